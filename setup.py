@@ -9,5 +9,6 @@ setup(
     author_email="beckettsimmons@hotmail.com",
     packages=["spittalpond"],
     install_requires=["requests"],
+    extras_require={"analytics": ["numpy"]},
     zip_safe=False
 )
@@ -0,0 +1,515 @@
+""" One-pass analytics of GUL results.
+
+A GulAnalytics takes the GUL rows (EVENT_ID, ITEM_ID, IDX, GUL) in batches,
+from the CSV while it downloads, from a CSV on disk or from a GUL table,
+and keeps only running results:
+
+    - the largest losses, sorted, and the count and sum of the losses above
+      a threshold (the large losses themselves can be passed on to a
+      GulWriter),
+    - a quantile sketch of the losses,
+    - the loss of every event and sample, from which the average annual
+      loss and the occurrence and aggregate exceedance probability (OEP,
+      AEP) curves are worked out.
+
+Memory use depends on the number of events and samples, not on the number
+of rows. Every batch is handled with vectorized NumPy operations, and two
+results can be merged, i.e. those of the shards of one portfolio.
+
+Rows with IDX 1 and up are samples; IDX 0 is the mean over the samples and
+is only used when a GUL has no sample rows.
+
+Example:
+
+    >>> analytics = spittal.run.get_gul_analytics(
+    ...     "spittalGUL", "my_data.csv", 3
+    ... )
+    >>> analytics.aal()
+    >>> analytics.return_period_losses([10, 100, 250], kind="aep")
+    >>> analytics.largest(10)
+"""
+import math
+
+from .spittalgul import GulCsvSink, GulTable, require_numpy, np
+from .spittalstream import DEFAULT_CHUNK_SIZE
+
+# The return periods in summary(), in years.
+RETURN_PERIODS = [2, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+class LossSketch(object):
+    """ A mergeable quantile sketch of non-negative losses.
+
+    Losses are counted into logarithmic buckets, so any quantile is known to
+    within the relative accuracy no matter how many losses are added, and
+    sketches with the same accuracy merge by adding their counts. Losses of
+    zero or less are counted apart.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        """ Initiating instance.
+
+        Args:
+            relative_accuracy (float, optional): the most a quantile may be
+                off by, as a fraction of its value.
+        """
+        require_numpy()
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # counts[i] is the bucket with index offset + i.
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.offset = 0
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _grow(self, low, high):
+        """ Makes room for the bucket indexes low to high. """
+        if not len(self.counts):
+            self.counts = np.zeros(high - low + 1, dtype=np.int64)
+            self.offset = low
+            return
+        new_low = min(low, self.offset)
+        new_high = max(high, self.offset + len(self.counts) - 1)
+        if new_low == self.offset and new_high - new_low + 1 == len(
+                self.counts):
+            return
+        counts = np.zeros(new_high - new_low + 1, dtype=np.int64)
+        start = self.offset - new_low
+        counts[start:start + len(self.counts)] = self.counts
+        self.counts = counts
+        self.offset = new_low
+
+    def _add_counts(self, offset, counts):
+        """ Adds bucket counts starting at the bucket index offset. """
+        if not len(counts):
+            return
+        self._grow(offset, offset + len(counts) - 1)
+        start = offset - self.offset
+        self.counts[start:start + len(counts)] += counts
+
+    def _update_totals(self, count, total, low, high):
+        self.count += count
+        self.total += total
+        if low is not None:
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+
+    def add(self, values):
+        """ Counts an array of losses. """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not len(values):
+            return
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        if len(positive):
+            indexes = np.ceil(np.log(positive) / self.log_gamma).astype(
+                np.int64
+            )
+            low = int(indexes.min())
+            self._add_counts(low, np.bincount(indexes - low))
+        self._update_totals(
+            len(values),
+            float(values.sum()),
+            float(values.min()),
+            float(values.max())
+        )
+
+    def merge(self, other):
+        """ Adds the counts of a sketch with the same accuracy. """
+        assert self.gamma == other.gamma, "Sketch accuracies differ"
+        self._add_counts(other.offset, other.counts)
+        self.zeros += other.zeros
+        self._update_totals(other.count, other.total, other.min, other.max)
+
+    def mean(self):
+        """ float: the mean of the losses, None if there are none. """
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def quantile(self, q):
+        """ Estimates a quantile.
+
+        Args:
+            q (float): the quantile, from 0 to 1, i.e. 0.99.
+
+        Returns:
+            float: the estimate, None if there are no losses.
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return min(self.min, 0.0)
+        cumulative = np.cumsum(self.counts) + self.zeros
+        i = int(np.searchsorted(cumulative, rank, side="right"))
+        i = min(i, len(self.counts) - 1)
+        value = 2 * self.gamma ** (self.offset + i) / (self.gamma + 1)
+        return min(max(value, self.min), self.max)
+
+    def to_dict(self):
+        """ dict: the sketch as plain data, i.e. for json.dump(). """
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'offset': self.offset,
+            'counts': self.counts.tolist(),
+            'zeros': self.zeros,
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Returns the sketch that to_dict() gave data for. """
+        sketch = cls(data['relative_accuracy'])
+        sketch.offset = data['offset']
+        sketch.counts = np.array(data['counts'], dtype=np.int64)
+        sketch.zeros = data['zeros']
+        sketch.count = data['count']
+        sketch.total = data['total']
+        sketch.min = data['min']
+        sketch.max = data['max']
+        return sketch
+
+class GulAnalytics(GulCsvSink):
+    """ Analyses GUL rows in one pass, see the module's description.
+
+    Being a GulCsvSink, it can be handed to download_file_to() to analyse
+    a GUL while it downloads. Use write_rows() for parsed rows, or
+    analyse_gul_csv() and analyse_gul_table().
+
+    Periods: a GUL only has event IDs. Pass event_years to group the events
+    into years; otherwise each event is taken as a year of its own, so the
+    OEP and AEP curves are the same.
+    """
+
+    def __init__(self, threshold=10.0, top=100, event_years=None,
+                 years=None, samples=None, large_losses=None,
+                 relative_accuracy=0.01):
+        """ Initiating instance.
+
+        Args:
+            threshold (float, optional): losses above this are large losses.
+            top (int, optional): number of largest losses to keep.
+            event_years (dict or list, optional): year of each event ID,
+                years count from 1.
+            years (int, optional): years the events cover, for the AAL and
+                the exceedance probabilities. The last year of event_years,
+                or else the number of events with a loss, by default.
+            samples (int, optional): samples per event and item. The
+                highest IDX seen by default, which is too low if no row of
+                the last sample is above the GUL's loss threshold.
+            large_losses (GulCsvSink, optional): sink that gets the rows of
+                the large losses, i.e. a GulWriter.
+            relative_accuracy (float, optional): of the quantile sketch.
+        """
+        super(GulAnalytics, self).__init__()
+        self.threshold = threshold
+        self.top = top
+        self.event_years = event_years
+        self.years = years
+        self.samples = samples
+        self.large_losses = large_losses
+        self.rows = 0
+        self.large_count = 0
+        self.large_total = 0.0
+        self.sketch = LossSketch(relative_accuracy)
+        self.largest_rows = np.zeros((0, 4), dtype=np.float64)
+        # Loss by event ID and IDX, grown as higher ones turn up.
+        self.event_losses = np.zeros((0, 0), dtype=np.float64)
+
+    def _grow_event_losses(self, events, columns):
+        """ Makes room for event IDs below events and IDX below columns. """
+        old_events, old_columns = self.event_losses.shape
+        if events <= old_events and columns <= old_columns:
+            return
+        grown = np.zeros(
+            (max(events, old_events), max(columns, old_columns)),
+            dtype=np.float64
+        )
+        grown[:old_events, :old_columns] = self.event_losses
+        self.event_losses = grown
+
+    def _add_event_losses(self, offset, losses):
+        """ Adds a block of event losses starting at the event ID offset. """
+        events, columns = losses.shape
+        self._grow_event_losses(offset + events, columns)
+        self.event_losses[offset:offset + events, :columns] += losses
+
+    def _keep_largest(self, rows):
+        """ Keeps the top rows with the largest losses of rows and those
+        kept so far. """
+        if not self.top or not len(rows):
+            return
+        if len(self.largest_rows) >= self.top:
+            rows = rows[rows[:, 3] > self.largest_rows[:, 3].min()]
+        rows = np.concatenate([self.largest_rows, rows])
+        if len(rows) > self.top:
+            keep = np.argpartition(-rows[:, 3], self.top - 1)[:self.top]
+            rows = rows[keep]
+        self.largest_rows = rows
+
+    def write_rows(self, rows):
+        """ Adds an (n, 4) array of EVENT_ID, ITEM_ID, IDX, GUL rows. """
+        if not len(rows):
+            return
+        losses = rows[:, 3]
+        self.rows += len(rows)
+        self.sketch.add(losses)
+
+        large = losses > self.threshold
+        self.large_count += int(large.sum())
+        self.large_total += float(losses[large].sum())
+        if self.large_losses is not None and large.any():
+            self.large_losses.write_rows(rows[large])
+        self._keep_largest(rows)
+
+        # GULs are written event by event, so a batch covers a narrow range
+        # of event IDs and is summed in a small block.
+        event_ids = rows[:, 0].astype(np.int64)
+        indexes = rows[:, 2].astype(np.int64)
+        if event_ids.min() < 0 or indexes.min() < 0:
+            raise ValueError("Negative EVENT_ID or IDX in GUL rows")
+        first = int(event_ids.min())
+        events = int(event_ids.max()) - first + 1
+        columns = int(indexes.max()) + 1
+        block = np.bincount(
+            (event_ids - first) * columns + indexes,
+            weights=losses,
+            minlength=events * columns
+        )
+        self._add_event_losses(first, block.reshape(events, columns))
+
+    def merge(self, other):
+        """ Adds the results of another GulAnalytics, i.e. of another shard
+        of the same portfolio. The threshold and top of self are kept. """
+        other_losses = other.event_losses
+        if other_losses.size:
+            self._add_event_losses(0, other_losses)
+        self.rows += other.rows
+        self.large_count += other.large_count
+        self.large_total += other.large_total
+        self.sketch.merge(other.sketch)
+        self._keep_largest(other.largest_rows)
+
+    def sample_losses(self):
+        """ Returns the loss of each event ID (row) and sample (column).
+
+        Falls back to the IDX 0 mean, as a single sample, for a GUL without
+        sample rows.
+        """
+        samples = self.samples
+        if samples is None:
+            samples = max(self.event_losses.shape[1] - 1, 0)
+        if not samples:
+            return self.event_losses[:, :1]
+        losses = self.event_losses[:, 1:samples + 1]
+        if losses.shape[1] < samples:
+            # Samples with no row above the GUL's threshold have no loss.
+            losses = np.hstack([
+                losses,
+                np.zeros((len(losses), samples - losses.shape[1]))
+            ])
+        return losses
+
+    def event_count(self):
+        """ int: the number of events with a loss. """
+        return int((self.event_losses.sum(axis=1) > 0).sum())
+
+    def year_count(self):
+        """ int: the years the events cover, see __init__(). """
+        if self.years is not None:
+            return self.years
+        if self.event_years is not None:
+            return int(self._year_lookup().max())
+        return self.event_count()
+
+    def _year_lookup(self):
+        """ Returns an array of the year of each event ID, 0 if unknown. """
+        if isinstance(self.event_years, dict):
+            lookup = np.zeros(max(self.event_years) + 1, dtype=np.int64)
+            for event_id, year in self.event_years.items():
+                lookup[event_id] = year
+            return lookup
+        return np.asarray(self.event_years, dtype=np.int64)
+
+    def period_losses(self, kind="oep"):
+        """ Returns the loss of each period with a loss, for each sample.
+
+        Args:
+            kind (str, optional): 'oep' for the largest event loss of each
+                period, 'aep' for the sum of them.
+
+        Returns:
+            numpy.ndarray: (periods, samples) array of losses.
+        """
+        if kind not in ("oep", "aep"):
+            raise ValueError("kind must be 'oep' or 'aep', not " + kind)
+        losses = self.sample_losses()
+        has_loss = losses.sum(axis=1) > 0
+        if self.event_years is None:
+            return losses[has_loss]
+        lookup = self._year_lookup()
+        event_ids = np.nonzero(has_loss)[0]
+        if event_ids.max() >= len(lookup) or not lookup[event_ids].all():
+            raise ValueError("An event with a loss has no year")
+        years = lookup[event_ids]
+        losses = losses[has_loss]
+        periods = np.zeros((int(years.max()) + 1, losses.shape[1]))
+        if kind == "oep":
+            np.maximum.at(periods, years, losses)
+        else:
+            np.add.at(periods, years, losses)
+        return periods[periods.sum(axis=1) > 0]
+
+    def ep_curve(self, kind="oep"):
+        """ Returns the exceedance probability curve.
+
+        Every period and sample is one outcome, out of years x samples.
+
+        Args:
+            kind (str, optional): 'oep' or 'aep', see period_losses().
+
+        Returns:
+            tuple: the losses, largest first, and the probability of a
+            year's loss being at least each of them.
+        """
+        losses = self.period_losses(kind)
+        outcomes = self.year_count() * max(losses.shape[1], 1)
+        losses = np.sort(losses[losses > 0])[::-1]
+        probabilities = np.arange(1, len(losses) + 1) / float(outcomes)
+        return losses, probabilities
+
+    def return_period_losses(self, return_periods=None, kind="oep"):
+        """ Returns the loss for each return period, read off ep_curve().
+
+        Args:
+            return_periods (list, optional): in years, RETURN_PERIODS by
+                default.
+            kind (str, optional): 'oep' or 'aep'.
+
+        Returns:
+            list: (return period, loss) tuples, the loss is 0 for return
+            periods beyond the losses seen.
+        """
+        if return_periods is None:
+            return_periods = RETURN_PERIODS
+        losses, probabilities = self.ep_curve(kind)
+        result = []
+        for period in return_periods:
+            i = np.searchsorted(probabilities, 1.0 / period, side="right")
+            loss = float(losses[i - 1]) if i else 0.0
+            result.append((period, loss))
+        return result
+
+    def aal(self):
+        """ float: the average annual loss, the mean over samples of the
+        total loss, over the years. """
+        losses = self.sample_losses()
+        years = self.year_count()
+        if not losses.size or not years:
+            return 0.0
+        return float(losses.sum()) / losses.shape[1] / years
+
+    def largest(self, n=None):
+        """ Returns the largest losses kept, largest first.
+
+        Args:
+            n (int, optional): how many, all that are kept by default.
+
+        Returns:
+            numpy.ndarray: structured array of event_id, item_id, idx, gul.
+        """
+        rows = self.largest_rows[np.argsort(-self.largest_rows[:, 3],
+                                            kind="mergesort")][:n]
+        result = np.empty(len(rows), dtype=[
+            ("event_id", "<i4"),
+            ("item_id", "<i4"),
+            ("idx", "<i4"),
+            ("gul", "<f8"),
+        ])
+        for i, name in enumerate(result.dtype.names):
+            result[name] = rows[:, i]
+        return result
+
+    def quantile(self, q):
+        """ Estimates a quantile of the row losses, see LossSketch. """
+        return self.sketch.quantile(q)
+
+    def summary(self, return_periods=None):
+        """ Returns the results as plain data.
+
+        Returns:
+            dict: rows, events, years, samples, total, mean, max, p50, p90,
+            p99, AAL, the large losses' threshold, count and total, and the
+            OEP and AEP losses by return period.
+        """
+        samples = self.sample_losses().shape[1]
+        return {
+            'rows': self.rows,
+            'events': self.event_count(),
+            'years': self.year_count(),
+            'samples': samples,
+            'total': self.sketch.total,
+            'mean': self.sketch.mean(),
+            'max': self.sketch.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'aal': self.aal(),
+            'threshold': self.threshold,
+            'large_count': self.large_count,
+            'large_total': self.large_total,
+            'oep': self.return_period_losses(return_periods, "oep"),
+            'aep': self.return_period_losses(return_periods, "aep"),
+        }
+
+def analyse_gul_csv(source, chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+    """ Analyses a GUL CSV file in chunks.
+
+    Args:
+        source (str or file): path of the CSV, or a binary file object.
+        chunk_size (int, optional): bytes to read at a time.
+        **kwargs: passed on to GulAnalytics.
+
+    Returns:
+        GulAnalytics: the results.
+    """
+    analytics = GulAnalytics(**kwargs)
+    f = source
+    if not hasattr(source, 'read'):
+        f = open(source, "rb")
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            analytics.write(chunk)
+    finally:
+        if f is not source:
+            f.close()
+    analytics.close()
+    return analytics
+
+def analyse_gul_table(table, batch_rows=1 << 20, **kwargs):
+    """ Analyses a GUL table in batches of rows.
+
+    Args:
+        table (GulTable or str): the table, or its directory.
+        batch_rows (int, optional): rows to handle at a time.
+        **kwargs: passed on to GulAnalytics.
+
+    Returns:
+        GulAnalytics: the results.
+    """
+    if not isinstance(table, GulTable):
+        table = GulTable(table)
+    analytics = GulAnalytics(**kwargs)
+    for rows in table.iter_rows(batch_rows):
+        analytics.write_rows(rows)
+    return analytics
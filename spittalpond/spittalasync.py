@@ -0,0 +1,365 @@
+""" asyncio versions of the spittalpond classes.
+
+Python 3 only. Every endpoint method of the async classes is a coroutine,
+and waiting on jobs sleeps on the event loop rather than in a thread, so one
+loop can drive many uploads, job polls and runs at once:
+
+    >>> spit = AsyncSpittalPond("http://127.0.0.1:8000", "root")
+    >>> await spit.do_login("password")
+    >>> await asyncio.gather(
+    ...     spit.model.do_job("version_vuln"),
+    ...     spit.model.do_job("version_hazfp"),
+    ... )
+
+The HTTP requests themselves are made by the blocking classes on an
+executor, through the same pooled SpittalTransport.
+"""
+import asyncio
+import functools
+import logging
+
+from .spittalbase import SpittalBase
+from .spittalmodel import SpittalModel
+from .spittalexposure import SpittalExposure
+from .spittalrun import SpittalRun
+from .spittaltransport import SpittalTransport
+from .spittalstream import DEFAULT_CHUNK_SIZE
+from .spittalpoll import poll_schedule, first_wait
+from .spittalmetrics import RequestMetrics
+from .spittaltiming import JobTimings
+
+logger = logging.getLogger('spittalpond')
+
+class AsyncSpittalBase(object):
+    """ Async front for a SpittalBase.
+
+    Methods that are not defined here are looked up on the wrapped blocking
+    instance (self.sync) and, if they are public methods, are returned as
+    coroutines that run on the executor. So `await create_dict(...)`,
+    `await create_benchmark(...)` and so on all work as expected.
+    """
+
+    sync_class = SpittalBase
+
+    def __init__(self, base_url, pub_user, transport=None, executor=None,
+                 **pool_kwargs):
+        """ Initiating instance.
+
+        Args:
+            base_url (str): server's domain name and/or port (without final slash).
+            pub_usr (str): the public user used to name certain things.
+            transport (SpittalTransport, optional): an existing transport to
+                share with other instances.
+            executor (concurrent.futures.Executor, optional): where blocking
+                requests run. The loop's default executor if not given.
+            **pool_kwargs: connection pool settings for a newly created
+                SpittalTransport.
+        """
+        self.sync = self.sync_class(
+            base_url, pub_user, transport, **pool_kwargs
+        )
+        self.executor = executor
+
+    @property
+    def data_dict(self):
+        """ dict: the data_dict of the wrapped instance. """
+        return self.sync.data_dict
+
+    def __getattr__(self, name):
+        attr = getattr(self.sync, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def run_blocking(*args, **kwargs):
+            return await self._run(attr, *args, **kwargs)
+        return run_blocking
+
+    async def _run(self, func, *args, **kwargs):
+        """ Runs a blocking callable on the executor. """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            functools.partial(func, *args, **kwargs)
+        )
+
+    async def do_request(self, url, in_data=None, in_file_dict=None,
+                         headers=None, stream=False, timeout=None,
+                         expect_json=False):
+        """ Awaitable SpittalBase.do_request(). """
+        return await self._run(
+            self.sync.do_request, url, in_data, in_file_dict, headers, stream,
+            timeout, expect_json
+        )
+
+    async def do_login(self, password):
+        """ Awaitable SpittalBase.do_login(). """
+        return await self._run(self.sync.do_login, password)
+
+    async def check_status(self, job_id, config_id=1):
+        """ Awaitable SpittalBase.check_status(). """
+        return await self._run(self.sync.check_status, job_id, config_id)
+
+    async def do_task(self, task_type, upload_id, sys_config=1,
+                      policy=None, input_bytes=None, timeout=None):
+        """ Awaitable SpittalBase.do_task(). """
+        return await self._run(
+            self.sync.do_task, task_type, upload_id, sys_config, policy,
+            input_bytes, timeout
+        )
+
+    async def wait_until_done(self, job_id, config_id=1,
+                              wait_time=5, max_iters=50, init_wait_time=0,
+                              policy=None, timeout=None):
+        """ Waits until the specified job is complete.
+
+        Same as SpittalBase.wait_until_done() except that the waits between
+        polls are asyncio sleeps, so no thread is held while waiting.
+
+        Args:
+            job_id (int): ID of the job to wait for.
+            config_id (int, optional): config that the job was created with.
+            wait_time (int, optional): seconds to wait between each check.
+            max_iters (int, optional): max iterations before raising exception.
+            init_wait_time (int, optional): seconds to initially wait.
+            policy (optional): how long to wait between checks.
+            timeout (float, optional): seconds of wall-clock time to wait
+                for, replacing max_iters.
+        """
+        policy = self.sync.job_policy([job_id], policy, wait_time)
+        schedule = poll_schedule(policy, timeout, max_iters)
+        await asyncio.sleep(max(init_wait_time, first_wait(policy, timeout)))
+        while True:
+            resp = await self.check_status(job_id, config_id)
+            if self.sync.is_job_done(job_id, resp):
+                await self._run(self.sync.mark_job_done, job_id)
+                return
+            wait = next(schedule, None)
+            if wait is None:
+                raise Exception(
+                    "Task Load Timeout!\nTry setting a longer wait time"
+                )
+            await asyncio.sleep(wait)
+
+    async def wait_all(self, job_ids, config_id=1, wait_time=5, max_iters=50,
+                       policy=None, timeout=None):
+        """ Awaitable SpittalBase.wait_all().
+
+        Each round checks the status of all still running jobs concurrently.
+        """
+        await self._wait_jobs(
+            job_ids, config_id, wait_time, max_iters, policy, timeout,
+            wait_for_all=True
+        )
+
+    async def wait_any(self, job_ids, config_id=1, wait_time=5, max_iters=50,
+                       policy=None, timeout=None):
+        """ Awaitable SpittalBase.wait_any(). """
+        done = await self._wait_jobs(
+            job_ids, config_id, wait_time, max_iters, policy, timeout,
+            wait_for_all=False
+        )
+        return done[0]
+
+    async def _wait_jobs(self, job_ids, config_id, wait_time, max_iters,
+                         policy, timeout, wait_for_all):
+        """ Polls the jobs round-robin for wait_all() and wait_any(). """
+        policy = self.sync.job_policy(job_ids, policy, wait_time)
+        schedule = poll_schedule(policy, timeout, max_iters)
+        await asyncio.sleep(first_wait(policy, timeout))
+        pending = list(job_ids)
+        done = []
+        while pending:
+            resps = await asyncio.gather(*[
+                self.check_status(job_id, config_id) for job_id in pending
+            ])
+            for job_id, resp in zip(list(pending), resps):
+                if self.sync.is_job_done(job_id, resp):
+                    await self._run(self.sync.mark_job_done, job_id)
+                    pending.remove(job_id)
+                    done.append(job_id)
+            if done and not wait_for_all:
+                break
+            if not pending:
+                break
+            wait = next(schedule, None)
+            if wait is None:
+                raise Exception(
+                    "Task Load Timeout!\nTry setting a longer wait time"
+                )
+            await asyncio.sleep(wait)
+        return done
+
+    async def load_models(self, wait=False, config_id=1, policy=None,
+                          timeout=None):
+        """ Awaitable SpittalBase.load_models(). """
+        job_ids = await self._run(
+            self.sync.load_models,
+            config_id=config_id
+        )
+        if wait:
+            await self.wait_all(
+                job_ids,
+                config_id=config_id,
+                policy=policy,
+                timeout=timeout
+            )
+        return job_ids
+
+    async def queue_task(self, task_name, policy=None, timeout=None):
+        """ Awaitable SpittalBase.queue_task(). """
+        return await self._run(
+            self.sync.queue_task, task_name, policy, timeout
+        )
+
+    async def do_job(self, task_name, wait_time=2, max_iters=100,
+                     policy=None, timeout=None):
+        """ Wait until the job has been done on the job queue.
+
+        Reuses an earlier job when resuming, see SpittalBase.do_job().
+        """
+        job_state = await self._run(self.sync.reusable_job, task_name)
+        if job_state == 'done':
+            return
+        if job_state is None:
+            await self.queue_task(task_name)
+        await self.wait_until_done(
+            self.data_dict[task_name]['job_id'],
+            wait_time=wait_time,
+            max_iters=max_iters,
+            policy=policy,
+            timeout=timeout
+        )
+
+    async def do_jobs(self, job_list, wait_time=2, max_iters=100,
+                      policy=None, timeout=None, parallel=False):
+        """ Do all dependant jobs in the given list.
+
+        With parallel set the jobs are queued at once and waited on
+        together, see SpittalBase.do_jobs().
+        """
+        if parallel:
+            job_ids = []
+            for task_name in job_list:
+                job_state = await self._run(self.sync.reusable_job, task_name)
+                if job_state == 'done':
+                    continue
+                if job_state is None:
+                    await self.queue_task(task_name)
+                job_ids.append(self.data_dict[task_name]['job_id'])
+            await self.wait_all(
+                job_ids,
+                wait_time=wait_time,
+                max_iters=max_iters,
+                policy=policy,
+                timeout=timeout
+            )
+            return
+
+        for task_name in job_list:
+            await self.do_job(
+                task_name,
+                wait_time=wait_time,
+                max_iters=max_iters,
+                policy=policy,
+                timeout=timeout
+            )
+
+class AsyncSpittalModel(AsyncSpittalBase):
+    """ Async front for a SpittalModel. """
+
+    sync_class = SpittalModel
+
+class AsyncSpittalExposure(AsyncSpittalBase):
+    """ Async front for a SpittalExposure. """
+
+    sync_class = SpittalExposure
+
+class AsyncSpittalRun(AsyncSpittalBase):
+    """ Async front for a SpittalRun. """
+
+    sync_class = SpittalRun
+
+    async def auto_create_random_numbers(self,
+                                         random_number_table_name="rand_nums",
+                                         number_of_chunks=10,
+                                         number_of_rows_per_chunk=1000,
+                                         number_of_pages=10,
+                                         number_of_samples_per_page=20,
+                                         policy=None):
+        """ Awaitable SpittalRun.auto_create_random_numbers(). """
+        logger.info("Auto-creating random numbers.")
+        await self._run(
+            self.sync.create_default_random_instance,
+            random_number_table_name,
+            number_of_chunks,
+            number_of_rows_per_chunk,
+            number_of_pages,
+            number_of_samples_per_page
+        )
+        await self.do_jobs(["version_random", "random_instance"],
+                           policy=policy)
+
+    async def get_gul_data(self, gul_name, filename, module_supplier_id,
+                           target=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                           progress_callback=None, policy=None):
+        """ Awaitable SpittalRun.get_gul_data(). """
+        await self._run(
+            self.sync.publish_gul, gul_name, filename, module_supplier_id
+        )
+        if not self.data_dict['kernel_pubgul'].get('saved'):
+            await self.do_jobs(
+                ['kernel_cdf', 'kernel_cdfsamples', 'kernel_gul',
+                 'kernel_pubgul'],
+                wait_time=1,
+                policy=policy
+            )
+            await self._run(self.sync.save_pub_gul)
+        await self.do_jobs(["kernel_pubgul"], wait_time=1, policy=policy)
+        return await self._run(
+            self.sync.download_gul, target, chunk_size, progress_callback
+        )
+
+class AsyncSpittalPond(object):
+    """ asyncio interface to the Oasis Django API.
+
+    Like SpittalPond, the model, exposure and run facades share a single
+    transport, so they share one login and one connection pool.
+    """
+
+    def __init__(self, base_url, user, executor=None, **pool_kwargs):
+        """ Initiate with server URL and user.
+
+        Args:
+            base_url (str): The URL of the Django server. Be sure to prepend
+                the protocol (i.e. http://) and append the port (i.e. :8000).
+            user (str): Username to use on the server.
+            executor (concurrent.futures.Executor, optional): where blocking
+                requests run. The loop's default executor if not given.
+            **pool_kwargs: connection pool settings for the shared
+                SpittalTransport.
+        """
+        self.transport = SpittalTransport(base_url, user, **pool_kwargs)
+        self.metrics = RequestMetrics()
+        self.transport.add_hook(self.metrics)
+        self.job_timings = JobTimings()
+        self.model = AsyncSpittalModel(
+            base_url, user, self.transport, executor,
+            job_timings=self.job_timings
+        )
+        self.exposure = AsyncSpittalExposure(
+            base_url, user, self.transport, executor,
+            job_timings=self.job_timings
+        )
+        self.run = AsyncSpittalRun(
+            base_url, user, self.transport, executor,
+            job_timings=self.job_timings
+        )
+
+    async def do_login(self, password):
+        """ Logs the shared transport into the Oasis Django mid-tier. """
+        return await self.model.do_login(password)
+
+    def close(self):
+        """ Closes all pooled connections of the shared transport. """
+        self.transport.close()
@@ -1,13 +1,87 @@
+from .spittaltransport import SpittalTransport
+from .spittalstream import MultipartFileStream, DEFAULT_CHUNK_SIZE
+from .spittalstream import IncompleteDownloadError
+from .spittalstream import CountingSink, copy_response, expected_length
+from .spittalpoll import FixedPolling, BackoffPolling, ExpectedPolling
+from .spittalpoll import poll_schedule, first_wait
+from .spittalcache import file_hash
+from .spittaltiming import JobTimings
+from .spittalfuture import JobHandle
+from .spittalvalidate import validate_directories
 import requests
 import json
 import glob
 import time
 import os
 import logging
+import threading
+import uuid
+from multiprocessing.pool import ThreadPool
 
 logger = logging.getLogger('spittalpond')
 
-class SpittalBase():
+# Forks of one instance may be made from several threads at once.
+_run_id_lock = threading.Lock()
+
+class SpittalUploadError(Exception):
+    """ Raised when one or more files of a directory failed to upload.
+
+    Attributes:
+        failures (dict): the exception raised for each failed file path.
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        Exception.__init__(
+            self,
+            "Failed to upload {num} file(s): {paths}".format(
+                num=len(failures),
+                paths=", ".join(sorted(failures))
+            )
+        )
+
+class SpittalJobError(Exception):
+    """ Raised when a job on the server's job queue has FAILED.
+
+    Attributes:
+        job_id (int): ID of the failed job.
+    """
+
+    def __init__(self, job_id, message):
+        self.job_id = job_id
+        Exception.__init__(self, message)
+
+def map_isolated(func, items, workers=1):
+    """ Calls func on each item, on a pool of threads if workers > 1.
+
+    An exception raised for one item does not stop the others.
+
+    Args:
+        func (callable): called with each item.
+        items (list): the items.
+        workers (int, optional): calls to make at once.
+
+    Returns:
+        list: a (result, None) or (None, exception) tuple for each item,
+        in the order of items.
+    """
+    def call(item):
+        try:
+            return func(item), None
+        except Exception as exc:
+            return None, exc
+
+    items = list(items)
+    if workers > 1 and len(items) > 1:
+        pool = ThreadPool(min(workers, len(items)))
+        try:
+            return pool.map(call, items)
+        finally:
+            pool.close()
+            pool.join()
+    return [call(item) for item in items]
+
+class SpittalBase(object):
     """ A base class that contains generic spittal functions
 
     Classes such as SpittalModel and SpittalExposures will import this one.
@@ -42,77 +116,178 @@ class SpittalBase():
         "kernel_cdfsamples":"CDFSamples",
         "kernel_gul":"GUL",
         "kernel_pubgul": "PubGUL",
+        "benchmark": "Benchmark",
     }
 
-    def __init__(self, base_url, pub_user):
+    def __init__(self, base_url, pub_user, transport=None, upload_cache=None,
+                 journal=None, journal_name=None, job_timings=None,
+                 **pool_kwargs):
         """ Initiating instance.
 
         Args:
             base_url (str): server's domain name and/or port (without final slash).
             pub_usr (str): the public user used to name certain things.
+            transport (SpittalTransport, optional): an existing (possibly
+                already logged in) transport to share with other instances.
+                A new one is created if not given.
+            upload_cache (UploadCache, optional): manifest of files already
+                uploaded, see spittalcache. Unchanged files are then not
+                uploaded, created and loaded again.
+            journal (SpittalJournal, optional): where to checkpoint the
+                data_dict after every state transition, see resume().
+            journal_name (str, optional): the name this instance's state is
+                kept under in the journal. Defaults to the class name.
+            job_timings (JobTimings, optional): where the timing of every
+                job is recorded, see spittaltiming. A new one by default.
+            **pool_kwargs: connection pool settings passed on to a newly
+                created SpittalTransport (pool_connections, pool_maxsize,
+                pool_block, keep_alive, timeout and retry_policy).
         """
         self.base_url = base_url
         self.pub_user = pub_user
-        self.is_logged_in = False
-        self.cookies = None
+        if transport is None:
+            transport = SpittalTransport(base_url, pub_user, **pool_kwargs)
+        self.transport = transport
+        self.upload_cache = upload_cache
+        self.journal = journal
+        self.journal_name = journal_name or self.__class__.__name__
+        if job_timings is None:
+            job_timings = JobTimings()
+        self.job_timings = job_timings
         # Each instance with have it's own data_dict
         self.data_dict = {}
+        # Guards the data_dict against the job poller thread, which marks
+        # jobs done and checkpoints while the steps go on.
+        self.lock = threading.RLock()
+        # Set by resume(), only then is journaled state reused.
+        self.resuming = False
+        # Names this instance's run in the journal, see fork().
+        self.run_id = None
+
+    @property
+    def resumable(self):
+        """ bool: whether earlier structures and jobs may be reused. """
+        return self.upload_cache is not None or self.resuming
+
+    def checkpoint(self):
+        """ Saves the data_dict to the journal, if there is one. """
+        if self.journal is not None:
+            with self.lock:
+                self.journal.save(self.journal_name, self.snapshot())
+
+    def snapshot(self):
+        """ Returns a copy of the data_dict and of each of its entries.
+
+        Unlike the data_dict itself, the copy can be read while other
+        threads add entries or fields.
+        """
+        with self.lock:
+            return dict(
+                (name, dict(entry) if isinstance(entry, dict) else entry)
+                for name, entry in list(self.data_dict.items())
+            )
+
+    def resume(self):
+        """ Restores the data_dict from the journal's last checkpoint.
+
+        Running the same steps again afterwards skips the uploads,
+        structures and jobs that were already done.
 
-    def do_request(self, url, in_data=None, in_file_dict=None):
-        """ Makes a post request.
+        Returns:
+            dict: the restored data_dict.
+        """
+        with self.lock:
+            self.data_dict = self.journal.load(self.journal_name)
+        self.resuming = True
+        self.run_id = self.journal.run_id(self.journal_name)
+        logger.info("Resumed {name} from journal: {keys}".format(
+            name=self.journal_name,
+            keys=sorted(self.data_dict)
+        ))
+        return self.data_dict
 
-        Also automatically passes self.cookies to the post request.
-        This authenticates each request.
+    def fork(self, name):
+        """ Returns a new instance of this class for one of several runs.
+
+        The fork shares this instance's transport, upload cache, journal and
+        job timings, and has a data_dict of its own. That is kept in the
+        journal under this instance's name, its run_id and the fork's name,
+        so forks of a later run never see it. It is only restored when this
+        instance was resumed, so forks resume with it.
+
+        Args:
+            name (str): name of the run.
+        """
+        with _run_id_lock:
+            if self.run_id is None:
+                self.run_id = uuid.uuid4().hex[:12]
+                if self.journal is not None:
+                    self.journal.set_run_id(self.journal_name, self.run_id)
+        fork = self.__class__(
+            self.base_url,
+            self.pub_user,
+            self.transport,
+            self.upload_cache,
+            self.journal,
+            "/".join([self.journal_name, self.run_id, name]),
+            job_timings=self.job_timings
+        )
+        if self.journal is not None and self.resuming:
+            fork.resume()
+        return fork
+
+    @property
+    def session(self):
+        """ requests.Session: the pooled session of the transport. """
+        return self.transport.session
+
+    @property
+    def cookies(self):
+        """ dict: the login session cookie, None until logged in. """
+        return self.transport.cookies
+
+    @property
+    def is_logged_in(self):
+        """ bool: whether the shared transport has been logged in. """
+        return self.transport.is_logged_in
+
+    def close(self):
+        """ Closes all pooled connections held by the transport. """
+        self.transport.close()
+
+    def do_request(self, url, in_data=None, in_file_dict=None, headers=None,
+                   stream=False, timeout=None, expect_json=False):
+        """ Makes a post request through the transport.
+
+        See SpittalTransport.do_request() for details.
 
         Args:
             url (str): the url to make a post request to. Ensureu that you
                 specify a schema i.e. http://, ftp:// etc...
             in_data (dict): optional, used if data needs to be passed.
             in_file_dict (dict): optional, passes file dict to server.
+            headers (dict): optional, extra headers for this request.
+            stream (bool): optional, leave the response body unread.
+            timeout (tuple or float): optional, overrides the transport's.
+            expect_json (bool): optional, treat a body that is not JSON as a
+                failure.
 
         Returns:
             HttpResponse: server's response
         """
-        url_string=url
-        logger.debug(
-            "do_request request string: {string}".format(string=url_string)
+        return self.transport.do_request(
+            url, in_data, in_file_dict, headers, stream, timeout, expect_json
         )
-        response=requests.post(
-            url_string,
-            data=in_data,
-            files=in_file_dict,
-            cookies=self.cookies  #For Authentication!
-        )
-        return response
 
     def do_login(self, password):
-        """ Logs into Oasis Django mid-tier.
+        """ Logs the transport into the Oasis Django mid-tier.
 
-        Also, set self.cookies to the return session ID.
-        This allows for future authentication.
+        Instances sharing the transport are all logged in by this one call.
 
         Args:
             password (str): server Djanger user password.
         """
-        # Creating JSON string with authentication credentails.
-        in_data = ('{{ "username":"{username}",'
-                    '"password":"{password}" }}'
-                    ).format(
-                    username=self.pub_user,
-                    password=password
-        )
-
-        url = self.base_url + "/oasis/login"
-        response = self.do_request(url, in_data)
-        json_response = json.loads(response.content)
-
-        if json_response["success"] == False:
-            print("Invalid user id or password")
-        else:
-            self.cookies = dict(sessionid=response.cookies['sessionid'])
-            print("You are logged into Mid-tier")
-
-        logger.info( 'Log in response ' + str(response.content))
+        self.transport.do_login(password)
 
     def create_file_upload(self, upload_filename,
                             pub_user, module_supplier_id):
@@ -170,37 +345,185 @@ class SpittalBase():
         down_id = int(json.loads(down_response.content)['taskId'])
         return down_id
 
-    def upload_file(self, local_absolute_filepath, upload_filename):
+    def upload_file(self, local_absolute_filepath, upload_filename,
+                    chunk_size=DEFAULT_CHUNK_SIZE, progress_callback=None):
         """ Uploads a file to the server.
 
         Uploads a local file that is renamed on the server side to
         the upload_filename argument.
 
+        The multipart body is streamed from disk chunk_size bytes at a time,
+        so memory use does not grow with the size of the file.
+
         Args:
             local_absolute_filepath (str): path to the file we need to upload.
             upload_filename (str): the name for the server-side file.
+            chunk_size (int, optional): bytes to read from disk at a time.
+            progress_callback (callable, optional): called as
+                progress_callback(bytes_sent, total_bytes, elapsed_seconds)
+                while the file is sent. See spittalstream.ProgressLogger.
 
         Returns:
             HttpResponse: server's response.
         """
         url = self.base_url + "/oasis/doTaskUploadFileHelper/"
 
-        with open(local_absolute_filepath) as f:
-            in_file = f
+        body = MultipartFileStream(
+            upload_filename,
+            local_absolute_filepath,
+            chunk_size=chunk_size,
+            progress_callback=progress_callback
+        )
+        try:
             response = self.do_request(
                 url,
-                in_file_dict={upload_filename:in_file}
+                in_data=body,
+                headers={'Content-Type': body.content_type}
             )
-            return response
+        finally:
+            body.close()
+        return response
+
+    def download_file(self, download_id, headers=None, stream=False):
+        """ Downloads a file from the server.
+
+        Unless stream is set the whole file ends up in the response's
+        content. Use download_file_to() for large files.
+
+        The file is asked for without content encoding, so its size and
+        byte ranges are those of the file itself.
+
+        Args:
+            download_id (int): the id returned from create_file_download().
+            headers (dict, optional): extra headers, i.e. a Range.
+            stream (bool, optional): leave the response body unread.
 
-    def download_file(self, download_id):
+        Returns:
+            HttpResponse: server's response.
+        """
+        headers = dict(headers or {})
+        headers.setdefault('Accept-Encoding', 'identity')
         response = self.do_request(
             self.base_url +
             "/oasis/doTaskDownloadFileHelper/" +
-            str(download_id) + "/"
+            str(download_id) + "/",
+            headers=headers,
+            stream=stream
         )
         return response
 
+    def download_file_to(self, download_id, target,
+                         chunk_size=DEFAULT_CHUNK_SIZE, resume=True,
+                         max_resumes=3, progress_callback=None):
+        """ Streams a file from the server to disk in fixed-size chunks.
+
+        Only chunk_size bytes are held in memory at a time. If target is a
+        path that already holds part of the file, or the connection drops
+        midway, the transfer is resumed with a Range request. Servers that
+        ignore the Range header send the whole file again, in which case a
+        target path is rewritten from the start.
+
+        Args:
+            download_id (int): the id returned from create_file_download().
+            target (str or file): path of the file to write, or any object
+                with a write() method (a sink is written to from its
+                current position and cannot be rewound).
+            chunk_size (int, optional): bytes to hold in memory at a time.
+            resume (bool, optional): continue from a partial target file.
+            max_resumes (int, optional): dropped connections to recover
+                from before giving up.
+            progress_callback (callable, optional): called as
+                progress_callback(bytes_done, total_bytes, elapsed_seconds).
+
+        Returns:
+            dict: the download's metadata; download_id, path, bytes,
+            expected_bytes, resumed_from and elapsed seconds.
+
+        Raises:
+            IncompleteDownloadError: if the byte count does not match the
+                size announced by the server.
+        """
+        is_path = not hasattr(target, 'write')
+        done = 0
+        if is_path and resume and os.path.exists(target):
+            done = os.path.getsize(target)
+        resumed_from = done
+        expected = None
+        attempts = 0
+        start_time = time.time()
+
+        while True:
+            headers = None
+            if done:
+                headers = {'Range': 'bytes={start}-'.format(start=done)}
+            response = self.download_file(download_id, headers, stream=True)
+
+            if done and response.status_code == 416:
+                # Nothing left to send, the partial file is already whole.
+                response.close()
+                expected = done
+                break
+            response.raise_for_status()
+            if done and response.status_code != 206:
+                # Range ignored, the whole file is coming again.
+                if not is_path:
+                    response.close()
+                    raise IncompleteDownloadError(done, expected)
+                done = 0
+                resumed_from = 0
+            expected = expected_length(response, done)
+
+            sink = target
+            if is_path:
+                sink = open(target, 'ab' if done else 'wb')
+            counter = CountingSink(
+                sink,
+                done=done,
+                total=expected,
+                progress_callback=progress_callback,
+                start_time=start_time
+            )
+            error = None
+            try:
+                copy_response(response, counter, chunk_size)
+            except requests.exceptions.RequestException as exc:
+                error = exc
+            finally:
+                done = counter.done
+                if is_path:
+                    sink.close()
+                response.close()
+
+            # Some connection drops just look like a short body.
+            if error is None and (expected is None or done >= expected):
+                break
+            attempts += 1
+            if attempts > max_resumes:
+                if error is not None:
+                    raise error
+                break
+            logger.warning(
+                "Download {id} dropped at {done} bytes, resuming: "
+                "{error}".format(id=download_id, done=done, error=error)
+            )
+
+        if expected is not None and done != expected:
+            raise IncompleteDownloadError(done, expected)
+
+        metadata = {
+            'download_id': download_id,
+            'path': target if is_path else None,
+            'bytes': done,
+            'expected_bytes': expected,
+            'resumed_from': resumed_from,
+            'elapsed': time.time() - start_time,
+        }
+        logger.info("Downloaded file {id}: {meta}".format(
+            id=download_id,
+            meta=metadata
+        ))
+        return metadata
+
 
     def create_timestamps(self):
         """ Create timestamp for destination files
@@ -225,29 +548,58 @@ class SpittalBase():
             self.base_url +
             "/oasis/statusAsync/" +
             str(config_id) + "/" +
-            str(job_id) + "/"
+            str(job_id) + "/",
+            expect_json=True
         )
         return response
 
-    def do_task(self, task_type, upload_id, sys_config=1):
+    def do_task(self, task_type, upload_id, sys_config=1, policy=None,
+                input_bytes=None, timeout=None):
         """ Creates a task on the job queue.
 
         Args:
             task_type (str): type of task to be added to the queue.
             upload_id (int): upload_id of the file to create task for.
             sys_config (int): defines where and how to load the data.
+            policy (optional): polling policy the handle watches the job
+                with, see JobHandle and job_policy().
+            input_bytes (int, optional): size of the job's input file, to
+                predict its duration by, see spittalhistory.
+            timeout (float, optional): seconds the handle watches the job
+                for before failing with a JobTimeoutError, see JobHandle.
 
         Returns:
-            HttpResponse: server's response.
+            JobHandle: the queued job, which also gives access to the
+            server's response. If no job was queued, the handle has failed
+            with a SpittalJobError.
 
         """
+        queued = time.time()
         response = self.do_request(
             self.base_url +
             "/oasis/doTask" + task_type + "/" +
             str(sys_config) + "/" +
             str(upload_id) + "/"
         )
-        return response
+        try:
+            job_id = json.loads(response.content)['JobId']
+        except (ValueError, KeyError, TypeError):
+            return JobHandle(
+                self, None, task_type, response, sys_config, policy,
+                error=SpittalJobError(
+                    None,
+                    "No {task} job queued, response: {resp}".format(
+                        task=task_type,
+                        resp=response.content
+                    )
+                )
+            )
+        self.job_timings.queued(job_id, task_type, queued, input_bytes)
+        return JobHandle(
+            self, job_id, task_type, response, sys_config,
+            self.job_policy([job_id], policy or BackoffPolling()),
+            timeout=timeout
+        )
 
     def create_dict(self, dict_type, upload_id, download_id,
                     pub_user, module_supplier_id):
@@ -276,7 +628,8 @@ class SpittalBase():
         return response
 
 
-    def upload_directory(self, directory_path, do_timestamps=True, pkey=1):
+    def upload_directory(self, directory_path, do_timestamps=True, pkey=1,
+                         workers=1, validate=False, name_prefix=""):
         """ Upload an entire directory of files.
 
         In order to achieve this I created a file naming convention.
@@ -298,18 +651,41 @@ class SpittalBase():
                do not have a config file to specify all of this.
                TODO: Create a config file to run everything automatically!
 
+        With more than one worker the files are uploaded concurrently, each
+        worker doing the create_file_upload(), create_file_download() and
+        upload_file() calls of one file. Either way the data_dict is only
+        updated once every file has been uploaded, in file name order.
+
         Args:
             directory_path (str): path to the directory to upload from.
             do_timestamps (bool): optional, timestamps files or not?
             module_supplier_id (int): overall module supplier for uploading.
             pkey (int): UNKNOWN
+            workers (int, optional): number of files to upload at once.
+            validate (bool or dict, optional): check the files' contents
+                before anything is uploaded, see spittalvalidate. Pass a
+                dict of FileSchema by type name to use other schemas.
+                Needs NumPy.
+            name_prefix (str, optional): put in front of the uploaded file
+                names, after the timestamp, i.e. to tell apart directories
+                of the same file names uploaded at the same time.
+
+        Raises:
+            SpittalUploadError: if any of the files failed to upload. The
+                data_dict is left untouched in that case.
+            SpittalValidationError: if validate is set and any of the files
+                failed their checks. Nothing is uploaded in that case.
         """
+        if validate:
+            schemas = validate if isinstance(validate, dict) else None
+            validate_directories(directory_path, schemas=schemas)
 
         # The data_dict stores all the information on uploaded files
         # and there respective structures.
         # TODO: Think of a better name for the data_dict.
-        files_to_upload = glob.glob(directory_path + "*")
+        files_to_upload = sorted(glob.glob(directory_path + "*"))
         timestamp = self.create_timestamps()
+        uploads = []
         # For all files in directory.
         for pathname in files_to_upload:
             filename = os.path.basename(pathname)
@@ -317,11 +693,13 @@ class SpittalBase():
             # Split the '.'s as well cause they are file extensions.
             # We just want to get the first two parts of the name.
             splitname = filename.replace(".", "_").split("_")
-            data_name = splitname[0] + "_" + splitname[1]
-            module_supplier_id = splitname[2]
 
             assert len(splitname) == 4,\
                 "Bad file name in folder: {filename}".format(filename=filename)
+
+            data_name = splitname[0] + "_" + splitname[1]
+            module_supplier_id = splitname[2]
+
             assert data_name in self.types.keys(),\
                     ("File type {filetype} does not have proper type format. "
                     "Are you sure you spelt it right?").format(
@@ -329,76 +707,359 @@ class SpittalBase():
                     )
 
             # Timestamp files if nessecary.
+            upload_filename = name_prefix + filename
             if do_timestamps:
-                upload_filename = timestamp + filename
-
+                upload_filename = timestamp + upload_filename
 
-            # Create the file upload and get ID.
-            up_id = self.create_file_upload(
-                upload_filename,
-                self.pub_user,
-                module_supplier_id
+            uploads.append(
+                (data_name, pathname, upload_filename, module_supplier_id)
             )
-            assert type(up_id) == int,\
-                "Bad upload ID response: Not an integer!"
 
-            # Create the file download and get ID.
-            down_id = self.create_file_download(
-                upload_filename,
-                self.pub_user,
+        results = map_isolated(
+            lambda upload: self._upload_one(*upload),
+            uploads,
+            workers
+        )
+
+        failures = {}
+        uploaded = {}
+        for (data_name, pathname, _, _), (entry, error) in zip(uploads,
+                                                                 results):
+            if error is not None:
+                logger.error("Upload of {path} failed: {error}".format(
+                    path=pathname,
+                    error=error
+                ))
+                failures[pathname] = error
+            else:
+                uploaded[data_name] = entry
+
+        if failures:
+            raise SpittalUploadError(failures)
+
+        # Save the data for later use.
+        # Update data_dict.
+        with self.lock:
+            self.data_dict.update(uploaded)
+            self.checkpoint()
+
+        print("Uploaded directory")
+
+    def _upload_one(self, data_name, pathname, upload_filename,
+                    module_supplier_id):
+        """ Uploads a single file of upload_directory().
+
+        A journaled upload is only reused when resuming, and only if the
+        file's content is still the same.
+
+        Returns:
+            dict: the file's data_dict entry.
+        """
+        content_hash = None
+        if self.journal is not None or self.upload_cache is not None:
+            content_hash = file_hash(pathname)
+        if self.journal is not None and self.resuming:
+            uploaded = self.journal.uploaded(self.journal_name, data_name)
+            if (uploaded is not None and
+                    uploaded['filepath'] == pathname and
+                    uploaded.get('content_hash') == content_hash):
+                logger.info("Resuming with upload {id} of {path}".format(
+                    id=uploaded['upload_id'],
+                    path=pathname
+                ))
+                return uploaded
+
+        entry = self._upload_or_reuse(
+            data_name, pathname, upload_filename, module_supplier_id,
+            content_hash
+        )
+        if self.journal is not None:
+            self.journal.record_upload(self.journal_name, data_name, entry)
+        return entry
+
+    def _upload_or_reuse(self, data_name, pathname, upload_filename,
+                         module_supplier_id, content_hash=None):
+        """ Uploads a file, unless the upload cache already has it.
+
+        Args:
+            content_hash (str, optional): the file's file_hash(), if known.
+
+        Returns:
+            dict: the file's data_dict entry.
+        """
+        if self.upload_cache is not None:
+            if content_hash is None:
+                content_hash = file_hash(pathname)
+            cached = self.upload_cache.lookup(
+                self.base_url,
+                content_hash,
                 module_supplier_id
             )
-            assert type(down_id) == int,\
-                "Bad download ID response: Not an integer!"
+            if cached is not None:
+                logger.info("Reusing upload {id} for {path}".format(
+                    id=cached['upload_id'],
+                    path=pathname
+                ))
+                cached.update({
+                    'filepath': pathname,
+                    'module_supplier_id': module_supplier_id,
+                    'content_hash': content_hash,
+                })
+                return dict(
+                    (key, value) for key, value in cached.items()
+                    if value is not None
+                )
 
-            # Actually upload the file to the server.
-            self.upload_file(
-                pathname,
-                upload_filename
+        # Create the file upload and get ID.
+        up_id = self.create_file_upload(
+            upload_filename,
+            self.pub_user,
+            module_supplier_id
+        )
+        assert type(up_id) == int,\
+            "Bad upload ID response: Not an integer!"
+
+        # Create the file download and get ID.
+        down_id = self.create_file_download(
+            upload_filename,
+            self.pub_user,
+            module_supplier_id
+        )
+        assert type(down_id) == int,\
+            "Bad download ID response: Not an integer!"
+
+        # Actually upload the file to the server.
+        self.upload_file(
+            pathname,
+            upload_filename
+        )
+
+        entry = {
+            'filepath': pathname,
+            'upload_name': upload_filename,
+            'upload_id': up_id,
+            'download_id': down_id,
+            'module_supplier_id': module_supplier_id,
+        }
+        if content_hash is not None:
+            entry['content_hash'] = content_hash
+        if self.upload_cache is not None:
+            self.upload_cache.record(
+                self.base_url,
+                content_hash,
+                module_supplier_id,
+                upload_name=upload_filename,
+                upload_id=up_id,
+                download_id=down_id
             )
+        return entry
 
-            # Save the data for later use.
-            # Update data_dict.
-            self.data_dict[data_name] = {
-                'filepath': pathname,
-                'upload_name': upload_filename,
-                'upload_id': up_id,
-                'download_id': down_id,
-                'module_supplier_id': module_supplier_id,
-            }
+    def cache_record(self, type_name, **fields):
+        """ Saves fields of a data_dict entry to the upload cache.
 
-        print("Uploaded directory")
+        Does nothing if there is no upload cache or the entry did not come
+        from an uploaded file.
+        """
+        entry = self.data_dict[type_name]
+        if self.upload_cache is None or 'content_hash' not in entry:
+            return
+        self.upload_cache.record(
+            self.base_url,
+            entry['content_hash'],
+            entry['module_supplier_id'],
+            **fields
+        )
+
+    def has_created(self, type_name, created_from):
+        """ Whether a reusable structure exists for a data_dict entry.
+
+        That is when, thanks to the upload cache or a resumed journal, the
+        entry already has a taskId that was created from the same inputs.
+
+        Args:
+            type_name (str): the data_dict entry.
+            created_from (list): IDs of the uploads (or other structures)
+                the structure would be created from.
+
+        Returns:
+            bool: True if the structure can be reused.
+        """
+        entry = self.data_dict.get(type_name, {})
+        reusable = (
+            self.resumable and
+            'taskId' in entry and
+            entry.get('created_from') == created_from
+        )
+        if reusable:
+            logger.info('Reusing {name} structure {id}'.format(
+                name=type_name,
+                id=entry['taskId']
+            ))
+        return reusable
+
+    def record_created(self, type_name, created_from):
+        """ Notes that a data_dict entry's structure was just created.
+
+        Any job loading an earlier structure no longer applies.
+
+        Args:
+            type_name (str): the data_dict entry.
+            created_from (list): IDs of the inputs it was created from.
+        """
+        with self.lock:
+            entry = self.data_dict[type_name]
+            entry['created_from'] = created_from
+            entry.pop('job_id', None)
+            entry.pop('job_status', None)
+        self.cache_record(
+            type_name,
+            taskId=entry['taskId'],
+            created_from=created_from,
+            job_id=None
+        )
+        self.checkpoint()
+
+    def reusable_job(self, type_name, config_id=1):
+        """ Checks whether a data_dict entry's earlier job can be reused.
+
+        Only when resuming from a journal or using the upload cache. The
+        job's status is read from the server.
+
+        Args:
+            type_name (str): the data_dict entry.
+            config_id (int, optional): config that the job was created with.
+
+        Returns:
+            str: 'done' if the job is done, 'running' if it is still on the
+            job queue, None if it has to be queued (again).
+        """
+        entry = self.data_dict.get(type_name, {})
+        if not self.resumable or 'job_id' not in entry:
+            return None
+        status = self.job_status(entry['job_id'], config_id)
+        if status == 'FAILED':
+            return None
+        logger.info('Reusing {name} job {id}, {status}'.format(
+            name=type_name,
+            id=entry['job_id'],
+            status=status
+        ))
+        if status == 'done':
+            return 'done'
+        return 'running'
+
+    def mark_job_done(self, job_id):
+        """ Notes in the data_dict that a job is done and checkpoints.
+
+        Called from the job poller thread too, see JobHandle.check().
+        """
+        with self.lock:
+            for type_ in list(self.data_dict.values()):
+                if isinstance(type_, dict) and type_.get('job_id') == job_id:
+                    type_['job_status'] = 'done'
+            self.checkpoint()
 
     # TODO: Appropriately name this method.
-    def load_models(self):
+    def load_models(self, wait=False, config_id=1, policy=None,
+                    timeout=None):
         """ Do tasks, load up models.
 
         Adds all the tasks in the data_dict to the job queue.
+
+        Args:
+            wait (bool, optional): wait for all of the queued jobs to be
+                done, see wait_all().
+            config_id (int, optional): config that the jobs were created with.
+            policy (optional): polling policy, see wait_until_done().
+            timeout (float, optional): seconds to wait for all of the jobs.
+
+        Returns:
+            list: IDs of the jobs queued or still running, without those
+            already done in an earlier run.
         """
         logger.info('Loading {name} data'.format(name=self.__class__.__name__))
-        for type_name, type_ in self.data_dict.iteritems():
+        job_ids = []
+        for type_name, type_ in list(self.data_dict.items()):
             # An exclude for correlations. Isn't created nor has an ID.
             if type_name == "correlations_main":
                 continue
-            task_response = self.do_task(
-                self.types[type_name],
-                type_['taskId']
-            )
-            self.data_dict[type_name]['job_id'] = json.loads(
-                task_response.content
-            )['JobId']
-            logger.info(
-                'Load {name} response: '.format(name=type_name) +
-                task_response.content
+            # Already loaded, or loading, in an earlier run.
+            job_state = self.reusable_job(type_name, config_id)
+            if job_state == 'done':
+                continue
+            if job_state is None:
+                task_response = self.do_task(
+                    self.types[type_name],
+                    type_['taskId'],
+                    input_bytes=self.input_bytes(type_name)
+                )
+                if task_response.job_id is None:
+                    # Nothing was queued, raises the handle's error.
+                    task_response.result()
+                with self.lock:
+                    type_['job_id'] = task_response.job_id
+                    self.checkpoint()
+                self.cache_record(type_name, job_id=type_['job_id'])
+                logger.info(
+                    'Load {name} response: '.format(name=type_name) +
+                    task_response.text
+                )
+            job_ids.append(self.data_dict[type_name]['job_id'])
+
+        if wait:
+            self.wait_all(
+                job_ids,
+                config_id=config_id,
+                policy=policy,
+                timeout=timeout
             )
 
         print("Loaded model")
+        return job_ids
 
 
     # Job related methods below.
+    def job_policy(self, job_ids, policy=None, wait_time=5, lead=0.8):
+        """ Returns the polling policy to wait for jobs with.
+
+        If the job timings keep a history (see spittalhistory) that
+        predicts when the jobs will be done, the first status check is held
+        until the earliest of them is nearly expected to be done, see
+        ExpectedPolling. The checks after it follow policy or, by default,
+        back off from a quarter second up to wait_time.
+
+        The first check comes a little early, at lead of the expected time.
+        A job already done by then has its duration recorded as that, so
+        an estimate that is too long shrinks on the next runs instead of
+        being confirmed by every check that finds the job done.
+
+        Args:
+            job_ids (list): IDs of the jobs to wait for.
+            policy (optional): the polling policy asked for, if any.
+            wait_time (int, optional): seconds between checks by default.
+            lead (float, optional): fraction of the expected duration to
+                make the first check at.
+        """
+        expected = [self.job_timings.expected_done(job_id, lead)
+                    for job_id in job_ids]
+        expected = [at for at in expected if at is not None]
+        if not expected:
+            return policy or FixedPolling(wait_time)
+        if policy is None:
+            policy = BackoffPolling(min(0.25, wait_time), max_wait=wait_time)
+        return ExpectedPolling(min(expected), policy)
+
+    def input_bytes(self, type_name):
+        """ int: size of the file uploaded for a data_dict entry, or None. """
+        filepath = self.data_dict.get(type_name, {}).get('filepath')
+        if filepath is None or not os.path.exists(filepath):
+            return None
+        return os.path.getsize(filepath)
+
     # TODO: Appropriately name this method.
     def wait_until_done(self, job_id, config_id=1,
-                            wait_time=5, max_iters=50, init_wait_time=0):
+                            wait_time=5, max_iters=50, init_wait_time=0,
+                            policy=None, timeout=None):
         """ Waits until the specified job is complete.
 
         This is used because some jobs depends on others.
@@ -410,72 +1071,250 @@ class SpittalBase():
             wait_time (int, optional): seconds to wait between each check.
             max_iters (int, optional): max iterations before raising exception.
             init_wait_time (int, optional): seconds to initially wait.
+            policy (optional): how long to wait between checks, i.e. a
+                spittalpoll.BackoffPolling. Defaults to FixedPolling of
+                wait_time. See job_policy() for when the first check is
+                held back.
+            timeout (float, optional): seconds of wall-clock time to wait
+                for, replacing max_iters.
 
         Returns:
             None
         """
-        status = False
-        i= 0
-        time.sleep(init_wait_time)
-        # Do until job finishes or max iters is reached.
-        while status == False and i < max_iters:
+        policy = self.job_policy([job_id], policy, wait_time)
+        schedule = poll_schedule(policy, timeout, max_iters)
+        time.sleep(max(init_wait_time, first_wait(policy, timeout)))
+        # Do until job finishes or we run out of time.
+        while True:
             resp = self.check_status(job_id, config_id)
-            logger.debug("Waiting for response " + resp.content)
-            job_status = json.loads(resp.content)['status']
-            if job_status == 'done':
-                logger.info("Previous, job done! " + resp.content)
-                status = True
-            # If the job fails stop everything and raise exception.
-            elif job_status == "FAILED":
+            if self.is_job_done(job_id, resp):
+                self.mark_job_done(job_id)
+                break
+            wait = next(schedule, None)
+            # If we hit max iterations or the deadline.
+            if wait is None:
                 raise Exception(
-                    "FATAL: Job {num} failed with a response of: {resp}".format(
-                        num=job_id,
-                        resp=resp.content
-                    )
+                    "Task Load Timeout!\nTry setting a longer wait time"
+                )
+            time.sleep(wait)
+        job = self.job_timings.job(job_id)
+        if job is not None:
+            logger.info(
+                "{task} job {id} done after {took:.2f}s, {polls} polls".format(
+                    task=job['task_type'],
+                    id=job_id,
+                    took=job['completed'] - job['queued'],
+                    polls=job['polls']
                 )
-            i += 1
-            time.sleep(wait_time)
-        # If we hit max iterations.
-        if status == False:
-            raise Exception(
-                "Task Load Timeout!\nTry setting a longer wait time"
             )
-        # TODO: Maybe report some time stats once done.
 
+    def wait_all(self, job_ids, config_id=1, wait_time=5, max_iters=50,
+                 policy=None, timeout=None):
+        """ Waits until all of the given jobs are complete.
+
+        The jobs are polled round-robin, each still running job once per
+        round, with one polling schedule shared by the whole set. So waiting
+        for many independent jobs takes about as long as the slowest one.
+
+        Args:
+            job_ids (list): IDs of the jobs to wait for.
+            config_id (int, optional): config that the jobs were created with.
+            wait_time (int, optional): seconds to wait between each round.
+            max_iters (int, optional): max rounds before raising exception.
+            policy (optional): how long to wait between rounds, see
+                wait_until_done().
+            timeout (float, optional): seconds of wall-clock time to wait
+                for, replacing max_iters.
+
+        Raises:
+            SpittalJobError: as soon as any of the jobs fails.
+        """
+        self._wait_jobs(
+            job_ids, config_id, wait_time, max_iters, policy, timeout,
+            wait_for_all=True
+        )
+
+    def wait_any(self, job_ids, config_id=1, wait_time=5, max_iters=50,
+                 policy=None, timeout=None):
+        """ Waits until any one of the given jobs is complete.
+
+        See wait_all() for the arguments.
+
+        Returns:
+            int: ID of the first job seen to be done.
+        """
+        return self._wait_jobs(
+            job_ids, config_id, wait_time, max_iters, policy, timeout,
+            wait_for_all=False
+        )[0]
+
+    def _wait_jobs(self, job_ids, config_id, wait_time, max_iters, policy,
+                   timeout, wait_for_all):
+        """ Polls the jobs round-robin for wait_all() and wait_any().
+
+        Returns:
+            list: IDs of the jobs seen to be done, in the order they were.
+        """
+        policy = self.job_policy(job_ids, policy, wait_time)
+        schedule = poll_schedule(policy, timeout, max_iters)
+        time.sleep(first_wait(policy, timeout))
+        pending = list(job_ids)
+        done = []
+        while pending:
+            for job_id in list(pending):
+                resp = self.check_status(job_id, config_id)
+                if self.is_job_done(job_id, resp):
+                    self.mark_job_done(job_id)
+                    pending.remove(job_id)
+                    done.append(job_id)
+            if done and not wait_for_all:
+                break
+            if not pending:
+                break
+            wait = next(schedule, None)
+            if wait is None:
+                raise Exception(
+                    "Task Load Timeout!\nTry setting a longer wait time"
+                )
+            time.sleep(wait)
+        return done
+
+    def job_status(self, job_id, config_id=1):
+        """ Returns the status of a job, i.e. 'done' or 'FAILED'.
+
+        Args:
+            job_id (int): ID of the job.
+            config_id (int, optional): config that the job was created with.
+
+        Returns:
+            str: the job's status.
+        """
+        resp = self.check_status(job_id, config_id)
+        return json.loads(resp.content)['status']
+
+    def is_job_done(self, job_id, resp):
+        """ Reads a job's status from a check_status() response.
+
+        Args:
+            job_id (int): ID of the job the status is for.
+            resp (HttpResponse): the check_status() response.
+
+        Returns:
+            bool: True once the job is done.
+
+        Raises:
+            SpittalJobError: if the job failed.
+        """
+        logger.debug("Waiting for response " + resp.text)
+        job_status = json.loads(resp.content)['status']
+        self.job_timings.polled(job_id, job_status)
+        if job_status == 'done':
+            logger.info("Previous, job done! " + resp.text)
+            return True
+        # If the job fails stop everything and raise exception.
+        elif job_status == "FAILED":
+            raise SpittalJobError(
+                job_id,
+                "FATAL: Job {num} failed with a response of: {resp}".format(
+                    num=job_id,
+                    resp=resp.content
+                )
+            )
+        return False
 
     # TODO: Rename to queue_all_tasks.
-    def queue_task(self, task_name):
+    def queue_task(self, task_name, policy=None, timeout=None):
         """ Simple add the specified task in the job queue.
 
         This is simple queuing the task only adding it to the queue.
         As opposed to do the job when we wait for it to complete.
+
+        Args:
+            task_name (str): the data_dict entry to queue the task of.
+            policy (optional): polling policy for the handle, see do_task().
+            timeout (float, optional): seconds the handle watches the job
+                for, see do_task().
+
+        Returns:
+            JobHandle: the queued job.
         """
         task_response = self.do_task(
             self.types[task_name],
-            self.data_dict[task_name]['taskId']
+            self.data_dict[task_name]['taskId'],
+            policy=policy,
+            input_bytes=self.input_bytes(task_name),
+            timeout=timeout
         )
-        self.data_dict[task_name]['job_id'] = json.loads(
-            task_response.content
-        )['JobId']
+        if task_response.job_id is None:
+            # Nothing was queued, raises the handle's error.
+            task_response.result()
+        with self.lock:
+            self.data_dict[task_name]['job_id'] = task_response.job_id
+            self.data_dict[task_name].pop('job_status', None)
+            self.checkpoint()
         logger.info(
             'Queued {name} task response: '.format(name=task_name) +
-            task_response.content
+            task_response.text
         )
+        return task_response
+
+    def do_job(self, task_name, wait_time=2, max_iters=100, policy=None,
+               timeout=None):
+        """ Wait until the job has been done on the job queue.
 
-    def do_job(self, task_name, wait_time=2, max_iters=100):
-        """ Wait until the job has been done on the job queue. """
-        self.queue_task(task_name)
+        When resuming, a job that is already done is not run again and one
+        that is still on the job queue is waited for rather than requeued.
+
+        See wait_until_done() for the arguments.
+        """
+        job_state = self.reusable_job(task_name)
+        if job_state == 'done':
+            return
+        if job_state is None:
+            self.queue_task(task_name)
         self.wait_until_done(
             self.data_dict[task_name]['job_id'],
             wait_time=wait_time,
-            max_iters=max_iters
+            max_iters=max_iters,
+            policy=policy,
+            timeout=timeout
         )
 
-    def do_jobs(self, job_list,  wait_time=2, max_iters=100):
-        """ Do all dependant jobs in the given list. """
+    def do_jobs(self, job_list,  wait_time=2, max_iters=100, policy=None,
+                timeout=None, parallel=False):
+        """ Do all dependant jobs in the given list.
+
+        See wait_until_done() for the arguments. The timeout applies to
+        each job.
+
+        Args:
+            parallel (bool, optional): the jobs are independent. Queue them
+                all at once and then wait on them together, see wait_all().
+                The timeout then applies to the whole set.
+        """
+        if parallel:
+            job_ids = []
+            for task_name in job_list:
+                job_state = self.reusable_job(task_name)
+                if job_state == 'done':
+                    continue
+                if job_state is None:
+                    self.queue_task(task_name)
+                job_ids.append(self.data_dict[task_name]['job_id'])
+            self.wait_all(
+                job_ids,
+                wait_time=wait_time,
+                max_iters=max_iters,
+                policy=policy,
+                timeout=timeout
+            )
+            return
+
         for task_name in job_list:
             self.do_job(
                 task_name,
                 wait_time=wait_time,
-                max_iters=max_iters
+                max_iters=max_iters,
+                policy=policy,
+                timeout=timeout
             )
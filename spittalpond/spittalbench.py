@@ -0,0 +1,406 @@
+""" End-to-end benchmarks of the model -> exposure -> GUL run.
+
+Each case runs the same steps as examples/toymodel.ipynb against a local
+SpittalServer, in a fresh Python process so that the peak memory use is the
+case's own, and records:
+
+    - the wall time of every stage and of the whole run,
+    - the HTTP requests made, bytes sent and bytes received,
+    - the number of job status polls, and the jobs by task type,
+    - the peak resident memory of the client process.
+
+The number of files is set by the Oasis file types, so the sizes vary the
+rows per uploaded file, the GUL size (events x items) and the CDF samples.
+
+Example:
+
+    $ python -m spittalpond.spittalbench --sizes small,medium \\
+        --save-baseline baseline.json
+    $ python -m spittalpond.spittalbench --sizes small,medium \\
+        --baseline baseline.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .spittalpond import SpittalPond
+from .spittalserver import SpittalServer
+from .spittalpoll import BackoffPolling
+
+SIZES = {
+    'small': {
+        'rows': 1000,
+        'gul_events': 100,
+        'gul_items': 10,
+        'samples': 10,
+    },
+    'medium': {
+        'rows': 20000,
+        'gul_events': 1000,
+        'gul_items': 20,
+        'samples': 10,
+    },
+    'large': {
+        'rows': 200000,
+        'gul_events': 5000,
+        'gul_items': 50,
+        'samples': 20,
+    },
+}
+
+MODEL_FILES = [
+    "dict_areaperil_1.csv",
+    "dict_damagebin_1.csv",
+    "dict_event_1.csv",
+    "dict_hazardintensitybin_1.csv",
+    "dict_vuln_1.csv",
+    "version_hazfp_1.csv",
+    "version_vuln_1.csv",
+]
+
+EXPOSURE_FILES = [
+    "correlations_main_1.csv",
+    "dict_exposure_1.csv",
+    "exposures_main_1.csv",
+]
+
+# The metrics compared against a baseline, lower is better for all.
+METRICS = [
+    'wall',
+    'requests',
+    'bytes_sent',
+    'bytes_received',
+    'status_polls',
+    'peak_rss_kb',
+]
+
+def write_inputs(directory, rows):
+    """ Writes model/ and exposure/ directories of rows-line CSV files.
+
+    Returns:
+        tuple: the model and exposure directory paths, with trailing slash.
+    """
+    paths = []
+    for sub, filenames in (("model", MODEL_FILES),
+                           ("exposure", EXPOSURE_FILES)):
+        sub_directory = os.path.join(directory, sub)
+        os.makedirs(sub_directory)
+        for filename in filenames:
+            with open(os.path.join(sub_directory, filename), "w") as f:
+                f.write("ID,VALUE_A,VALUE_B,VALUE_C\n")
+                for row in range(1, rows + 1):
+                    f.write("{row},{a},{b},0.{c:06d}\n".format(
+                        row=row,
+                        a=row % 97,
+                        b=row % 13,
+                        c=row % 1000000
+                    ))
+        paths.append(sub_directory + os.sep)
+    return tuple(paths)
+
+def peak_rss_kb():
+    """ int: the peak resident memory of this process in KB, or None. """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # Bytes on macOS, KB everywhere else.
+        peak //= 1024
+    return peak
+
+def run_case(case):
+    """ Runs one benchmark case in this process.
+
+    Args:
+        case (dict): the size settings plus job_duration, latency, policy
+            and stream.
+
+    Returns:
+        dict: the case's results.
+    """
+    work_dir = tempfile.mkdtemp(prefix="spittalbench")
+    policy = None
+    if case.get('policy') == 'backoff':
+        policy = BackoffPolling()
+    try:
+        model_directory, exposure_directory = write_inputs(
+            work_dir, case['rows']
+        )
+        server = SpittalServer(
+            latency={"*": case.get('latency', 0)},
+            job_durations={"*": case.get('job_duration', 0.1)},
+            gul_events=case['gul_events'],
+            gul_items=case['gul_items'],
+            seed=1
+        )
+        with server:
+            spittal = SpittalPond(server.base_url, "root")
+            target = None
+            if case.get('stream'):
+                target = os.path.join(work_dir, "gul.csv")
+            gul = {}
+
+            def benchmark():
+                gul['benchmark'] = spittal.exposure.run_benchmark(
+                    policy=policy
+                )
+
+            def get_gul():
+                resp = spittal.run.get_gul_data(
+                    "spittalGUL", "my_data.csv", 3,
+                    target=target,
+                    policy=policy
+                )
+                if target is None:
+                    # Like the notebook, hold the whole GUL in memory.
+                    gul['bytes'] = len(resp.content)
+                else:
+                    gul['bytes'] = resp['bytes']
+
+            # The steps of examples/toymodel.ipynb.
+            stages = [
+                ("login", lambda: spittal.do_login("password")),
+                ("model_upload",
+                 lambda: spittal.model.upload_directory(model_directory)),
+                ("model_structures", spittal.model.create_model_structures),
+                ("model_load",
+                 lambda: spittal.model.load_models(wait=True, policy=policy)),
+                ("exposure_upload",
+                 lambda: spittal.exposure.upload_directory(
+                     exposure_directory
+                 )),
+                ("exposure_structures",
+                 lambda: spittal.exposure.create_exposure_structure(
+                     spittal.model.data_dict
+                 )),
+                ("exposure_load",
+                 lambda: spittal.exposure.load_models(
+                     wait=True, policy=policy
+                 )),
+                ("benchmark", benchmark),
+                ("random_numbers",
+                 lambda: spittal.run.auto_create_random_numbers(
+                     policy=policy
+                 )),
+                ("gul_create",
+                 lambda: spittal.run.create_gul_data(
+                     "spittalGUL",
+                     gul['benchmark'],
+                     spittal.exposure.data_dict['exposures_instance']['taskId'],
+                     case['samples']
+                 )),
+                ("gul_get", get_gul),
+            ]
+            timings = {}
+            start = time.time()
+            for name, func in stages:
+                stage_start = time.time()
+                func()
+                timings[name] = time.time() - stage_start
+            wall = time.time() - start
+            spittal.close()
+
+            stats = server.stats
+            return {
+                'case': case,
+                'stages': timings,
+                'wall': wall,
+                'requests': sum(s['requests'] for s in stats.values()),
+                'bytes_sent': sum(s['bytes_in'] for s in stats.values()),
+                'bytes_received': sum(
+                    s['bytes_out'] for s in stats.values()
+                ),
+                'status_polls': stats.get(
+                    'statusAsync', {}
+                ).get('requests', 0),
+                'gul_bytes': gul['bytes'],
+                'jobs': spittal.job_timings.summary(),
+                'peak_rss_kb': peak_rss_kb(),
+            }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def run_case_process(case):
+    """ Runs one benchmark case in a fresh Python process.
+
+    Returns:
+        dict: the case's results, see run_case().
+    """
+    package_parent = os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__))
+    )
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package_parent] + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    output = subprocess.check_output(
+        [sys.executable, "-m", "spittalpond.spittalbench",
+         "--case", json.dumps(case)],
+        env=env
+    )
+    # The client prints progress, the results are on the last line.
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+def run_suite(sizes, job_duration=0.1, latency=0, policy=None,
+              stream=False, repeat=1):
+    """ Runs a case for each size, keeping the fastest of each repeat.
+
+    Args:
+        sizes (list): names of the SIZES to run.
+        job_duration (float, optional): seconds every server job runs for.
+        latency (float, optional): seconds every server call takes.
+        policy (str, optional): 'backoff' for BackoffPolling, otherwise the
+            default polling of each method.
+        stream (bool, optional): stream the GUL to disk.
+        repeat (int, optional): times to run each case.
+
+    Returns:
+        dict: results by size name.
+    """
+    results = {}
+    for size in sizes:
+        case = dict(SIZES[size])
+        case.update({
+            'size': size,
+            'job_duration': job_duration,
+            'latency': latency,
+            'policy': policy,
+            'stream': stream,
+        })
+        runs = [run_case_process(case) for _ in range(repeat)]
+        results[size] = min(runs, key=lambda result: result['wall'])
+    return results
+
+def compare(results, baseline, tolerance=0.1):
+    """ Compares results with a baseline.
+
+    Args:
+        results (dict): results by size name, see run_suite().
+        baseline (dict): earlier results by size name.
+        tolerance (float, optional): fraction a metric may grow by before
+            it counts as a regression.
+
+    Returns:
+        tuple: a text report and the list of (size, metric) regressions.
+    """
+    lines = ["{size:<8} {metric:<16} {base:>14} {now:>14} {ratio:>7}".format(
+        size="size",
+        metric="metric",
+        base="baseline",
+        now="current",
+        ratio="ratio"
+    )]
+    regressions = []
+    for size in sorted(results):
+        if size not in baseline:
+            continue
+        for metric in METRICS:
+            base = baseline[size].get(metric)
+            now = results[size].get(metric)
+            if not base or now is None:
+                continue
+            ratio = float(now) / base
+            mark = ""
+            if ratio > 1 + tolerance:
+                mark = " !"
+                regressions.append((size, metric))
+            lines.append(
+                "{size:<8} {metric:<16} {base:>14.6g} {now:>14.6g} "
+                "{ratio:>7.2f}{mark}".format(
+                    size=size,
+                    metric=metric,
+                    base=base,
+                    now=now,
+                    ratio=ratio,
+                    mark=mark
+                )
+            )
+    return "\n".join(lines), regressions
+
+def report(results):
+    """ A text table of the results' stage timings and totals. """
+    lines = []
+    for size in sorted(results):
+        result = results[size]
+        lines.append("== {size}: {wall:.2f}s, {requests} requests, "
+                     "{sent} bytes sent, {received} bytes received, "
+                     "{polls} status polls, peak RSS {rss} KB".format(
+                         size=size,
+                         wall=result['wall'],
+                         requests=result['requests'],
+                         sent=result['bytes_sent'],
+                         received=result['bytes_received'],
+                         polls=result['status_polls'],
+                         rss=result['peak_rss_kb']
+                     ))
+        for name, took in sorted(result['stages'].items(),
+                                 key=lambda stage: -stage[1]):
+            lines.append("   {name:<24} {took:>9.3f}s".format(
+                name=name,
+                took=took
+            ))
+    return "\n".join(lines)
+
+def main(argv=None):
+    """ Runs the benchmark suite from the command line. """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the model -> exposure -> GUL run against a "
+                    "local Oasis stand-in."
+    )
+    parser.add_argument("--sizes", default="small",
+                        help="comma separated, of: " +
+                        ", ".join(sorted(SIZES)))
+    parser.add_argument("--job-duration", type=float, default=0.1)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--policy", choices=["default", "backoff"],
+                        default="default")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream the GUL to disk")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", help="write the results to a file")
+    parser.add_argument("--baseline", help="compare with a results file")
+    parser.add_argument("--save-baseline",
+                        help="write the results as a new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        # Child process of run_case_process().
+        print(json.dumps(run_case(json.loads(args.case))))
+        return 0
+
+    results = run_suite(
+        args.sizes.split(","),
+        job_duration=args.job_duration,
+        latency=args.latency,
+        policy=args.policy,
+        stream=args.stream,
+        repeat=args.repeat
+    )
+    print(report(results))
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        text, regressions = compare(results, baseline, args.tolerance)
+        print(text)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
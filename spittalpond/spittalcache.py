@@ -0,0 +1,73 @@
+import hashlib
+
+from .spittalstore import JsonStore
+from .spittalstream import DEFAULT_CHUNK_SIZE
+
+def file_hash(filepath, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Returns the SHA-1 hex digest of a file, read in chunks.
+
+    Args:
+        filepath (str): path of the file to hash.
+        chunk_size (int, optional): bytes to read at a time.
+
+    Returns:
+        str: the hex digest.
+    """
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class UploadCache(object):
+    """ A local manifest of files already uploaded to a server.
+
+    Files are keyed by server, content hash and module supplier ID. Each
+    entry maps to the server-side objects made from the file: upload_name,
+    upload_id and download_id, the taskId of the dict/version created from
+    it (with created_from, the upload IDs it was created with) and the
+    job_id that loaded it. An unchanged file can then reuse those objects
+    instead of being uploaded, created and loaded again.
+    """
+
+    def __init__(self, path):
+        """ Initiating instance.
+
+        Args:
+            path (str): path of the JSON manifest file.
+        """
+        self.store = JsonStore(path)
+
+    @staticmethod
+    def key(base_url, content_hash, module_supplier_id):
+        """ str: the manifest key of a file. """
+        return "{url} {hash} {supplier}".format(
+            url=base_url,
+            hash=content_hash,
+            supplier=module_supplier_id
+        )
+
+    def lookup(self, base_url, content_hash, module_supplier_id):
+        """ Returns the cached entry of a file, None if not uploaded yet. """
+        entry = self.store.get(
+            self.key(base_url, content_hash, module_supplier_id)
+        )
+        if entry is None or 'upload_id' not in entry:
+            return None
+        return dict(entry)
+
+    def record(self, base_url, content_hash, module_supplier_id, **fields):
+        """ Saves fields into the cached entry of a file. """
+        self.store.update(
+            self.key(base_url, content_hash, module_supplier_id),
+            fields
+        )
+
+    def forget(self, base_url, content_hash, module_supplier_id):
+        """ Drops the cached entry of a file, i.e. if it is gone server-side. """
+        self.store.delete(
+            self.key(base_url, content_hash, module_supplier_id)
+        )
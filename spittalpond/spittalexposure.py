@@ -1,5 +1,5 @@
 import json
-from spittalbase import SpittalBase
+from .spittalbase import SpittalBase
 import logging
 
 logger = logging.getLogger('spittalpond')
@@ -137,82 +137,128 @@ class SpittalExposure(SpittalBase):
 
         logger.info('Creating the exposure strutuces.')
         # Upload the lone dictionary.
-        creation_response = self.create_dict(
-            "dict_exposure",
+        created_from = [
             self.data_dict['dict_exposure']['upload_id'],
             self.data_dict['dict_exposure']['download_id'],
-            self.pub_user,
-            self.data_dict['dict_exposure']['module_supplier_id'],
-        )
-        logger.info('Create dict_exposure response: ' + creation_response.content)
+        ]
+        if not self.has_created('dict_exposure', created_from):
+            creation_response = self.create_dict(
+                "dict_exposure",
+                self.data_dict['dict_exposure']['upload_id'],
+                self.data_dict['dict_exposure']['download_id'],
+                self.pub_user,
+                self.data_dict['dict_exposure']['module_supplier_id'],
+            )
+            logger.info(
+                'Create dict_exposure response: ' + creation_response.text
+            )
 
-        self.data_dict['dict_exposure']['taskId'] = json.loads(
-            creation_response.content
-        )['taskId']
+            self.data_dict['dict_exposure']['taskId'] = json.loads(
+                creation_response.content
+            )['taskId']
+            self.record_created('dict_exposure', created_from)
 
         # The correlations file simply has to be uploaded.
         # create_exposure_version() will take care of the rest.
 
         # For now we assume that there is only one exposure version.
         # so we do not need to loop through.
-        creation_response = self.create_exposure_version(
-            "exposure_main",
-            self.data_dict['exposures_main']['module_supplier_id'],
+        created_from = [
             self.data_dict['exposures_main']['upload_id'],
             self.data_dict['correlations_main']['upload_id'],
-        )
-        logger.info('Create exposure_verion response: ' + creation_response.content)
+        ]
+        if not self.has_created('exposures_main', created_from):
+            creation_response = self.create_exposure_version(
+                "exposure_main",
+                self.data_dict['exposures_main']['module_supplier_id'],
+                self.data_dict['exposures_main']['upload_id'],
+                self.data_dict['correlations_main']['upload_id'],
+            )
+            logger.info(
+                'Create exposure_verion response: ' + creation_response.text
+            )
 
-        self.data_dict['exposures_main']['taskId'] = json.loads(
-            creation_response.content
-        )['taskId']
+            self.data_dict['exposures_main']['taskId'] = json.loads(
+                creation_response.content
+            )['taskId']
+            self.record_created('exposures_main', created_from)
 
         # Create the exposure instance.
-        self.data_dict['exposures_instance'] = {}
-        creation_response = self.create_exposure_instance(
-            self.pub_user,
+        created_from = [
             self.data_dict['exposures_main']['taskId'],
             self.data_dict['dict_exposure']['taskId'],
             model_data_dict['dict_areaperil']['taskId'],
-            model_data_dict['dict_vuln']['taskId']
-        )
-        logger.info('Create exposure_instance response: ' + creation_response.content)
+            model_data_dict['dict_vuln']['taskId'],
+        ]
+        if not self.has_created('exposures_instance', created_from):
+            self.data_dict['exposures_instance'] = {}
+            creation_response = self.create_exposure_instance(
+                self.pub_user,
+                self.data_dict['exposures_main']['taskId'],
+                self.data_dict['dict_exposure']['taskId'],
+                model_data_dict['dict_areaperil']['taskId'],
+                model_data_dict['dict_vuln']['taskId']
+            )
+            logger.info(
+                'Create exposure_instance response: ' + creation_response.text
+            )
 
-        self.data_dict['exposures_instance']['taskId'] = json.loads(
-            creation_response.content
-        )['taskId']
+            self.data_dict['exposures_instance']['taskId'] = json.loads(
+                creation_response.content
+            )['taskId']
+            self.record_created('exposures_instance', created_from)
 
         # Create the hazfp instance.
-        self.data_dict['hazfp_instance'] = {}
-        creation_response = self.create_hazfp_instance(
-            self.pub_user,
+        created_from = [
             model_data_dict['version_hazfp']['taskId'],
             model_data_dict['dict_event']['taskId'],
             model_data_dict['dict_areaperil']['taskId'],
             model_data_dict['dict_hazardintensitybin']['taskId'],
-            "ModelKey"
-        )
-        logger.info('Create hazfp_verion response: ' + creation_response.content)
+        ]
+        if not self.has_created('hazfp_instance', created_from):
+            self.data_dict['hazfp_instance'] = {}
+            creation_response = self.create_hazfp_instance(
+                self.pub_user,
+                model_data_dict['version_hazfp']['taskId'],
+                model_data_dict['dict_event']['taskId'],
+                model_data_dict['dict_areaperil']['taskId'],
+                model_data_dict['dict_hazardintensitybin']['taskId'],
+                "ModelKey"
+            )
+            logger.info(
+                'Create hazfp_verion response: ' + creation_response.text
+            )
 
-        self.data_dict['hazfp_instance']['taskId'] = json.loads(
-            creation_response.content
-        )['taskId']
+            self.data_dict['hazfp_instance']['taskId'] = json.loads(
+                creation_response.content
+            )['taskId']
+            self.record_created('hazfp_instance', created_from)
 
         # Create vuln instance.
-        self.data_dict['vuln_instance'] = {}
-        creation_response = self.create_vuln_instance(
-            self.pub_user,
+        created_from = [
             model_data_dict['version_vuln']['taskId'],
             model_data_dict['dict_vuln']['taskId'],
             model_data_dict['dict_hazardintensitybin']['taskId'],
             model_data_dict['dict_damagebin']['taskId'],
-            "ModelKey"
-        )
-        logger.info('Create vuln_instance response: ' + creation_response.content)
+        ]
+        if not self.has_created('vuln_instance', created_from):
+            self.data_dict['vuln_instance'] = {}
+            creation_response = self.create_vuln_instance(
+                self.pub_user,
+                model_data_dict['version_vuln']['taskId'],
+                model_data_dict['dict_vuln']['taskId'],
+                model_data_dict['dict_hazardintensitybin']['taskId'],
+                model_data_dict['dict_damagebin']['taskId'],
+                "ModelKey"
+            )
+            logger.info(
+                'Create vuln_instance response: ' + creation_response.text
+            )
 
-        self.data_dict['vuln_instance']['taskId'] = json.loads(
-            creation_response.content
-        )['taskId']
+            self.data_dict['vuln_instance']['taskId'] = json.loads(
+                creation_response.content
+            )['taskId']
+            self.record_created('vuln_instance', created_from)
         print("Finished creating exposure structures.")
 
     def create_benchmark(self, name="Benchmark", chunk_size=10,
@@ -240,3 +286,41 @@ class SpittalExposure(SpittalBase):
             str(max_chunk) + "/"
         )
         return response
+
+    def run_benchmark(self, name="Benchmark", chunk_size=10, min_chunk=4,
+                      max_chunk=4, policy=None, timeout=None):
+        """ Creates a benchmark and waits for its job to be done.
+
+        The benchmark's taskId and job_id are kept in the data_dict under
+        'benchmark'. See create_benchmark() and wait_until_done() for the
+        arguments.
+
+        Returns:
+            int: the benchmark id, as needed by SpittalRun.create_gul_data().
+        """
+        created_from = [
+            self.data_dict['hazfp_instance']['taskId'],
+            self.data_dict['exposures_instance']['taskId'],
+            self.data_dict['vuln_instance']['taskId'],
+            chunk_size,
+            min_chunk,
+            max_chunk,
+        ]
+        if not self.has_created('benchmark', created_from):
+            creation_response = self.create_benchmark(
+                name,
+                chunk_size,
+                min_chunk,
+                max_chunk
+            )
+            logger.info(
+                'Create benchmark response: ' + creation_response.text
+            )
+
+            self.data_dict['benchmark'] = {}
+            self.data_dict['benchmark']['taskId'] = json.loads(
+                creation_response.content
+            )['taskId']
+            self.record_created('benchmark', created_from)
+        self.do_job('benchmark', policy=policy, timeout=timeout)
+        return self.data_dict['benchmark']['taskId']
@@ -0,0 +1,330 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from .spittalpoll import BackoffPolling, first_wait, poll_schedule
+
+logger = logging.getLogger('spittalpond')
+
+class JobCancelledError(Exception):
+    """ Raised by JobHandle.result() when the handle was cancelled. """
+
+class JobTimeoutError(Exception):
+    """ Raised by JobHandle.result() when the job is not done in time.
+
+    Either result()'s own timeout passed, and the job is still watched, or
+    the handle's timeout did, and the job is no longer watched.
+    """
+
+class JobHandle(object):
+    """ A job on the server's job queue, like a concurrent.futures.Future.
+
+    Returned by SpittalBase.do_task() and queue_task(). The job is watched
+    from the first call to done(), result(), exception(), add_done_callback()
+    or watch(): the JobPoller thread then checks its status on the polling
+    policy's schedule, so waiting on many jobs takes no thread per job.
+
+    For compatibility with code written when do_task() returned the
+    server's response, the response's attributes (content, text,
+    status_code...) can be read on the handle too.
+
+    Example:
+
+        >>> handles = [spittal.model.queue_task(name) for name in names]
+        >>> for handle in handles:
+        ...     handle.add_done_callback(lambda h: print(h.job_id, "done"))
+        >>> handles[0].result(timeout=600)
+    """
+
+    def __init__(self, base, job_id, task_type, response=None,
+                 config_id=1, policy=None, poller=None, error=None,
+                 timeout=None):
+        """ Initiating instance.
+
+        Args:
+            base (SpittalBase): the facade whose check_status() is used.
+            job_id (int): ID of the job, None if none was queued.
+            task_type (str): the job's task type, i.e. 'GUL'.
+            response (HttpResponse, optional): the do_task() response.
+            config_id (int, optional): config the job was created with.
+            policy (optional): polling policy, BackoffPolling() by default.
+            poller (JobPoller, optional): the poller to watch the job on,
+                the shared default_poller() by default.
+            error (Exception, optional): makes the handle done already,
+                failed with this error.
+            timeout (float, optional): seconds from now to watch the job
+                for. The handle then fails with a JobTimeoutError and the
+                job is no longer polled. Forever by default.
+        """
+        self.base = base
+        self.job_id = job_id
+        self.task_type = task_type
+        self.response = response
+        self.config_id = config_id
+        self.policy = policy or BackoffPolling()
+        self.poller = poller
+        self.timeout = timeout
+        self.started = time.time()
+        self.watched = False
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._callbacks = []
+        self._result = None
+        self._error = None
+        self._cancelled = False
+        if error is not None:
+            self._finish(error=error)
+
+    def __getattr__(self, name):
+        response = self.__dict__.get('response')
+        if response is not None and not name.startswith('_'):
+            return getattr(response, name)
+        raise AttributeError(name)
+
+    def __repr__(self):
+        return "<JobHandle {task} job {id} {state}>".format(
+            task=self.task_type,
+            id=self.job_id,
+            state=self.state()
+        )
+
+    def state(self):
+        """ str: 'pending', 'running', 'done', 'failed' or 'cancelled'. """
+        with self._lock:
+            if self._cancelled:
+                return 'cancelled'
+            if self._finished.is_set():
+                return 'failed' if self._error is not None else 'done'
+            return 'running' if self.watched else 'pending'
+
+    def watch(self):
+        """ Starts checking the job's status in the background. """
+        with self._lock:
+            if self.watched or self._finished.is_set():
+                return self
+            self.watched = True
+        if self.poller is None:
+            self.poller = default_poller()
+        self.poller.submit(self)
+        return self
+
+    def done(self):
+        """ bool: whether the job is finished, failed or cancelled. """
+        self.watch()
+        return self._finished.is_set()
+
+    def cancelled(self):
+        """ bool: whether the handle was cancelled. """
+        return self._cancelled
+
+    def cancel(self):
+        """ Stops watching the job.
+
+        Oasis has no way to stop a queued job, so the job itself carries on
+        on the server; only this handle gives up on it. Done callbacks are
+        called and result() raises JobCancelledError.
+
+        Returns:
+            bool: False if the job had already finished.
+        """
+        return self._finish(
+            error=JobCancelledError(
+                "Stopped watching {task} job {id}".format(
+                    task=self.task_type,
+                    id=self.job_id
+                )
+            ),
+            cancelled=True
+        )
+
+    def result(self, timeout=None):
+        """ Waits for the job to be done.
+
+        Args:
+            timeout (float, optional): seconds to wait, forever by default.
+
+        Returns:
+            dict: the job's last status, as sent by the server.
+
+        Raises:
+            JobTimeoutError: if the job is not done within timeout.
+            SpittalJobError: if the job FAILED.
+            JobCancelledError: if the handle was cancelled.
+        """
+        error = self.exception(timeout)
+        if error is not None:
+            raise error
+        return self._result
+
+    def exception(self, timeout=None):
+        """ Waits for the job, returning the error it failed with, if any.
+
+        See result() for the arguments and JobTimeoutError.
+        """
+        self.watch()
+        if not self._finished.wait(timeout):
+            raise JobTimeoutError(
+                "{task} job {id} not done after {timeout}s".format(
+                    task=self.task_type,
+                    id=self.job_id,
+                    timeout=timeout
+                )
+            )
+        return self._error
+
+    def add_done_callback(self, callback):
+        """ Calls callback(handle) once the job is done, failed or cancelled.
+
+        The callback runs on the poller thread, or right away if the job is
+        already finished. An exception it raises is logged.
+        """
+        with self._lock:
+            if not self._finished.is_set():
+                self._callbacks.append(callback)
+                callback = None
+        if callback is not None:
+            self._call(callback)
+        self.watch()
+
+    def check(self):
+        """ Checks the job's status once, called by the poller.
+
+        Returns:
+            bool: True once the job is finished.
+        """
+        if self._finished.is_set():
+            return True
+        try:
+            resp = self.base.check_status(self.job_id, self.config_id)
+            if not self.base.is_job_done(self.job_id, resp):
+                return False
+            self.base.mark_job_done(self.job_id)
+            result = resp.json()
+        except Exception as exc:
+            self._finish(error=exc)
+            return True
+        self._finish(result=result)
+        return True
+
+    def expire(self):
+        """ Gives up on the job once the handle's timeout has passed. """
+        return self._finish(
+            error=JobTimeoutError(
+                "{task} job {id} not done after {timeout}s".format(
+                    task=self.task_type,
+                    id=self.job_id,
+                    timeout=self.timeout
+                )
+            )
+        )
+
+    def _finish(self, result=None, error=None, cancelled=False):
+        """ Stores the outcome and calls the done callbacks.
+
+        Returns:
+            bool: False if the handle had already finished.
+        """
+        with self._lock:
+            if self._finished.is_set():
+                return False
+            self._cancelled = cancelled
+            self._result = result
+            self._error = error
+            self._finished.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._call(callback)
+        return True
+
+    def _call(self, callback):
+        try:
+            callback(self)
+        except Exception as exc:
+            logger.warning("Job callback {callback} failed: {error}".format(
+                callback=callback,
+                error=exc
+            ))
+
+class JobPoller(object):
+    """ One background thread that checks the status of watched jobs.
+
+    Jobs are checked in the order their next check is due, each on its own
+    handle's polling policy, until done or the handle's timeout. The thread
+    is started when a job is submitted and stops once no job is left to
+    watch.
+    """
+
+    def __init__(self):
+        """ Initiating instance. """
+        self.condition = threading.Condition()
+        self.queue = []
+        self.order = itertools.count()
+        self.thread = None
+
+    def submit(self, handle):
+        """ Starts watching a handle.
+
+        Its status is checked right away, or once the job is expected to be
+        done with an ExpectedPolling policy.
+        """
+        remaining = None
+        if handle.timeout is not None:
+            remaining = max(handle.started + handle.timeout - time.time(), 0)
+        with self.condition:
+            self._push(
+                handle,
+                time.time() + first_wait(handle.policy, remaining),
+                poll_schedule(handle.policy, handle.timeout,
+                              start_time=handle.started)
+            )
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run,
+                    name="spittalpond-job-poller"
+                )
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+
+    def pending(self):
+        """ int: the number of jobs being watched. """
+        with self.condition:
+            return len(self.queue)
+
+    def _push(self, handle, due, schedule):
+        heapq.heappush(self.queue, (due, next(self.order), handle, schedule))
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if not self.queue:
+                        self.thread = None
+                        return
+                    due = self.queue[0][0]
+                    now = time.time()
+                    if due <= now:
+                        break
+                    self.condition.wait(due - now)
+                _, _, handle, schedule = heapq.heappop(self.queue)
+            if handle.check():
+                continue
+            wait = next(schedule, None)
+            if wait is None:
+                handle.expire()
+                continue
+            with self.condition:
+                self._push(handle, time.time() + wait, schedule)
+
+_default_poller = None
+_default_poller_lock = threading.Lock()
+
+def default_poller():
+    """ JobPoller: the poller shared by all handles that do not name one. """
+    global _default_poller
+    with _default_poller_lock:
+        if _default_poller is None:
+            _default_poller = JobPoller()
+        return _default_poller
@@ -0,0 +1,362 @@
+""" Compact, memory-mapped storage of GUL results.
+
+The published GUL CSV (EVENT_ID, ITEM_ID, IDX, GUL) is converted once into
+a directory holding one raw binary file per column plus a small meta.json.
+Each column is then memory-mapped as a NumPy array, so opening a GUL is
+instant and analysis reads only the pages it touches instead of parsing
+the CSV again.
+
+The conversion can run while the GUL is being downloaded: a GulWriter is a
+sink for SpittalBase.download_file_to(), see SpittalRun.get_gul_table().
+
+NumPy is only needed for this module:
+
+    $ pip install numpy
+"""
+import json
+import os
+import warnings
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .spittalstream import DEFAULT_CHUNK_SIZE
+
+GUL_HEADER = ["EVENT_ID", "ITEM_ID", "IDX", "GUL"]
+
+# The column files, in CSV order, with their dtype names.
+GUL_COLUMNS = [
+    ("event_id", "<i4"),
+    ("item_id", "<i4"),
+    ("idx", "<i4"),
+    ("gul", "<f4"),
+]
+
+META_FILE = "meta.json"
+
+def require_numpy():
+    """ Raises ImportError unless NumPy is installed. """
+    if np is None:
+        raise ImportError(
+            "NumPy is needed for GUL tables, try: pip install numpy"
+        )
+
+def parse_gul_rows(text):
+    """ Parses complete GUL CSV lines into an (n, 4) float64 array.
+
+    Args:
+        text (bytes): whole lines of EVENT_ID, ITEM_ID, IDX, GUL values.
+
+    Raises:
+        ValueError: if the lines do not hold four numbers each.
+    """
+    text = text.strip()
+    if not text:
+        return np.zeros((0, 4))
+    buf = np.frombuffer(text + b"\n", dtype=np.uint8)
+    # Commas on each line, from the running count at each line break.
+    commas = np.cumsum(buf == ord(","))[buf == ord("\n")]
+    commas[1:] -= commas[:-1].copy()
+    lines = len(commas)
+    bad = commas != 3
+    if bad.any():
+        raise ValueError(
+            "Malformed GUL rows, {num} row(s) without 4 values, first on "
+            "row {row} of these lines".format(
+                num=int(bad.sum()),
+                row=int(np.argmax(bad)) + 1
+            )
+        )
+    text = text.replace(b",", b" ")
+    if not isinstance(text, str):
+        # Python 3, fromstring() wants text.
+        text = text.decode("ascii")
+    with warnings.catch_warnings():
+        # A value that is not a number ends the parse with a warning, or
+        # an error on newer NumPy.
+        warnings.simplefilter("ignore")
+        try:
+            values = np.fromstring(text, dtype=np.float64, sep=" ")
+        except ValueError:
+            values = None
+    if values is None or len(values) != 4 * lines:
+        raise ValueError("Malformed GUL rows, not 4 numbers per row")
+    return values.reshape(lines, 4)
+
+class GulCsvSink(object):
+    """ Base of the sinks that take a GUL CSV written to them in pieces.
+
+    It has a write() method, so it can be handed to download_file_to() as
+    the download's sink. Lines split between two writes are held back
+    until the rest arrives, so memory use stays around the write size.
+    Subclasses get the parsed rows in write_rows().
+    """
+
+    def __init__(self):
+        """ Initiating instance. """
+        require_numpy()
+        self.pending = b""
+        self.header = None
+
+    def write(self, data):
+        """ Parses the complete lines of data, keeping the rest. """
+        data = self.pending + data
+        end = data.rfind(b"\n")
+        if end < 0:
+            self.pending = data
+            return
+        self.pending = data[end + 1:]
+        self.write_lines(data[:end + 1])
+
+    def write_lines(self, lines):
+        """ Parses whole lines, the first must be the header. """
+        if self.header is None:
+            header_end = lines.find(b"\n")
+            self.header = [
+                name.strip() for name in
+                lines[:header_end].decode("ascii").split(",")
+            ]
+            if self.header != GUL_HEADER:
+                raise ValueError(
+                    "Not a GUL file, header: {header}".format(
+                        header=self.header
+                    )
+                )
+            lines = lines[header_end + 1:]
+        if not lines.strip():
+            return
+        self.write_rows(parse_gul_rows(lines))
+
+    def write_rows(self, rows):
+        """ Takes an (n, 4) array of parsed rows. """
+        raise NotImplementedError
+
+    def flush_pending(self):
+        """ Parses a last line that had no line break. """
+        if self.pending.strip():
+            self.write_lines(self.pending + b"\n")
+        self.pending = b""
+
+    def close(self):
+        """ Parses any last line. """
+        self.flush_pending()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+class GulWriter(GulCsvSink):
+    """ Converts a GUL CSV, written to it in pieces, into a GUL table.
+
+    Example:
+
+        >>> with GulWriter("gul_table") as writer:
+        ...     spittal.run.download_gul(target=writer)
+        >>> table = open_gul_table("gul_table")
+    """
+
+    def __init__(self, directory, gul_dtype="<f4"):
+        """ Initiating instance, creating the directory.
+
+        Args:
+            directory (str): where to write the column files.
+            gul_dtype (str, optional): dtype of the GUL column, '<f8' to
+                keep full double precision.
+        """
+        super(GulWriter, self).__init__()
+        self.directory = directory
+        self.columns = [(name, gul_dtype if name == "gul" else dtype)
+                        for name, dtype in GUL_COLUMNS]
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # An older table's meta.json would mark a half-written one done.
+        meta_path = os.path.join(directory, META_FILE)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        self.files = [
+            open(os.path.join(directory, name + ".bin"), "wb")
+            for name, _ in self.columns
+        ]
+        self.rows = 0
+
+    def write_rows(self, rows):
+        """ Appends an (n, 4) array of rows to the column files. """
+        for i, (_, dtype) in enumerate(self.columns):
+            rows[:, i].astype(dtype).tofile(self.files[i])
+        self.rows += len(rows)
+
+    def close(self):
+        """ Converts any last line and writes the meta file.
+
+        The meta file is written last, so a table without one is known to
+        be incomplete.
+        """
+        self.flush_pending()
+        for f in self.files:
+            f.close()
+        meta = {
+            'rows': self.rows,
+            'columns': self.columns,
+            'header': GUL_HEADER,
+        }
+        meta_path = os.path.join(self.directory, META_FILE)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f, indent=1)
+        os.rename(meta_path + ".tmp", meta_path)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            for f in self.files:
+                f.close()
+
+class GulTable(object):
+    """ A GUL table, each column memory-mapped from its file.
+
+    Columns are read-only NumPy arrays, i.e. table['gul'] or table.gul.
+    Nothing is read from disk until it is used.
+    """
+
+    def __init__(self, directory):
+        """ Opens a table written by GulWriter.
+
+        Args:
+            directory (str): the table's directory.
+
+        Raises:
+            IOError: if the table is incomplete.
+        """
+        require_numpy()
+        meta_path = os.path.join(directory, META_FILE)
+        if not os.path.exists(meta_path):
+            raise IOError(
+                "Incomplete GUL table, no meta file: " + directory
+            )
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        self.directory = directory
+        self.rows = self.meta['rows']
+        self.columns = {}
+        for name, dtype in self.meta['columns']:
+            if self.rows:
+                column = np.memmap(
+                    os.path.join(directory, name + ".bin"),
+                    dtype=dtype,
+                    mode="r",
+                    shape=(self.rows,)
+                )
+            else:
+                # Empty files cannot be memory-mapped.
+                column = np.zeros(0, dtype=dtype)
+            self.columns[name] = column
+
+    @property
+    def dtype(self):
+        """ numpy.dtype: the structured dtype of one row. """
+        return np.dtype([(str(name), str(dtype))
+                         for name, dtype in self.meta['columns']])
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __getattr__(self, name):
+        columns = self.__dict__.get('columns', {})
+        if name in columns:
+            return columns[name]
+        raise AttributeError(name)
+
+    def records(self, start=0, stop=None):
+        """ Returns rows as a NumPy structured array.
+
+        Unlike the columns this is a copy, so ask for a slice of a large
+        table.
+
+        Args:
+            start (int, optional): first row.
+            stop (int, optional): row after the last, the end by default.
+        """
+        if stop is None:
+            stop = self.rows
+        rows = np.empty(max(stop - start, 0), dtype=self.dtype)
+        for name in rows.dtype.names:
+            rows[name] = self.columns[name][start:stop]
+        return rows
+
+    def iter_rows(self, batch_rows=1 << 20):
+        """ Yields the table as (n, 4) float64 arrays of batch_rows rows.
+
+        The same rows a GulCsvSink gets, so a table can be fed to one
+        without going back to the CSV.
+        """
+        for start in range(0, self.rows, batch_rows):
+            stop = min(start + batch_rows, self.rows)
+            rows = np.empty((stop - start, 4), dtype=np.float64)
+            for i, (name, _) in enumerate(self.meta['columns']):
+                rows[:, i] = self.columns[name][start:stop]
+            yield rows
+
+def convert_gul_csv(source, directory, chunk_size=DEFAULT_CHUNK_SIZE,
+                    gul_dtype="<f4"):
+    """ Converts a GUL CSV file into a GUL table.
+
+    Args:
+        source (str or file): path of the CSV, or a binary file object.
+        directory (str): where to write the table.
+        chunk_size (int, optional): bytes to read at a time.
+        gul_dtype (str, optional): dtype of the GUL column.
+
+    Returns:
+        GulTable: the new table.
+    """
+    f = source
+    if not hasattr(source, 'read'):
+        f = open(source, "rb")
+    try:
+        with GulWriter(directory, gul_dtype) as writer:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                writer.write(chunk)
+    finally:
+        if f is not source:
+            f.close()
+    return GulTable(directory)
+
+def open_gul_table(directory):
+    """ Opens a GUL table, see GulTable. """
+    return GulTable(directory)
+
+def move_gul_table(source, directory):
+    """ Moves a finished GUL table into place, i.e. from a temporary path.
+
+    The meta file of an older table in directory is removed first and the
+    new one moved last, so the table is never seen complete with a mix of
+    old and new columns.
+
+    Args:
+        source (str): directory of the finished table.
+        directory (str): where the table is to be.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    meta_path = os.path.join(directory, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    names = sorted(os.listdir(source))
+    names.sort(key=lambda name: name == META_FILE)
+    for name in names:
+        target = os.path.join(directory, name)
+        if os.name == "nt" and os.path.exists(target):
+            # Windows' rename does not replace existing files.
+            os.remove(target)
+        os.rename(os.path.join(source, name), target)
+    os.rmdir(source)
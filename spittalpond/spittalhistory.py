@@ -0,0 +1,92 @@
+import glob
+import os
+import time
+
+from .spittalstore import JsonStore
+
+class JobHistory(object):
+    """ A local record of how long jobs took, to predict the next ones.
+
+    Each job's task type from SpittalBase.types (HazFPVersion, VulnVersion,
+    CDF, GUL, PubGUL...) is kept with the seconds the job took and the size
+    of its input file, if it had one. A pipeline records its stages the
+    same way, under 'stage:' and the stage name.
+
+    The expected time of a job grows linearly with its input size once
+    jobs of the type were seen at two or more sizes, otherwise it is the
+    median of the recorded times. Keep one history per server, as servers
+    differ in speed. See JobTimings and SpittalPond(job_history=...).
+    """
+
+    def __init__(self, path, max_samples=50):
+        """ Initiating instance.
+
+        Args:
+            path (str): path of the JSON history file.
+            max_samples (int, optional): the most recent durations to keep
+                of each task type.
+        """
+        self.store = JsonStore(path)
+        self.max_samples = max_samples
+
+    def record(self, task_type, seconds, input_bytes=None):
+        """ Adds how long a job took.
+
+        Args:
+            task_type (str): the job's task type, i.e. 'GUL'.
+            seconds (float): how long it took.
+            input_bytes (int, optional): size of its input.
+        """
+        sample = [seconds, input_bytes, time.time()]
+
+        def change(data):
+            samples = list(data.get(task_type, [])) + [sample]
+            data[task_type] = samples[-self.max_samples:]
+        self.store.modify(change)
+
+    def samples(self, task_type):
+        """ list: the [seconds, input_bytes, recorded] of a task type. """
+        return [list(sample) for sample in self.store.get(task_type, [])]
+
+    def expected(self, task_type, input_bytes=None):
+        """ Predicts how long a job will take.
+
+        Args:
+            task_type (str): the job's task type.
+            input_bytes (int, optional): size of its input.
+
+        Returns:
+            float: the expected seconds, None if the type was never seen.
+        """
+        samples = self.samples(task_type)
+        if not samples:
+            return None
+        sized = [(size, seconds) for seconds, size, _ in samples
+                 if size is not None]
+        if input_bytes is not None and len(set(s for s, _ in sized)) > 1:
+            # Least squares fit of seconds = intercept + slope * size.
+            mean_size = sum(s for s, _ in sized) / float(len(sized))
+            mean_seconds = sum(t for _, t in sized) / float(len(sized))
+            covariance = sum((s - mean_size) * (t - mean_seconds)
+                             for s, t in sized)
+            variance = sum((s - mean_size) ** 2 for s, _ in sized)
+            slope = covariance / variance
+            if slope >= 0:
+                intercept = mean_seconds - slope * mean_size
+                return max(intercept + slope * input_bytes, 0.0)
+        seconds = sorted(sample[0] for sample in samples)
+        middle = len(seconds) // 2
+        if len(seconds) % 2:
+            return seconds[middle]
+        return (seconds[middle - 1] + seconds[middle]) / 2.0
+
+    def task_types(self):
+        """ list: the task types with a recorded duration. """
+        return sorted(self.store.keys())
+
+def directory_bytes(directory_path):
+    """ int: the total size of the files in a directory. """
+    return sum(
+        os.path.getsize(path) for path in glob.glob(directory_path + "*")
+        if os.path.isfile(path)
+    )
@@ -0,0 +1,78 @@
+import json
+
+from .spittalstore import JsonStore
+
+class SpittalJournal(object):
+    """ A durable local record of a pipeline's data_dict state.
+
+    The model, exposure and run instances each write their data_dict here
+    after every state transition: a file uploaded, a structure created, a
+    job queued or seen done. A new process can then resume() from the last
+    checkpoint, skipping work that was already done instead of starting
+    over from upload_directory().
+    """
+
+    def __init__(self, path):
+        """ Initiating instance.
+
+        Args:
+            path (str): path of the JSON journal file.
+        """
+        self.store = JsonStore(path)
+
+    def save(self, name, data_dict):
+        """ Checkpoints the data_dict of the named instance.
+
+        Args:
+            name (str): which instance it is, i.e. 'model'.
+            data_dict (dict): its current data_dict.
+        """
+        # A deep copy, the live data_dict keeps changing.
+        self.store.set(name, json.loads(json.dumps(data_dict)))
+
+    def load(self, name):
+        """ Returns the last checkpointed data_dict of the named instance. """
+        return json.loads(json.dumps(self.store.get(name, {})))
+
+    def record_upload(self, name, data_name, entry):
+        """ Checkpoints one finished upload of an upload_directory() call.
+
+        upload_directory() only fills in the data_dict once all files are
+        uploaded, so the files done so far are kept here in the meantime.
+
+        Args:
+            name (str): which instance it is, i.e. 'model'.
+            data_name (str): the file's data_dict key.
+            entry (dict): the file's data_dict entry.
+        """
+        self.store.update(name + " uploads", {data_name: entry})
+
+    def uploaded(self, name, data_name):
+        """ Returns a checkpointed upload's data_dict entry, or None. """
+        entry = self.store.get(name + " uploads", {}).get(data_name)
+        if entry is None:
+            return None
+        return dict(entry)
+
+    def set_run_id(self, name, run_id):
+        """ Saves the run_id that the named instance's forks are kept under.
+        """
+        self.store.set(name + " run", run_id)
+
+    def run_id(self, name):
+        """ Returns the named instance's saved run_id, or None. """
+        return self.store.get(name + " run")
+
+    def clear(self, name):
+        """ Forgets everything checkpointed for the named instance.
+
+        The state of its forks (see SpittalBase.fork()), named after it, is
+        forgotten too.
+        """
+        def change(data):
+            for key in list(data):
+                if key.startswith(name + "/"):
+                    del data[key]
+            for key in (name, name + " uploads", name + " run"):
+                data.pop(key, None)
+        self.store.modify(change)
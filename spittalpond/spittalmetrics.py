@@ -0,0 +1,242 @@
+import json
+import threading
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+def endpoint_template(url):
+    """ Returns the endpoint a request URL is for.
+
+    The IDs and names in the path are dropped, so all calls of one Django
+    view are counted together, i.e.
+    http://host:8000/oasis/statusAsync/1/42/ is 'statusAsync'.
+
+    Args:
+        url (str): the request URL.
+
+    Returns:
+        str: the endpoint name, or the whole path if it is not an /oasis/ one.
+    """
+    parts = [part for part in urlparse(url).path.split("/") if part]
+    if len(parts) >= 2 and parts[0] == "oasis":
+        return parts[1]
+    return "/" + "/".join(parts)
+
+def body_length(data):
+    """ Returns the size in bytes of a request body, None if unknown. """
+    if data is None:
+        return 0
+    if isinstance(data, dict):
+        return None
+    try:
+        return len(data)
+    except TypeError:
+        return None
+
+class Histogram(object):
+    """ Counts values into fixed, exponentially growing buckets.
+
+    Cheap to update and to merge, and good enough for percentiles: a value
+    is known to within a factor of the bucket growth.
+    """
+
+    def __init__(self, smallest=0.001, factor=2.0, buckets=18):
+        """ Initiating instance.
+
+        Args:
+            smallest (float, optional): upper bound of the first bucket.
+            factor (float, optional): growth of each next bucket's bound.
+            buckets (int, optional): number of bounded buckets. One more
+                bucket holds everything above the last bound.
+        """
+        self.bounds = [smallest * factor ** i for i in range(buckets)]
+        self.counts = [0] * (buckets + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """ Counts one value. """
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """ Adds the counts of a histogram with the same buckets. """
+        assert self.bounds == other.bounds, "Histogram buckets differ"
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def mean(self):
+        """ float: the mean of the values, None if there are none. """
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def quantile(self, q):
+        """ Estimates a quantile, interpolating within its bucket.
+
+        Args:
+            q (float): the quantile, from 0 to 1, i.e. 0.99.
+
+        Returns:
+            float: the estimate, None if there are no values.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[i - 1] if i else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                lower = max(lower, self.min)
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def to_dict(self):
+        """ dict: the histogram as plain data, i.e. for json.dump(). """
+        return {
+            'bounds': self.bounds,
+            'counts': self.counts,
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+        }
+
+class RequestMetrics(object):
+    """ A request hook that aggregates requests per endpoint.
+
+    Add it to a transport with SpittalTransport.add_hook(). Per endpoint it
+    keeps the request count, status codes, errors, retries, bytes sent and
+    received and a latency histogram. SpittalPond adds one as its metrics.
+
+    Example:
+
+        >>> spittal.metrics.report()
+        >>> spittal.metrics.endpoint('statusAsync')['latency'].quantile(0.99)
+        >>> spittal.metrics.dump('metrics.json')
+    """
+
+    def __init__(self):
+        """ Initiating instance. """
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def __call__(self, record):
+        """ Adds one request record, see SpittalTransport.do_request(). """
+        with self.lock:
+            stats = self.endpoints.get(record['endpoint'])
+            if stats is None:
+                stats = self.endpoints[record['endpoint']] = {
+                    'requests': 0,
+                    'errors': 0,
+                    'retries': 0,
+                    'statuses': {},
+                    'request_bytes': 0,
+                    'response_bytes': 0,
+                    'latency': Histogram(),
+                }
+            stats['requests'] += 1
+            stats['retries'] += record['retries']
+            if record['error'] is not None:
+                stats['errors'] += 1
+            status = str(record['status'])
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            stats['request_bytes'] += record['request_bytes'] or 0
+            stats['response_bytes'] += record['response_bytes'] or 0
+            stats['latency'].add(record['latency'])
+
+    def endpoint(self, name):
+        """ dict: the stats of one endpoint, None if it was never called. """
+        with self.lock:
+            return self.endpoints.get(name)
+
+    def reset(self):
+        """ Forgets everything recorded so far. """
+        with self.lock:
+            self.endpoints = {}
+
+    def summary(self):
+        """ Returns the stats of every endpoint as plain data.
+
+        Returns:
+            dict: by endpoint; requests, errors, retries, statuses, bytes
+            and the latency histogram with its mean, p50, p90 and p99.
+        """
+        with self.lock:
+            summary = {}
+            for name, stats in self.endpoints.items():
+                latency = stats['latency']
+                summary[name] = dict(stats, latency=dict(
+                    latency.to_dict(),
+                    mean=latency.mean(),
+                    p50=latency.quantile(0.5),
+                    p90=latency.quantile(0.9),
+                    p99=latency.quantile(0.99)
+                ))
+                summary[name]['statuses'] = dict(stats['statuses'])
+            return summary
+
+    def dump(self, path):
+        """ Writes summary() to a JSON file. """
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=1, sort_keys=True)
+
+    def report(self):
+        """ A text table of the endpoints, by total time spent.
+
+        Returns:
+            str: the report.
+        """
+        summary = self.summary()
+        lines = ["{name:<32} {n:>6} {err:>4} {total:>9} {mean:>8} {p50:>8} "
+                 "{p99:>8} {sent:>11} {recv:>11}".format(
+                     name="endpoint",
+                     n="calls",
+                     err="err",
+                     total="total(s)",
+                     mean="mean(s)",
+                     p50="p50(s)",
+                     p99="p99(s)",
+                     sent="sent(B)",
+                     recv="recv(B)"
+                 )]
+        for name in sorted(summary,
+                           key=lambda n: -summary[n]['latency']['total']):
+            stats = summary[name]
+            latency = stats['latency']
+            lines.append(
+                "{name:<32} {n:>6} {err:>4} {total:>9.3f} {mean:>8.4f} "
+                "{p50:>8.4f} {p99:>8.4f} {sent:>11} {recv:>11}".format(
+                    name=name,
+                    n=stats['requests'],
+                    err=stats['errors'],
+                    total=latency['total'],
+                    mean=latency['mean'],
+                    p50=latency['p50'],
+                    p99=latency['p99'],
+                    sent=stats['request_bytes'],
+                    recv=stats['response_bytes']
+                )
+            )
+        return "\n".join(lines)
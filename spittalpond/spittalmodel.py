@@ -1,5 +1,6 @@
 import json
-from spittalbase import SpittalBase
+from .spittalbase import SpittalBase
+import requests
 import logging
 
 logger = logging.getLogger('spittalpond')
@@ -7,6 +8,32 @@ logger = logging.getLogger('spittalpond')
 class SpittalModel(SpittalBase):
     """ Handles everything model related. """
 
+    def __init__(self, base_url, pub_user, transport=None, upload_cache=None,
+                 journal=None, journal_name=None, registry=None,
+                 **pool_kwargs):
+        """ Initiating instance.
+
+        Args:
+            registry (ModelRegistry, optional): where loaded models are
+                registered by name, see register_model() and get_model().
+
+        See SpittalBase for the other arguments.
+        """
+        SpittalBase.__init__(
+            self, base_url, pub_user, transport, upload_cache, journal,
+            journal_name, **pool_kwargs
+        )
+        self.registry = registry
+
+    def fork(self, name):
+        """ Returns a new instance for one of several runs, see SpittalBase.
+
+        The fork shares this instance's model registry too.
+        """
+        fork = SpittalBase.fork(self, name)
+        fork.registry = self.registry
+        return fork
+
     def create_version(self, version_type, version_name, module_supplier_id,
                        upload_id, model_key):
         """ Creates a generic version.
@@ -61,12 +88,25 @@ class SpittalModel(SpittalBase):
         """
         ##### Create the Model Structures ####
         logger.info('Creating the model structures.')
-        for type_name, type_ in self.data_dict.iteritems():
+        for type_name, type_ in self.data_dict.items():
             splitname = type_name.replace(".", "_").split("_")
 
             # FIXME: Really bad hack to include exposures_main
             # Need to find my naming conventions.
             bad_exposures_hack = splitname[0] == 'exposures'
+
+            # The uploads this structure is created from. If it has already
+            # been created from the very same uploads, reuse it.
+            created_from = [type_.get('upload_id')]
+            if splitname[0] == 'dict':
+                created_from.append(type_['download_id'])
+            elif bad_exposures_hack:
+                created_from.append(
+                    self.data_dict['correlations_main']['upload_id']
+                )
+            if self.has_created(type_name, created_from):
+                continue
+
             # For dictionary types.
             if splitname[0] == 'dict':
                 creation_response = self.create_dict(
@@ -110,15 +150,101 @@ class SpittalModel(SpittalBase):
             type_['taskId'] = json.loads(
                 creation_response.content
             )['taskId']
+            self.record_created(type_name, created_from)
 
 
         print('Finished creating model strutures.')
 
-    # TODO: Finish creating this method.
-    def get_model(self, model_name):
-        """ Return a previously uploaded model from the database.
+    def register_model(self, model_name):
+        """ Registers the loaded model under a name for get_model().
+
+        Call it once load_models() has finished.
 
         Args:
-            model_name -- The name that the model was uploaded with.
+            model_name (str): the name to find the model by.
+
+        Raises:
+            ValueError: if the instance has no model registry.
+        """
+        if self.registry is None:
+            raise ValueError(
+                "Cannot register model {model}: no model registry, pass "
+                "registry= (or SpittalPond(model_registry=...))".format(
+                    model=model_name
+                )
+            )
+        for type_name, type_ in self.data_dict.items():
+            if type_name == "correlations_main":
+                continue
+            assert 'taskId' in type_ and 'job_id' in type_,\
+                "Model not loaded yet: {name}".format(name=type_name)
+        self.registry.register(self.base_url, model_name, self.data_dict)
+        logger.info("Registered model " + model_name)
+
+    def get_model(self, model_name, config_id=1):
+        """ Return a previously loaded model from the database.
+
+        The model is looked up in the registry and then checked against the
+        server: every job that loaded it has to still be done. A model that
+        fails the check is dropped from the registry. One whose jobs could
+        not be checked, as the server did not answer, is kept for next time.
+
+        On success the model's data_dict becomes this instance's data_dict,
+        ready to be passed on to SpittalExposure.create_exposure_structure().
+
+        Args:
+            model_name (str): The name that the model was registered with.
+            config_id (int, optional): config that the jobs were created with.
+
+        Returns:
+            dict: the model's data_dict, None if there is no such model or
+            no model registry.
         """
-        pass
+        if self.registry is None:
+            logger.warning(
+                "No model registry to get model {model} from".format(
+                    model=model_name
+                )
+            )
+            return None
+        data_dict = self.registry.lookup(self.base_url, model_name)
+        if data_dict is None:
+            logger.info("No registered model " + model_name)
+            return None
+
+        for type_name, type_ in data_dict.items():
+            if 'job_id' not in type_:
+                continue
+            try:
+                status = self.job_status(type_['job_id'], config_id)
+            except requests.exceptions.RequestException as exc:
+                # SpittalRequestError included: the server's answer was an
+                # error, or it did not answer.
+                logger.warning(
+                    "Could not check model {model}, {name} job {id}: "
+                    "{error}".format(
+                        model=model_name,
+                        name=type_name,
+                        id=type_['job_id'],
+                        error=exc
+                    )
+                )
+                return None
+            except (ValueError, KeyError) as exc:
+                status = str(exc)
+            if status != 'done':
+                logger.warning(
+                    "Model {model} is stale, {name} job {id}: {status}".format(
+                        model=model_name,
+                        name=type_name,
+                        id=type_['job_id'],
+                        status=status
+                    )
+                )
+                self.registry.forget(self.base_url, model_name)
+                return None
+
+        self.data_dict = data_dict
+        self.checkpoint()
+        logger.info("Got model " + model_name)
+        return self.data_dict
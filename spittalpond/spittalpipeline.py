@@ -0,0 +1,345 @@
+import time
+import logging
+from multiprocessing.pool import ThreadPool
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+logger = logging.getLogger('spittalpond')
+
+class SpittalPipelineError(Exception):
+    """ Raised when a stage of a pipeline fails.
+
+    Attributes:
+        stage (str): name of the failed stage.
+        error (Exception): the exception the stage raised.
+    """
+
+    def __init__(self, stage, error):
+        self.stage = stage
+        self.error = error
+        Exception.__init__(
+            self,
+            "Pipeline stage {stage} failed: {error}".format(
+                stage=stage,
+                error=error
+            )
+        )
+
+class SpittalPipeline(object):
+    """ Runs a dependency graph of stages, each as soon as it can.
+
+    Every stage is a callable with the names of the stages it depends on.
+    A stage starts as soon as all of its dependencies are done, so stages
+    that do not depend on each other run in parallel.
+
+    Example:
+
+        >>> pipeline = SpittalPipeline()
+        >>> pipeline.add_stage("upload", upload)
+        >>> pipeline.add_stage("random", make_random_numbers)
+        >>> pipeline.add_stage("gul", make_gul, ["upload", "random"])
+        >>> pipeline.run()
+        >>> print(pipeline.report())
+
+    With a JobHistory each stage's duration is recorded, and eta() then
+    predicts, from earlier runs, when the pipeline will be done.
+    """
+
+    def __init__(self, max_workers=4, job_timings=None, history=None,
+                 on_success=None):
+        """ Initiating instance.
+
+        Args:
+            max_workers (int, optional): max stages to run at once.
+            job_timings (JobTimings, optional): where the stages' jobs are
+                recorded, to add them to the report().
+            history (JobHistory, optional): where stage durations are kept
+                across runs, see spittalhistory.
+            on_success (callable, optional): called with no arguments once
+                every stage of a run is done, i.e. to clear a journal.
+        """
+        self.max_workers = max_workers
+        self.job_timings = job_timings
+        self.history = history
+        self.on_success = on_success
+        # Wall-clock start and end of the last run.
+        self.started = None
+        self.finished = None
+        self.stages = {}
+        # Stage names in the order they were added.
+        self.order = []
+        self.results = {}
+        self.timings = {}
+        # Wall-clock start of each stage of the last run.
+        self.stage_starts = {}
+        self.input_bytes = {}
+
+    def add_stage(self, name, func, depends_on=(), input_bytes=None):
+        """ Adds a stage to the pipeline.
+
+        Args:
+            name (str): unique name of the stage.
+            func (callable): called with no arguments to run the stage.
+            depends_on (list, optional): names of the stages that have to be
+                done before this one starts.
+            input_bytes (int, optional): size of the stage's input, to
+                predict its duration by.
+        """
+        assert name not in self.stages,\
+            "Duplicate pipeline stage: {name}".format(name=name)
+        self.stages[name] = (func, list(depends_on))
+        self.order.append(name)
+        self.input_bytes[name] = input_bytes
+
+    def dependencies(self, name):
+        """ list: names of the stages the given stage depends on. """
+        return self.stages[name][1]
+
+    def check(self):
+        """ Checks that all dependencies exist and that there is no cycle.
+
+        Raises:
+            ValueError: if the graph is not a valid DAG.
+        """
+        for name in self.order:
+            for dependency in self.dependencies(name):
+                if dependency not in self.stages:
+                    raise ValueError(
+                        "Stage {name} depends on unknown stage "
+                        "{dependency}".format(name=name, dependency=dependency)
+                    )
+        # Kahn's algorithm, anything left over is in a cycle.
+        remaining = dict(
+            (name, set(self.dependencies(name))) for name in self.order
+        )
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(
+                    "Pipeline stages form a cycle: {names}".format(
+                        names=", ".join(sorted(remaining))
+                    )
+                )
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def run(self):
+        """ Runs every stage, each as soon as its dependencies are done.
+
+        If a stage fails no new stages are started; the running ones are
+        left to finish and then the failure is raised.
+
+        Returns:
+            dict: the return value of each stage, by name.
+
+        Raises:
+            SpittalPipelineError: if any stage raised an exception.
+        """
+        self.check()
+        self.results = {}
+        self.timings = {}
+        self.stage_starts = {}
+        waiting = dict(
+            (name, set(self.dependencies(name))) for name in self.order
+        )
+        finished = Queue()
+        pool = ThreadPool(self.max_workers)
+        running = 0
+        failure = None
+        pipeline_start = time.time()
+        self.started = pipeline_start
+        self.finished = None
+        try:
+            while True:
+                if failure is None:
+                    ready = [name for name in self.order
+                             if name in waiting and not waiting[name]]
+                    for name in ready:
+                        del waiting[name]
+                        logger.info("Starting pipeline stage " + name)
+                        pool.apply_async(
+                            self._run_stage,
+                            (name, pipeline_start, finished)
+                        )
+                        running += 1
+                if not running:
+                    break
+                name, error = finished.get()
+                running -= 1
+                if error is not None:
+                    logger.error(
+                        "Pipeline stage {name} failed: {error}".format(
+                            name=name,
+                            error=error
+                        )
+                    )
+                    if failure is None:
+                        failure = SpittalPipelineError(name, error)
+                    continue
+                eta = self.eta()
+                if eta is None:
+                    logger.info("Finished pipeline stage " + name)
+                else:
+                    logger.info(
+                        "Finished pipeline stage {name}, about {eta:.1f}s "
+                        "left".format(name=name, eta=eta)
+                    )
+                for deps in waiting.values():
+                    deps.discard(name)
+        finally:
+            pool.close()
+            pool.join()
+            self.finished = time.time()
+
+        if failure is not None:
+            raise failure
+        if self.on_success is not None:
+            self.on_success()
+        return self.results
+
+    def _run_stage(self, name, pipeline_start, finished):
+        """ Runs one stage on a worker and reports back through finished. """
+        func = self.stages[name][0]
+        self.stage_starts[name] = time.time()
+        start = self.stage_starts[name] - pipeline_start
+        error = None
+        try:
+            try:
+                self.results[name] = func()
+            except BaseException as exc:
+                # Not raised on: a pool worker that dies leaves its task
+                # unfinished, and run() could never join the pool.
+                error = exc
+            end = time.time() - pipeline_start
+            self.timings[name] = (start, end)
+            if error is None and self.history is not None:
+                try:
+                    self.history.record(
+                        self.history_key(name),
+                        end - start,
+                        self.input_bytes[name]
+                    )
+                except Exception as exc:
+                    logger.warning(
+                        "Could not record pipeline stage {name}: "
+                        "{error}".format(name=name, error=exc)
+                    )
+        finally:
+            # Always report back, or run() would wait for this stage forever.
+            finished.put((name, error))
+
+    @staticmethod
+    def history_key(name):
+        """ str: the task type a stage's durations are recorded under. """
+        return "stage:" + name
+
+    def expected(self, name):
+        """ float: the expected seconds of a stage, None if unknown. """
+        if self.history is None:
+            return None
+        return self.history.expected(
+            self.history_key(name),
+            self.input_bytes[name]
+        )
+
+    def eta(self):
+        """ Predicts the seconds left until the pipeline is done.
+
+        Each stage is expected to take as long as it did before, see
+        expected(), and to start once its dependencies are done, so the
+        estimate is the longest chain of stages still to do. A running
+        stage counts for its expected time less the time it has run. Call
+        it before run() for the whole pipeline, or from another thread
+        while it runs.
+
+        Returns:
+            float: the seconds left, None if no stage has a history.
+        """
+        now = time.time()
+        ends = {}
+        known = [False]
+
+        def end(name):
+            if name not in ends:
+                if name in self.timings:
+                    ends[name] = 0.0
+                    return 0.0
+                expected = self.expected(name)
+                if expected is None:
+                    expected = 0.0
+                else:
+                    known[0] = True
+                start = max([end(dep) for dep in self.dependencies(name)] +
+                            [0.0])
+                if name in self.stage_starts:
+                    expected -= now - self.stage_starts[name]
+                ends[name] = start + max(expected, 0.0)
+            return ends[name]
+
+        left = max([end(name) for name in self.order] + [0.0])
+        if not known[0]:
+            return None
+        return left
+
+    def critical_path(self):
+        """ The chain of stages that decided the last run's wall time.
+
+        Starting from the stage that finished last, each step goes back to
+        the dependency that finished last, as that is the one the stage was
+        waiting for.
+
+        Returns:
+            list: (name, seconds) of each stage on the path, first to last.
+        """
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda stage: self.timings[stage][1])
+        path = []
+        while name is not None:
+            start, end = self.timings[name]
+            path.append((name, end - start))
+            deps = [dep for dep in self.dependencies(name)
+                    if dep in self.timings]
+            name = None
+            if deps:
+                name = max(deps, key=lambda dep: self.timings[dep][1])
+        path.reverse()
+        return path
+
+    def report(self):
+        """ A text table of the last run's stage timings.
+
+        Stages on the critical path are marked with a '*'. With job_timings
+        the jobs queued during the run follow, by task type.
+
+        Returns:
+            str: the report.
+        """
+        critical = set(name for name, _ in self.critical_path())
+        lines = ["{mark} {name:<24} {start:>9} {end:>9} {took:>9}".format(
+            mark=" ",
+            name="stage",
+            start="start(s)",
+            end="end(s)",
+            took="took(s)"
+        )]
+        for name in sorted(self.timings, key=lambda n: self.timings[n][0]):
+            start, end = self.timings[name]
+            lines.append(
+                "{mark} {name:<24} {start:>9.2f} {end:>9.2f} {took:>9.2f}"
+                .format(
+                    mark="*" if name in critical else " ",
+                    name=name,
+                    start=start,
+                    end=end,
+                    took=end - start
+                )
+            )
+        if self.job_timings is not None and self.started is not None:
+            lines.append("")
+            lines.append(self.job_timings.report(self.started, self.finished))
+        return "\n".join(lines)
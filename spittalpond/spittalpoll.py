@@ -0,0 +1,160 @@
+import random
+import time
+
+class FixedPolling(object):
+    """ Polls a job's status at a fixed interval.
+
+    This is the behaviour wait_until_done() has always had.
+    """
+
+    def __init__(self, wait_time=5):
+        """ Initiating instance.
+
+        Args:
+            wait_time (float, optional): seconds to wait between each check.
+        """
+        self.wait_time = wait_time
+
+    def intervals(self):
+        """ Yields the seconds to wait before each following status check. """
+        while True:
+            yield self.wait_time
+
+class BackoffPolling(object):
+    """ Polls a job's status with capped, jittered exponential backoff.
+
+    Short jobs are seen finishing soon after they do, while long jobs are
+    not polled needlessly often. The jitter keeps many waiters that started
+    together from polling the status endpoint in lock step.
+    """
+
+    def __init__(self, initial_wait=0.25, factor=2.0, max_wait=30,
+                 jitter=0.1):
+        """ Initiating instance.
+
+        Args:
+            initial_wait (float, optional): seconds before the second check.
+            factor (float, optional): growth of the wait after each check.
+            max_wait (float, optional): the cap on any single wait.
+            jitter (float, optional): fraction by which each wait is
+                randomly lengthened or shortened.
+        """
+        self.initial_wait = initial_wait
+        self.factor = factor
+        self.max_wait = max_wait
+        self.jitter = jitter
+
+    def intervals(self):
+        """ Yields the seconds to wait before each following status check. """
+        wait = self.initial_wait
+        while True:
+            jittered = wait * (1 + random.uniform(-self.jitter, self.jitter))
+            yield min(jittered, self.max_wait)
+            wait = min(wait * self.factor, self.max_wait)
+
+class ExpectedPolling(object):
+    """ Polls a job first around when it is expected to be done.
+
+    The expected time comes from the history of earlier jobs of the same
+    type, see spittalhistory. Until then the status is not checked at all;
+    after it, the checks follow the policy given, so a job that runs late
+    is still seen finishing soon after it does.
+    """
+
+    def __init__(self, expected_at, after=None):
+        """ Initiating instance.
+
+        Args:
+            expected_at (float): the time, as time.time(), the job is
+                expected to be done at.
+            after (optional): the policy to poll by once that time has
+                come, BackoffPolling() by default.
+        """
+        self.expected_at = expected_at
+        self.after = after or BackoffPolling()
+
+    @property
+    def first_wait(self):
+        """ float: seconds left until the job is expected to be done. """
+        return max(self.expected_at - time.time(), 0.0)
+
+    def intervals(self):
+        """ Yields the seconds to wait before each following status check. """
+        return self.after.intervals()
+
+def first_wait(policy, timeout=None):
+    """ Returns the seconds to wait before a job's first status check.
+
+    Most policies check straight away; an ExpectedPolling waits until the
+    job is expected to be done, though never longer than timeout.
+    """
+    wait = getattr(policy, 'first_wait', 0)
+    if timeout is not None:
+        wait = min(wait, timeout)
+    return wait
+
+class RetryPolicy(BackoffPolling):
+    """ How SpittalTransport retries a request that failed in transit.
+
+    The waits between attempts back off as in BackoffPolling. Only calls
+    that are safe to repeat are retried on any transient failure: status
+    checks, downloads and the login. Calls that create an object or queue
+    a job are retried only when they cannot have reached the server, see
+    SpittalTransport.should_retry().
+    """
+
+    def __init__(self, retries=3, initial_wait=0.5, factor=2.0, max_wait=10,
+                 jitter=0.1, statuses=(500, 502, 503, 504),
+                 retry_creates=False):
+        """ Initiating instance.
+
+        Args:
+            retries (int, optional): max retries of one request, 0 to never
+                retry.
+            initial_wait (float, optional): seconds before the first retry.
+            factor (float, optional): growth of the wait after each retry.
+            max_wait (float, optional): the cap on any single wait.
+            jitter (float, optional): fraction by which each wait is
+                randomly lengthened or shortened.
+            statuses (tuple, optional): HTTP status codes that are retried.
+            retry_creates (bool, optional): also retry create* calls like
+                safe ones. A create that did reach the server then leaves an
+                unused duplicate object behind, which is harmless but not
+                free.
+        """
+        super(RetryPolicy, self).__init__(
+            initial_wait, factor, max_wait, jitter
+        )
+        self.retries = retries
+        self.statuses = statuses
+        self.retry_creates = retry_creates
+
+def poll_schedule(policy, timeout=None, max_iters=None, start_time=None):
+    """ Yields the waits between the status checks of one job.
+
+    Stops once the deadline (start_time + timeout) is reached or, when no
+    timeout is given, after max_iters checks. A wait is never longer than
+    the time left to the deadline, so the last check lands on it.
+
+    Args:
+        policy (FixedPolling or BackoffPolling): the polling policy.
+        timeout (float, optional): seconds of wall-clock time to wait for.
+        max_iters (int, optional): max checks, used if timeout is None.
+        start_time (float, optional): when the wait started, now by default.
+    """
+    if start_time is None:
+        start_time = time.time()
+    deadline = None
+    if timeout is not None:
+        deadline = start_time + timeout
+    checks = 1
+    for wait in policy.intervals():
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            wait = min(wait, remaining)
+        elif max_iters is not None and checks >= max_iters:
+            return
+        checks += 1
+        yield wait
@@ -1,7 +1,27 @@
-from spittalmodel import SpittalModel
-from spittalexposure import SpittalExposure
-from spittalrun import SpittalRun
+from .spittalmodel import SpittalModel
+from .spittalexposure import SpittalExposure
+from .spittalrun import SpittalRun
+from .spittaltransport import SpittalTransport
+from .spittalpipeline import SpittalPipeline
+from .spittalcache import UploadCache
+from .spittaljournal import SpittalJournal
+from .spittalregistry import ModelRegistry
+from .spittalmetrics import RequestMetrics
+from .spittaltiming import JobTimings
+from .spittalhistory import JobHistory, directory_bytes
+from .spittalvalidate import validate_directories
+from .spittalrun import SpittalFanOutError
+from .spittalshard import split_exposure, merge_gul_files
+from .spittalanalytics import analyse_gul_csv
+from .spittalstore import JsonStore
+from .spittalbase import map_isolated
 import logging
+import os
+import shutil
+import tempfile
+import time
+
+logger = logging.getLogger('spittalpond')
 
 class SpittalPond():
     """ Python interface to the Oasis Django API.
@@ -11,13 +31,36 @@ class SpittalPond():
     """
 
     def __init__(self, base_url, user,
-                 log_file=None, log_level=logging.INFO):
+                 log_file=None, log_level=logging.INFO, upload_cache=None,
+                 journal=None, model_registry=None, job_history=None,
+                 **pool_kwargs):
         """ Initiate with server URL and user.
 
+        The model, exposure and run facades share a single transport, so
+        they share one login and one connection pool.
+
         Args:
             base_url (str): The URL of the Django server. Be sure to prepend
                 the protocol (i.e. http://) and append the port (i.e. :8000).
             user (str): Username to use on the server.
+            upload_cache (str or UploadCache, optional): manifest of files
+                already uploaded, or a path to keep one at. Unchanged files
+                are then not uploaded, created and loaded again. Runs in
+                several processes can share one, see JsonStore.
+            journal (str or SpittalJournal, optional): journal, or a path
+                to keep one at, that the model, exposure and run state is
+                checkpointed to. See resume().
+            model_registry (str or ModelRegistry, optional): registry, or
+                a path to keep one at, of loaded models by name. See
+                SpittalModel.get_model(). Can be shared like upload_cache.
+            job_history (str or JobHistory, optional): history, or a path
+                to keep one at, of how long jobs and pipeline stages took.
+                The first status check of a job is then held until it is
+                expected to be done, and pipelines can tell their eta().
+                Can be shared like upload_cache.
+            **pool_kwargs: connection pool settings for the shared
+                SpittalTransport (pool_connections, pool_maxsize,
+                pool_block, keep_alive, timeout and retry_policy).
         """
 
         logger = logging.getLogger('spittalpond')
@@ -32,6 +75,514 @@ class SpittalPond():
             logger.setLevel(log_level)
 
         logger.info('Initating new spittalpond instance.')
-        self.model = SpittalModel(base_url, user)
-        self.exposure = SpittalExposure(base_url, user)
-        self.run = SpittalRun(base_url, user)
+        if upload_cache is not None and not isinstance(upload_cache,
+                                                       UploadCache):
+            upload_cache = UploadCache(upload_cache)
+        self.upload_cache = upload_cache
+        if journal is not None and not isinstance(journal, SpittalJournal):
+            journal = SpittalJournal(journal)
+        self.journal = journal
+        if model_registry is not None and not isinstance(model_registry,
+                                                         ModelRegistry):
+            model_registry = ModelRegistry(model_registry)
+        self.model_registry = model_registry
+        if job_history is not None and not isinstance(job_history,
+                                                      JobHistory):
+            job_history = JobHistory(job_history)
+        self.job_history = job_history
+
+        self.transport = SpittalTransport(base_url, user, **pool_kwargs)
+        # Per endpoint request stats, see RequestMetrics.report().
+        self.metrics = RequestMetrics()
+        self.transport.add_hook(self.metrics)
+        # Queue, poll and completion times of every job.
+        self.job_timings = JobTimings(job_history)
+        self.model = SpittalModel(
+            base_url, user, self.transport, upload_cache, journal, "model",
+            model_registry, job_timings=self.job_timings
+        )
+        self.exposure = SpittalExposure(
+            base_url, user, self.transport, upload_cache, journal, "exposure",
+            job_timings=self.job_timings
+        )
+        self.run = SpittalRun(
+            base_url, user, self.transport, upload_cache, journal, "run",
+            job_timings=self.job_timings
+        )
+
+    def do_login(self, password):
+        """ Logs the shared transport into the Oasis Django mid-tier.
+
+        One login authenticates the model, exposure and run facades.
+
+        Args:
+            password (str): server Djanger user password.
+        """
+        self.transport.do_login(password)
+
+    def resume(self):
+        """ Restores the model, exposure and run state from the journal.
+
+        Use it in a new process after a crash or restart, then log in and
+        run the same steps (or pipeline) again: uploads, structures and
+        server jobs that are already done are skipped, and jobs still on
+        the job queue are waited for rather than queued again.
+        """
+        for facade in (self.model, self.exposure, self.run):
+            facade.resume()
+
+    def clear_journal(self):
+        """ Forgets the model, exposure and run state kept in the journal.
+
+        Done once a pipeline has run through, so that a later run does not
+        mistake that state for work of its own.
+        """
+        if self.journal is None:
+            return
+        for facade in (self.model, self.exposure, self.run):
+            self.journal.clear(facade.journal_name)
+            facade.resuming = False
+
+    def close(self):
+        """ Closes all pooled connections of the shared transport. """
+        self.transport.close()
+
+    def create_pipeline(self, model_directory, exposure_directory, gul_name,
+                        gul_filename, module_supplier_id, target=None,
+                        do_timestamps=True, upload_workers=1, policy=None,
+                        max_workers=4, model_name=None, validate=False):
+        """ Builds the model -> exposure -> GUL run as a pipeline.
+
+        The stages and what they really depend on:
+
+            - validate: nothing, only there if validate is set.
+            - model_upload, exposure_upload: validate.
+            - random_numbers: nothing.
+            - model_structures: model_upload.
+            - model_load: model_structures.
+            - exposure_structures: model_structures and exposure_upload.
+            - exposure_load: exposure_structures and model_load.
+            - benchmark: exposure_load.
+            - gul_create: benchmark and random_numbers.
+            - gul_get: gul_create.
+
+        With a model_name, a model registered under that name is reused
+        (see SpittalModel.get_model()): the three model stages are replaced
+        by a single model_get stage. Otherwise the model is registered under
+        that name once it is loaded.
+
+        Call run() on the returned pipeline, then report() or
+        critical_path() to see where the time went; the report includes
+        the run's jobs by task type. With a job_history, eta() predicts
+        how long the pipeline will take. Once it has run through, the
+        journal is cleared, see clear_journal(). Log in first.
+
+        Args:
+            model_directory (str): path of the model files to upload.
+            exposure_directory (str): path of the exposure files to upload.
+            gul_name (str): the user friendly name of the GUL to create.
+            gul_filename (str): the name of the GUL file on the server.
+            module_supplier_id (int): module supplier of the GUL file.
+            target (str or file, optional): where to stream the GUL data,
+                see SpittalRun.get_gul_data().
+            do_timestamps (bool, optional): timestamp the uploaded files.
+            upload_workers (int, optional): files to upload at once.
+            policy (optional): polling policy for the jobs.
+            max_workers (int, optional): max stages to run at once.
+            model_name (str, optional): name of the model in the registry.
+            validate (bool or dict, optional): check the model and exposure
+                files together before uploading, see validate_inputs().
+
+        Returns:
+            SpittalPipeline: the pipeline, ready to run.
+        """
+        pipeline = SpittalPipeline(
+            max_workers, self.job_timings, self.job_history,
+            on_success=self.clear_journal
+        )
+        # Input sizes, to predict the stages' durations by.
+        model_bytes = exposure_bytes = all_bytes = None
+        if self.job_history is not None:
+            model_bytes = directory_bytes(model_directory)
+            exposure_bytes = directory_bytes(exposure_directory)
+            all_bytes = model_bytes + exposure_bytes
+        upload_after = []
+        if validate:
+            schemas = validate if isinstance(validate, dict) else None
+            pipeline.add_stage(
+                "validate",
+                lambda: self.validate_inputs(
+                    model_directory, exposure_directory, schemas
+                ),
+                input_bytes=all_bytes
+            )
+            upload_after = ["validate"]
+        model_data_dict = None
+        if model_name is not None and self.model_registry is not None:
+            model_data_dict = self.model.get_model(model_name)
+
+        if model_data_dict is not None:
+            pipeline.add_stage("model_get", lambda: model_data_dict)
+            model_structures = model_load = "model_get"
+        else:
+            model_structures = "model_structures"
+            model_load = "model_load"
+            pipeline.add_stage(
+                "model_upload",
+                lambda: self.model.upload_directory(
+                    model_directory, do_timestamps, workers=upload_workers
+                ),
+                upload_after,
+                model_bytes
+            )
+            pipeline.add_stage(
+                model_structures,
+                self.model.create_model_structures,
+                ["model_upload"]
+            )
+            pipeline.add_stage(
+                model_load,
+                lambda: self._load_model(policy, model_name),
+                [model_structures],
+                model_bytes
+            )
+        pipeline.add_stage(
+            "exposure_upload",
+            lambda: self.exposure.upload_directory(
+                exposure_directory, do_timestamps, workers=upload_workers
+            ),
+            upload_after,
+            exposure_bytes
+        )
+        pipeline.add_stage(
+            "random_numbers",
+            lambda: self.run.auto_create_random_numbers(policy=policy)
+        )
+        pipeline.add_stage(
+            "exposure_structures",
+            lambda: self.exposure.create_exposure_structure(
+                self.model.data_dict
+            ),
+            [model_structures, "exposure_upload"]
+        )
+        pipeline.add_stage(
+            "exposure_load",
+            lambda: self.exposure.load_models(wait=True, policy=policy),
+            ["exposure_structures", model_load],
+            exposure_bytes
+        )
+        pipeline.add_stage(
+            "benchmark",
+            lambda: self.exposure.run_benchmark(policy=policy),
+            ["exposure_load"],
+            exposure_bytes
+        )
+        pipeline.add_stage(
+            "gul_create",
+            lambda: self.run.create_gul_data(
+                gul_name,
+                self.exposure.data_dict['benchmark']['taskId'],
+                self.exposure.data_dict['exposures_instance']['taskId']
+            ),
+            ["benchmark", "random_numbers"],
+            exposure_bytes
+        )
+        pipeline.add_stage(
+            "gul_get",
+            lambda: self.run.get_gul_data(
+                gul_name,
+                gul_filename,
+                module_supplier_id,
+                target=target,
+                policy=policy
+            ),
+            ["gul_create"],
+            exposure_bytes
+        )
+        return pipeline
+
+    def validate_inputs(self, model_directory, exposure_directory,
+                        schemas=None, workers=4):
+        """ Checks the model and exposure files before they are uploaded.
+
+        Both directories are checked together, so the exposure files' IDs
+        are looked up in the model's dictionaries. See spittalvalidate.
+
+        Args:
+            model_directory (str): path of the model files.
+            exposure_directory (str): path of the exposure files.
+            schemas (dict, optional): FileSchema by type name.
+            workers (int, optional): files to check at once.
+
+        Returns:
+            dict: the number of rows of each checked file.
+
+        Raises:
+            SpittalValidationError: if any file failed its checks.
+        """
+        return validate_directories(
+            model_directory, exposure_directory,
+            schemas=schemas, workers=workers
+        )
+
+    def run_sharded(self, exposure_directory, shards, gul_name, gul_filename,
+                    module_supplier_id, target, work_dir=None,
+                    number_of_samples=10, max_concurrent=4, policy=None,
+                    do_timestamps=True):
+        """ Runs an exposure as shards at once, merging their GULs into one.
+
+        The exposure is split into shards of whole groups (see spittalshard), and
+        each shard is uploaded, given an exposure instance and benchmark,
+        and run to a published GUL on forks of the exposure and run
+        facades, up to max_concurrent shards at a time. The shards' GULs
+        are then merged into target, ordered by event and item.
+
+        The model must be loaded first (or got with get_model()). Runs
+        share the run facade's random numbers, made first if there are
+        none. Needs NumPy.
+
+        Args:
+            exposure_directory (str): path of the exposure files to split.
+            shards (int): number of shards.
+            gul_name (str): the user friendly name of the GUL, the shards'
+                GULs are named after it.
+            gul_filename (str): the name of the GUL file on the server, the
+                shards' are named after it.
+            module_supplier_id (int): module supplier of the GUL files.
+            target (str or file): where to write the merged GUL, see
+                spittalshard.merge_gul_files().
+            work_dir (str, optional): where to keep the shard directories
+                and GULs. A temporary directory, removed afterwards, by
+                default.
+            number_of_samples (int, optional): CDF samples of each GUL.
+            max_concurrent (int, optional): shards to run at once.
+            policy (optional): polling policy for the jobs.
+            do_timestamps (bool, optional): timestamp the uploaded files.
+
+        Returns:
+            dict: 'rows' of the merged GUL, and 'shards', for each shard its
+            'directory', 'exposure' and 'run' facades and 'gul' path.
+
+        Raises:
+            SpittalFanOutError: if any shard failed, nothing is merged.
+        """
+        temporary = work_dir is None
+        if temporary:
+            work_dir = tempfile.mkdtemp(prefix="spittalshard")
+        try:
+            directories = split_exposure(exposure_directory, shards, work_dir)
+            self._ensure_random_numbers(policy)
+            outcomes = map_isolated(
+                lambda args: self._run_exposure(
+                    "shard_{n}".format(n=args[0]),
+                    args[1],
+                    self.model.data_dict,
+                    gul_name,
+                    gul_filename,
+                    module_supplier_id,
+                    os.path.join(work_dir,
+                                 "shard_{n}_gul.csv".format(n=args[0])),
+                    number_of_samples,
+                    policy,
+                    do_timestamps
+                ),
+                enumerate(directories),
+                max_concurrent
+            )
+
+            results = {}
+            failures = {}
+            for number, (result, error) in enumerate(outcomes):
+                name = "shard_{n}".format(n=number)
+                if error is not None:
+                    logger.error("Shard {name} failed: {exc!r}".format(
+                        name=name,
+                        exc=error
+                    ))
+                    failures[name] = error
+                else:
+                    results[name] = result
+            if failures:
+                raise SpittalFanOutError(failures, results)
+
+            shard_results = [result for result, _ in outcomes]
+            rows = merge_gul_files(
+                [result['gul'] for result in shard_results],
+                target
+            )
+            return {'rows': rows, 'shards': shard_results}
+        finally:
+            if temporary:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    def run_portfolios(self, model_data_dict, exposure_directories,
+                       output_directory, gul_name="spittalGUL",
+                       gul_filename="gul.csv",
+                       module_supplier_id=1, number_of_samples=10,
+                       max_concurrent=4, policy=None, do_timestamps=True,
+                       analyse=False):
+        """ Runs many portfolios' exposures against one loaded model.
+
+        Each portfolio is uploaded, given exposure structures, loaded,
+        benchmarked and run to a GUL on forks of the exposure and run
+        facades (so all share one login), up to max_concurrent portfolios
+        at a time. A failed portfolio does not stop the others.
+
+        Its GUL is written to output_directory/<name>.csv, and a manifest,
+        output_directory/manifest.json, keeps each portfolio's result. It
+        is updated as each portfolio finishes, with:
+
+            - status: 'done' or 'failed'.
+            - directory: the portfolio's exposure directory.
+            - started, finished: times, in seconds since the epoch.
+            - for done portfolios; gul (the GUL path), bytes,
+              exposures_instance and benchmark (server taskIds), and with
+              analyse, analytics (see GulAnalytics.summary()).
+            - for failed ones; error.
+
+        Args:
+            model_data_dict (dict): the loaded model's data_dict, i.e. from
+                SpittalModel.get_model().
+            exposure_directories (list or dict): paths of the portfolios'
+                exposure directories, or paths by portfolio name. Names are
+                the directory names by default.
+            output_directory (str): where to write the GULs and manifest.
+            gul_name (str, optional): the GULs' user friendly name, before
+                the portfolio name.
+            gul_filename (str, optional): the GUL files' name on the server,
+                after the portfolio name.
+            module_supplier_id (int, optional): of the GUL files.
+            number_of_samples (int, optional): CDF samples of each GUL.
+            max_concurrent (int, optional): portfolios to run at once.
+            policy (optional): polling policy for the jobs.
+            do_timestamps (bool, optional): timestamp the uploaded files.
+            analyse (bool, optional): add each GUL's analytics to the
+                manifest. Needs NumPy.
+
+        Returns:
+            dict: the manifest, by portfolio name.
+
+        Raises:
+            ValueError: if two portfolios have the same name.
+        """
+        if isinstance(exposure_directories, dict):
+            portfolios = sorted(exposure_directories.items())
+        else:
+            portfolios = [
+                (os.path.basename(os.path.normpath(directory)), directory)
+                for directory in exposure_directories
+            ]
+        names = [name for name, _ in portfolios]
+        if len(set(names)) != len(names):
+            raise ValueError("Portfolio names must be unique: " +
+                             ", ".join(names))
+        if not os.path.isdir(output_directory):
+            os.makedirs(output_directory)
+        manifest = JsonStore(os.path.join(output_directory, "manifest.json"))
+        self._ensure_random_numbers(policy)
+
+        def run_portfolio(portfolio):
+            name, directory = portfolio
+            started = time.time()
+            manifest.set(name, {
+                'status': 'running',
+                'directory': directory,
+                'started': started,
+            })
+            try:
+                result = self._run_exposure(
+                    name,
+                    directory,
+                    model_data_dict,
+                    gul_name,
+                    gul_filename,
+                    module_supplier_id,
+                    os.path.join(output_directory, name + ".csv"),
+                    number_of_samples,
+                    policy,
+                    do_timestamps
+                )
+                entry = {
+                    'status': 'done',
+                    'gul': result['gul'],
+                    'bytes': result['download']['bytes'],
+                    'exposures_instance': result['exposure'].data_dict[
+                        'exposures_instance']['taskId'],
+                    'benchmark': result['exposure'].data_dict[
+                        'benchmark']['taskId'],
+                }
+                if analyse:
+                    entry['analytics'] = analyse_gul_csv(
+                        result['gul']
+                    ).summary()
+            except Exception as exc:
+                logger.error("Portfolio {name} failed: {exc!r}".format(
+                    name=name,
+                    exc=exc
+                ))
+                entry = {'status': 'failed', 'error': repr(exc)}
+            entry['finished'] = time.time()
+            manifest.update(name, entry)
+
+        map_isolated(run_portfolio, portfolios, max_concurrent)
+        return dict((name, manifest.get(name)) for name in names)
+
+    def _ensure_random_numbers(self, policy):
+        """ Makes the run facade's random numbers, if there are none. """
+        if 'taskId' not in self.run.data_dict.get('random_instance', {}):
+            self.run.auto_create_random_numbers(policy=policy)
+
+    def _run_exposure(self, name, directory, model_data_dict, gul_name,
+                      gul_filename, module_supplier_id, gul_path,
+                      number_of_samples, policy, do_timestamps):
+        """ Runs one exposure directory to a GUL file, on forks named name.
+
+        The uploaded files, the GUL and its file on the server are named
+        after name, so that several can run at once.
+
+        Returns:
+            dict: the 'directory', the 'exposure' and 'run' forks, the
+            'gul' path and the 'download' metadata.
+        """
+        exposure = self.exposure.fork(name)
+        exposure.upload_directory(
+            directory, do_timestamps, name_prefix=name + "_"
+        )
+        exposure.create_exposure_structure(model_data_dict)
+        exposure.load_models(wait=True, policy=policy)
+        benchmark = exposure.run_benchmark(policy=policy)
+
+        run = self.run.fork(name)
+        # A GUL file already at gul_path is only part of this GUL if the
+        # journal has it published already, otherwise resuming it would
+        # mix two GULs.
+        saved = run.data_dict.get('kernel_pubgul', {}).get('saved')
+        if not saved and os.path.exists(gul_path):
+            os.remove(gul_path)
+        run_gul_name = gul_name + "_" + name
+        run.create_gul_data(
+            run_gul_name,
+            benchmark,
+            exposure.data_dict['exposures_instance']['taskId'],
+            number_of_samples
+        )
+        download = run.get_gul_data(
+            run_gul_name,
+            name + "_" + gul_filename,
+            module_supplier_id,
+            target=gul_path,
+            policy=policy
+        )
+        return {
+            'directory': directory,
+            'exposure': exposure,
+            'run': run,
+            'gul': gul_path,
+            'download': download,
+        }
+
+    def _load_model(self, policy, model_name):
+        """ The model_load stage, registering the model if it is named. """
+        self.model.load_models(wait=True, policy=policy)
+        if model_name is not None and self.model_registry is not None:
+            self.model.register_model(model_name)
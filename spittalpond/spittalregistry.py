@@ -0,0 +1,59 @@
+import json
+import time
+
+from .spittalstore import JsonStore
+
+class ModelRegistry(object):
+    """ A local record of the models loaded on each server, by name.
+
+    Each entry is the data_dict of a fully loaded model: the taskId of
+    every dict and version, and the job_id that loaded it. A new exposure
+    can then be built onto a registered model straight away, instead of
+    uploading, creating and loading the whole model again.
+    See SpittalModel.get_model().
+    """
+
+    def __init__(self, path):
+        """ Initiating instance.
+
+        Args:
+            path (str): path of the JSON registry file.
+        """
+        self.store = JsonStore(path)
+
+    @staticmethod
+    def key(base_url, model_name):
+        """ str: the registry key of a model. """
+        return "{url} {name}".format(url=base_url, name=model_name)
+
+    def register(self, base_url, model_name, data_dict):
+        """ Saves a loaded model's data_dict under its name.
+
+        Args:
+            base_url (str): the server the model is loaded on.
+            model_name (str): the name to find the model by.
+            data_dict (dict): the model's data_dict.
+        """
+        self.store.set(self.key(base_url, model_name), {
+            'data_dict': json.loads(json.dumps(data_dict)),
+            'registered': time.time(),
+        })
+
+    def lookup(self, base_url, model_name):
+        """ Returns a registered model's data_dict, None if not registered. """
+        entry = self.store.get(self.key(base_url, model_name))
+        if entry is None:
+            return None
+        return json.loads(json.dumps(entry['data_dict']))
+
+    def forget(self, base_url, model_name):
+        """ Drops a model, i.e. if it is gone server-side. """
+        self.store.delete(self.key(base_url, model_name))
+
+    def names(self, base_url):
+        """ list: names of the models registered for a server. """
+        prefix = base_url + " "
+        return sorted(
+            key[len(prefix):] for key in self.store.keys()
+            if key.startswith(prefix)
+        )
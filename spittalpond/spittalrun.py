@@ -1,9 +1,45 @@
-from spittalbase import SpittalBase
+from .spittalbase import SpittalBase, map_isolated
+from .spittalstream import DEFAULT_CHUNK_SIZE, TeeSink
+from .spittalgul import GulWriter, GulTable, move_gul_table
+from .spittalanalytics import GulAnalytics
 import json
 import logging
+import shutil
 
 logger = logging.getLogger('spittalpond')
 
+# The settings a fan_out_gul() run configuration may have.
+GUL_CONFIG_KEYS = [
+    'name',
+    'samples',
+    'loss_threshold',
+    'random_numbers',
+    'random_instance',
+    'filename',
+    'module_supplier_id',
+    'target',
+]
+
+class SpittalFanOutError(Exception):
+    """ Raised when one or more GUL chains of a fan-out failed.
+
+    Attributes:
+        failures (dict): the exception raised for each failed run name.
+        results (dict): the results of the runs that did not fail, see
+            SpittalRun.fan_out_gul().
+    """
+
+    def __init__(self, failures, results):
+        self.failures = failures
+        self.results = results
+        Exception.__init__(
+            self,
+            "Failed {num} GUL run(s): {names}".format(
+                num=len(failures),
+                names=", ".join(sorted(failures))
+            )
+        )
+
 class SpittalRun(SpittalBase):
     """ Handles everything related to running the data processs
 
@@ -159,7 +195,8 @@ class SpittalRun(SpittalBase):
                                    number_of_chunks=10,
                                    number_of_rows_per_chunk=1000,
                                    number_of_pages=10,
-                                   number_of_samples_per_page=20):
+                                   number_of_samples_per_page=20,
+                                   policy=None):
         """ Generate random numbers with the default Random Number Table Version.
 
         Much of the time we just want to run Oasis without worry about these
@@ -179,6 +216,8 @@ class SpittalRun(SpittalBase):
             number_of_rows_per_chunk (int, optional):
             number_of_pages (int, optional):
             number_of_samples_per_page (int, optional):
+            policy (optional): polling policy for the jobs, see
+                wait_until_done().
 
         Returns:
             None: Until we figure out something more contructive to return.
@@ -186,6 +225,36 @@ class SpittalRun(SpittalBase):
 
         logger.info("Auto-creating random numbers.")
 
+        self.create_default_random_instance(
+            random_number_table_name,
+            number_of_chunks,
+            number_of_rows_per_chunk,
+            number_of_pages,
+            number_of_samples_per_page
+        )
+
+        # Run both of the jobs in order.
+        self.do_jobs(["version_random", "random_instance"], policy=policy)
+
+        return None
+
+    def create_default_random_instance(self, random_number_table_name,
+                                       number_of_chunks,
+                                       number_of_rows_per_chunk,
+                                       number_of_pages,
+                                       number_of_samples_per_page):
+        """ Creates a random number instance of the default table version.
+
+        This is the creation half of auto_create_random_numbers(), the jobs
+        are not run.
+
+        Args:
+            random_number_table_name (str): A user friendly name for the task.
+            number_of_chunks (int): Self descriptive.
+            number_of_rows_per_chunk (int):
+            number_of_pages (int):
+            number_of_samples_per_page (int):
+        """
         # Check if we need to create the data_dict keys.
         for key in ["version_random", "random_instance"]:
             if not key in self.data_dict:
@@ -194,6 +263,16 @@ class SpittalRun(SpittalBase):
         # Setup the version in the data_dict accordingly.
         self.data_dict["version_random"]["taskId"] = 2
 
+        created_from = [
+            self.data_dict["version_random"]["taskId"],
+            number_of_chunks,
+            number_of_rows_per_chunk,
+            number_of_pages,
+            number_of_samples_per_page,
+        ]
+        if self.has_created("random_instance", created_from):
+            return
+
         # Setup the instance in the data_dict accordingly.
         instance_resp = self.create_random_number_instance(
             random_number_table_name,
@@ -205,76 +284,366 @@ class SpittalRun(SpittalBase):
         )
         self.data_dict["random_instance"]["taskId"] =\
             json.loads(instance_resp.content)['taskId']
+        self.record_created("random_instance", created_from)
 
-        # Run both of the jobs in order.
-        self.do_jobs(["version_random", "random_instance"])
-
-        return None
-
-    def create_gul_data(self, gul_name, benchmark_id, exposure_instance):
+    def create_gul_data(self, gul_name, benchmark_id, exposure_instance,
+                        number_of_samples=10, loss_threshold=0):
         """ Create the ground up loss data based on our exposure instance.
 
         Args:
             gul_name (str): the user friendly name of the gul to create
             benchmark_id (int): the id returned from create_benchmark().
             exposure_instance_id (int): id returned from create_exposure_instance().
+            number_of_samples (int, optional): number of cdf samples to create.
+            loss_threshold (float, optional): losses at or below this are
+                left out of the GUL.
 
         Returns:
             HttpResponse: server's response.
         """
 
         # Create the cdf Django kernel object.
-        self.data_dict['kernel_cdf'] = {}
-        resp = self.create_cdf(gul_name, benchmark_id, exposure_instance)
-        logger.info('Create cdf response: ' + resp.content)
+        created_from = [benchmark_id, exposure_instance]
+        if not self.has_created('kernel_cdf', created_from):
+            self.data_dict['kernel_cdf'] = {}
+            resp = self.create_cdf(gul_name, benchmark_id, exposure_instance)
+            logger.info('Create cdf response: ' + resp.text)
 
-        self.data_dict['kernel_cdf']['taskId'] = json.loads(
-            resp.content
-        )['taskId']
+            self.data_dict['kernel_cdf']['taskId'] = json.loads(
+                resp.content
+            )['taskId']
+            self.record_created('kernel_cdf', created_from)
 
         # Create the cdf_samples Django kernel object.
-        self.data_dict['kernel_cdfsamples'] = {}
-        resp = self.create_cdf_samples(
-            gul_name,
+        created_from = [
             self.data_dict['kernel_cdf']['taskId'],
-            10,
-            self.data_dict['random_instance']['taskId']
-        )
-        logger.info('Create cdf_samples response: ' + resp.content)
+            number_of_samples,
+            self.data_dict['random_instance']['taskId'],
+        ]
+        if not self.has_created('kernel_cdfsamples', created_from):
+            self.data_dict['kernel_cdfsamples'] = {}
+            resp = self.create_cdf_samples(
+                gul_name,
+                self.data_dict['kernel_cdf']['taskId'],
+                number_of_samples,
+                self.data_dict['random_instance']['taskId']
+            )
+            logger.info('Create cdf_samples response: ' + resp.text)
 
-        self.data_dict['kernel_cdfsamples']['taskId'] = json.loads(
-            resp.content
-        )['taskId']
+            self.data_dict['kernel_cdfsamples']['taskId'] = json.loads(
+                resp.content
+            )['taskId']
+            self.record_created('kernel_cdfsamples', created_from)
 
         # Create the GUL Django kernel object.
-        self.data_dict['kernel_gul'] = {}
-        resp = self.create_gul(
-            gul_name,
+        created_from = [
             self.data_dict['kernel_cdfsamples']['taskId'],
-        )
-        logger.info('Create kernel gul response: ' + resp.content)
+            loss_threshold,
+        ]
+        if not self.has_created('kernel_gul', created_from):
+            self.data_dict['kernel_gul'] = {}
+            resp = self.create_gul(
+                gul_name,
+                self.data_dict['kernel_cdfsamples']['taskId'],
+                loss_threshold
+            )
+            logger.info('Create kernel gul response: ' + resp.text)
 
-        self.data_dict['kernel_gul']['taskId'] = json.loads(
-            resp.content
-        )['taskId']
+            self.data_dict['kernel_gul']['taskId'] = json.loads(
+                resp.content
+            )['taskId']
+            self.record_created('kernel_gul', created_from)
 
         print("Created GUL data")
 
-    def get_gul_data(self, gul_name, filename, module_supplier_id):
+    def fork(self, name):
+        """ Returns a SpittalRun of its own for one of several GUL runs.
+
+        The data_dict keys of the CDF, CDF samples and GUL structures are
+        fixed, so GUL runs made at the same time each need a SpittalRun.
+        Unlike SpittalBase.fork(), the fork starts with this instance's
+        random numbers.
+
+        Args:
+            name (str): name of the GUL run.
+
+        Returns:
+            SpittalRun: the fork.
+        """
+        run = super(SpittalRun, self).fork(name)
+        for key in ("version_random", "random_instance"):
+            if key in self.data_dict and key not in run.data_dict:
+                run.data_dict[key] = dict(self.data_dict[key])
+        return run
+
+    def fan_out_gul(self, configs, benchmark_id, exposure_instance,
+                    module_supplier_id=1, max_concurrent=4, policy=None):
+        """ Creates and gets several GULs of one benchmark and exposure.
+
+        Each run configuration is a dict with:
+
+            - name (str): the GUL's user friendly name, unique.
+            - samples (int, optional): CDF samples, 10 by default.
+            - loss_threshold (float, optional): 0 by default.
+            - random_numbers (dict, optional): arguments for
+              auto_create_random_numbers(), to use a random number instance
+              of the run's own.
+            - random_instance (int, optional): taskId of an existing random
+              number instance to use instead.
+            - filename (str, optional): name of the GUL file on the server,
+              the name plus '.csv' by default.
+            - module_supplier_id (int, optional): of the GUL file.
+            - target (str or file, optional): where to stream the GUL, see
+              get_gul_data().
+
+        Runs without random_numbers or random_instance share this
+        instance's random numbers, made with auto_create_random_numbers()
+        first if there are none yet. Each run's CDF -> CDFSamples -> GUL ->
+        PubGUL chain is made and run on a fork() of this instance, up to
+        max_concurrent chains at a time.
+
+        Args:
+            configs (list): the run configurations.
+            benchmark_id (int): the id returned from create_benchmark().
+            exposure_instance (int): id returned from
+                create_exposure_instance().
+            module_supplier_id (int, optional): default of the runs.
+            max_concurrent (int, optional): chains to run at once.
+            policy (optional): polling policy for the jobs, see
+                wait_until_done().
+
+        Returns:
+            dict: by run name; the run's fork ('run') and what
+            get_gul_data() returned ('result').
+
+        Raises:
+            ValueError: for duplicate names or unknown settings.
+            SpittalFanOutError: once all runs are done, if any failed.
+        """
+        names = [config['name'] for config in configs]
+        if len(set(names)) != len(names):
+            raise ValueError("GUL run names must be unique: " +
+                             ", ".join(names))
+        for config in configs:
+            unknown = set(config) - set(GUL_CONFIG_KEYS)
+            if unknown:
+                raise ValueError("Unknown GUL run settings: " +
+                                 ", ".join(sorted(unknown)))
+
+        shared = [config for config in configs
+                  if 'random_numbers' not in config and
+                  'random_instance' not in config]
+        if shared and 'taskId' not in self.data_dict.get(
+                'random_instance', {}):
+            self.auto_create_random_numbers(policy=policy)
+
+        outcomes = map_isolated(
+            lambda config: self._run_gul_config(
+                config, benchmark_id, exposure_instance,
+                module_supplier_id, policy
+            ),
+            configs,
+            max_concurrent
+        )
+
+        results = {}
+        failures = {}
+        for name, (result, error) in zip(names, outcomes):
+            if error is not None:
+                logger.error("GUL run {name} failed: {exc!r}".format(
+                    name=name,
+                    exc=error
+                ))
+                failures[name] = error
+            else:
+                results[name] = result
+        if failures:
+            raise SpittalFanOutError(failures, results)
+        return results
+
+    def _run_gul_config(self, config, benchmark_id, exposure_instance,
+                        module_supplier_id, policy):
+        """ Makes and gets the GUL of one fan_out_gul() configuration. """
+        name = config['name']
+        run = self.fork(name)
+        if 'random_numbers' in config:
+            run.auto_create_random_numbers(
+                policy=policy, **config['random_numbers']
+            )
+        elif 'random_instance' in config:
+            run.data_dict['random_instance'] = {
+                'taskId': config['random_instance']
+            }
+        run.create_gul_data(
+            name,
+            benchmark_id,
+            exposure_instance,
+            config.get('samples', 10),
+            config.get('loss_threshold', 0)
+        )
+        result = run.get_gul_data(
+            name,
+            config.get('filename', name + ".csv"),
+            config.get('module_supplier_id', module_supplier_id),
+            target=config.get('target'),
+            policy=policy
+        )
+        return {'run': run, 'result': result}
+
+    def get_gul_data(self, gul_name, filename, module_supplier_id,
+                     target=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                     progress_callback=None, policy=None):
         """ Get the GUL data from the server.
 
+        Pass a target to have the published GUL streamed to disk (or any
+        sink) instead of held in memory. See download_file_to().
+
         Args:
             gul_name (str): The user friendly name of the GUL to create
             filename (str): the name of file to create and download.
             module_supplier_id (int): id of the module that supplies the
                 python and SQL code for this file.
                 See /oasis/django/oasis/app/scripts/Dict
+            target (str or file, optional): path or sink to stream the
+                GUL data to.
+            chunk_size (int, optional): bytes to hold in memory at a time
+                when streaming to target.
+            progress_callback (callable, optional): called as
+                progress_callback(bytes_done, total_bytes, elapsed_seconds)
+                when streaming to target.
+            policy (optional): polling policy for the GUL jobs, see
+                wait_until_done(). Polls every second by default.
 
         Returns:
             HttpResponse: server's response.
             This response also contains all the data from the GUL creation.
+            If a target is given, the download's metadata dict is returned
+            instead.
         """
 
+        self.publish_gul(gul_name, filename, module_supplier_id)
+
+        # When resuming, the GUL may have been saved already.
+        if not self.data_dict['kernel_pubgul'].get('saved'):
+            jobs_to_do = [
+                'kernel_cdf',
+                'kernel_cdfsamples',
+                'kernel_gul',
+                'kernel_pubgul',
+            ]
+            self.do_jobs(jobs_to_do, wait_time=1, policy=policy)
+            self.save_pub_gul()
+
+        # Do the pubgul task again.
+        self.do_jobs(["kernel_pubgul"], wait_time=1, policy=policy)
+
+        return self.download_gul(target, chunk_size, progress_callback)
+
+    def get_gul_table(self, gul_name, filename, module_supplier_id,
+                      directory, chunk_size=DEFAULT_CHUNK_SIZE,
+                      progress_callback=None, policy=None,
+                      gul_dtype="<f4"):
+        """ Get the GUL data from the server as a memory-mapped GUL table.
+
+        Same as get_gul_data(), but the CSV is converted into a GUL table
+        while it is downloaded, see spittalgul. Needs NumPy.
+
+        Args:
+            directory (str): where to write the GUL table.
+            gul_dtype (str, optional): dtype of the GUL column, '<f8' to
+                keep full double precision.
+
+        See get_gul_data() for the other arguments.
+
+        Returns:
+            GulTable: the GUL table.
+        """
+        with GulWriter(directory, gul_dtype) as writer:
+            self.get_gul_data(
+                gul_name,
+                filename,
+                module_supplier_id,
+                target=writer,
+                chunk_size=chunk_size,
+                progress_callback=progress_callback,
+                policy=policy
+            )
+        return GulTable(directory)
+
+    def get_gul_analytics(self, gul_name, filename, module_supplier_id,
+                          analytics=None, directory=None,
+                          chunk_size=DEFAULT_CHUNK_SIZE,
+                          progress_callback=None, policy=None):
+        """ Get the GUL data from the server, analysed as it downloads.
+
+        Same as get_gul_data(), but the CSV is only parsed, in chunks, into
+        a GulAnalytics, see spittalanalytics. Needs NumPy.
+
+        Args:
+            analytics (GulAnalytics, optional): to analyse the GUL with, one
+                with the default settings by default.
+            directory (str, optional): also write the GUL into a GUL table
+                here, see get_gul_table().
+
+        See get_gul_data() for the other arguments.
+
+        Returns:
+            GulAnalytics: the results.
+        """
+        if analytics is None:
+            analytics = GulAnalytics()
+        if directory is None:
+            self.get_gul_data(
+                gul_name,
+                filename,
+                module_supplier_id,
+                target=analytics,
+                chunk_size=chunk_size,
+                progress_callback=progress_callback,
+                policy=policy
+            )
+        else:
+            # Written aside and moved into place only once complete, so a
+            # failed download leaves no table that looks whole.
+            partial = directory.rstrip("/\\") + ".partial"
+            try:
+                with GulWriter(partial) as writer:
+                    self.get_gul_data(
+                        gul_name,
+                        filename,
+                        module_supplier_id,
+                        target=TeeSink(writer, analytics),
+                        chunk_size=chunk_size,
+                        progress_callback=progress_callback,
+                        policy=policy
+                    )
+            except BaseException:
+                shutil.rmtree(partial, True)
+                raise
+            move_gul_table(partial, directory)
+        analytics.close()
+        return analytics
+
+    def publish_gul(self, gul_name, filename, module_supplier_id):
+        """ Creates the file download and publish GUL objects of a GUL.
+
+        This is the first step of get_gul_data(), the jobs are not run.
+
+        Args:
+            gul_name (str): The user friendly name of the GUL to create
+            filename (str): the name of file to create and download.
+            module_supplier_id (int): id of the module that supplies the
+                python and SQL code for this file.
+                See /oasis/django/oasis/app/scripts/Dict
+        """
+        created_from = [
+            self.data_dict['kernel_gul']['taskId'],
+            filename,
+            module_supplier_id,
+        ]
+        if self.has_created('kernel_pubgul', created_from):
+            return
+
         # Create a new file download.
         self.data_dict['kernel_pubgul'] = {}
         download_id = self.create_file_download(
@@ -293,7 +662,7 @@ class SpittalRun(SpittalBase):
             self.data_dict['kernel_gul']['taskId'],
             self.data_dict['kernel_pubgul']['download_id']
         )
-        logger.info('Create kernel publish GUL response , ' + resp.content)
+        logger.info('Create kernel publish GUL response , ' + resp.text)
 
         self.data_dict['kernel_pubgul']['taskId'] = json.loads(
             resp.content
@@ -306,22 +675,15 @@ class SpittalRun(SpittalBase):
             module_supplier_id,
             filename,
         )
-        logger.info("update kernel publish GUL download, " + resp.content)
+        logger.info("update kernel publish GUL download, " + resp.text)
 
         self.data_dict['kernel_pubgul']['download_id_2'] = json.loads(
             resp.content
         )['taskId']
+        self.record_created('kernel_pubgul', created_from)
 
-        jobs_to_do = [
-            'kernel_cdf',
-            'kernel_cdfsamples',
-            'kernel_gul',
-            'kernel_pubgul',
-        ]
-        self.do_jobs(jobs_to_do, wait_time=1)
-        # This has to be done like at the very last!!
-        # self.load_models()
-
+    def save_pub_gul(self):
+        """ Saves the published GUL file, once its jobs have run. """
         # A makeshift save of the data.
         response1 = self.do_request(
             self.base_url +
@@ -330,15 +692,49 @@ class SpittalRun(SpittalBase):
             str(self.data_dict['kernel_pubgul']['taskId']) + "/"
         )
 
-        logger.info("Save pub GUL response " + response1.content)
+        logger.info("Save pub GUL response " + response1.text)
 
-        # Do the pubgul task again.
-        self.do_jobs(["kernel_pubgul"], wait_time=1)
+        # The publish GUL job has to run again after the save.
+        self.data_dict['kernel_pubgul']['saved'] = True
+        self.data_dict['kernel_pubgul'].pop('job_id', None)
+        self.data_dict['kernel_pubgul'].pop('job_status', None)
+        self.checkpoint()
+
+    def download_gul(self, target=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                     progress_callback=None):
+        """ Downloads the saved, published GUL file.
+
+        This is the last step of get_gul_data().
+
+        Args:
+            target (str or file, optional): path or sink to stream the
+                GUL data to.
+            chunk_size (int, optional): bytes to hold in memory at a time
+                when streaming to target.
+            progress_callback (callable, optional): called as
+                progress_callback(bytes_done, total_bytes, elapsed_seconds)
+                when streaming to target.
 
+        Returns:
+            HttpResponse: server's response, or the download's metadata
+            dict if a target is given.
+        """
         # Actually download the file.
+        if target is not None:
+            return self.download_file_to(
+                self.data_dict['kernel_pubgul']['download_id'],
+                target,
+                chunk_size=chunk_size,
+                progress_callback=progress_callback
+            )
+
         resp = self.download_file(
             self.data_dict['kernel_pubgul']['download_id']
         )
-        logger.info("Download Herlp gul response " + resp.content)
+        logger.info(
+            "Download Herlp gul response, {num} bytes".format(
+                num=len(resp.content)
+            )
+        )
 
         return resp
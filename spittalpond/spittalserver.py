@@ -0,0 +1,539 @@
+""" A local stand-in for the Oasis mid-tier Django server.
+
+It answers every endpoint spittalpond calls, so the client can be run,
+tested and timed without an Oasis VM. Jobs take a configurable time to
+finish, every endpoint can be given a latency and a failure rate, and the
+published GUL file is generated at whatever size is asked for.
+
+Example:
+
+    >>> with SpittalServer(job_durations={"*": 0.5}) as server:
+    ...     spit = spittalpond.SpittalPond(server.base_url, "root")
+    ...     spit.do_login("password")
+
+Or from the command line:
+
+    $ python -m spittalpond.spittalserver --port 8000 --job-duration '*=0.5'
+"""
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+logger = logging.getLogger('spittalpond')
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+def match_setting(settings, endpoint, default):
+    """ Looks up the setting of an endpoint or task type.
+
+    Settings are keyed by name or fnmatch pattern, i.e. 'statusAsync',
+    'create*' or '*'. An exact name wins, then the longest matching pattern.
+
+    Args:
+        settings (dict): the settings by name or pattern.
+        endpoint (str): the endpoint or task type to look up.
+        default: returned if nothing matches.
+    """
+    if endpoint in settings:
+        return settings[endpoint]
+    matches = [pattern for pattern in settings
+               if fnmatch.fnmatchcase(endpoint, pattern)]
+    if not matches:
+        return default
+    return settings[max(matches, key=len)]
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """ Hands every request over to the SpittalServer. """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes, do not delay the body.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.spittal.lock:
+            self.server.spittal.connections.add(self.connection)
+
+    def finish(self):
+        with self.server.spittal.lock:
+            self.server.spittal.connections.discard(self.connection)
+        BaseHTTPRequestHandler.finish(self)
+
+    def do_POST(self):
+        self.server.spittal.handle(self)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        logger.debug("spittalserver: " + format % args)
+
+class SpittalServer(object):
+    """ Fake Oasis mid-tier serving the spittalpond endpoints over HTTP.
+
+    Every create* call returns a new taskId and every doTask* call queues a
+    job that is done (or FAILED) once its duration has passed. Per endpoint
+    request counts and bytes are kept in stats.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=None,
+                 job_durations=None, failures=None, gul_events=100,
+                 gul_items=10, password=None, padding=None, seed=None):
+        """ Initiating instance, the server is not started yet.
+
+        Args:
+            host (str, optional): interface to listen on.
+            port (int, optional): port to listen on, any free port if 0.
+            latency (dict, optional): seconds to wait before answering, by
+                endpoint name or pattern, i.e. {'create*': 0.05}.
+            job_durations (dict, optional): seconds a job runs for, by task
+                type or pattern, i.e. {'Benchmark': 2, '*': 0.1}.
+            failures (dict, optional): chance, from 0 to 1, that a call
+                fails, by endpoint name or pattern. A failed doTask* call
+                queues a job that ends up FAILED, any other failed call is
+                answered with a non-JSON HTTP 500.
+            gul_events (int, optional): events in a published GUL file.
+            gul_items (int, optional): items per event in a GUL file. Each
+                event and item gets one row per sample, plus the mean.
+            password (str, optional): the only password login accepts. Any
+                password is accepted if not given.
+            padding (dict, optional): bytes of filler to add to the JSON
+                responses, by endpoint name or pattern.
+            seed (int, optional): seed for the failures and GUL data.
+        """
+        self.latency = latency or {}
+        self.job_durations = job_durations or {"*": 0.1}
+        self.failures = failures or {}
+        self.gul_events = gul_events
+        self.gul_items = gul_items
+        self.password = password
+        self.padding = padding or {}
+        self.seed = seed
+        self.random = random.Random(seed)
+
+        self.lock = threading.RLock()
+        self.next_id = 1
+        # taskId -> (endpoint, args) of everything created.
+        self.tasks = {}
+        # JobId -> dict(task_type, task_id, start, duration, failed, polls)
+        self.jobs = {}
+        # download id -> taskId of the GUL published to it.
+        self.gul_downloads = {}
+        # download id -> path of its generated GUL file.
+        self.gul_files = {}
+        self.stats = {}
+        # Open keep-alive connections, closed on stop().
+        self.connections = set()
+
+        self.work_dir = None
+        self.httpd = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self.httpd.spittal = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        """ str: the URL to give SpittalPond, i.e. http://127.0.0.1:8000 """
+        host, port = self.httpd.server_address[:2]
+        return "http://{host}:{port}".format(host=host, port=port)
+
+    def start(self):
+        """ Starts serving on a background thread. """
+        self.work_dir = tempfile.mkdtemp(prefix="spittalserver")
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info("spittalserver listening on " + self.base_url)
+        return self
+
+    def stop(self):
+        """ Stops serving and removes the generated files. """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        if self.thread is not None:
+            self.thread.join()
+        if self.work_dir is not None:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_stats(self):
+        """ Clears the per endpoint stats. """
+        with self.lock:
+            self.stats = {}
+
+    def count(self, endpoint, **amounts):
+        """ Adds to the stats of an endpoint. """
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, {
+                'requests': 0,
+                'bytes_in': 0,
+                'bytes_out': 0,
+            })
+            for name, amount in amounts.items():
+                stats[name] = stats.get(name, 0) + amount
+
+    def new_id(self):
+        """ int: a new taskId or JobId. """
+        with self.lock:
+            new_id = self.next_id
+            self.next_id += 1
+            return new_id
+
+    def handle(self, request):
+        """ Answers one HTTP request. """
+        path = request.path.split("?")[0]
+        parts = [part for part in path.split("/") if part]
+        if len(parts) < 2 or parts[0] != "oasis":
+            endpoint, args = path, []
+        else:
+            endpoint, args = parts[1], parts[2:]
+
+        body_length = self.read_body(request, endpoint)
+        self.count(endpoint, requests=1, bytes_in=body_length)
+        time.sleep(match_setting(self.latency, endpoint, 0))
+
+        failed = self.random.random() < match_setting(
+            self.failures, endpoint, 0
+        )
+        if failed and not self.is_job_endpoint(endpoint):
+            self.send(request, endpoint, 500, b"Server Error (500)",
+                      "text/html")
+            return
+
+        if endpoint == "login":
+            self.login(request, endpoint)
+        elif endpoint == "doTaskDownloadFileHelper":
+            self.download(request, endpoint, args)
+        elif endpoint == "doTaskUploadFileHelper":
+            self.send_json(request, endpoint, {
+                "status": "done",
+                "success": True,
+            })
+        elif endpoint == "statusAsync":
+            self.status(request, endpoint, args)
+        elif self.is_job_endpoint(endpoint):
+            self.queue_job(request, endpoint, args, failed)
+        elif endpoint.startswith("create") or endpoint in (
+                "updateFileDownload", "saveFilePubGUL"):
+            self.create(request, endpoint, args)
+        else:
+            self.send_json(request, endpoint, {
+                "success": False,
+                "detail": "Unknown endpoint " + endpoint,
+            }, 404)
+
+    @staticmethod
+    def is_job_endpoint(endpoint):
+        """ bool: whether the endpoint queues a job. """
+        return endpoint.startswith("doTask") and endpoint not in (
+            "doTaskUploadFileHelper", "doTaskDownloadFileHelper"
+        )
+
+    @staticmethod
+    def read_body(request, endpoint):
+        """ Reads and drops the request body, returning its size. """
+        remaining = int(request.headers.get("Content-Length") or 0)
+        total = remaining
+        data = []
+        while remaining > 0:
+            chunk = request.rfile.read(min(remaining, COPY_CHUNK_SIZE))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            # Only the login body is ever looked at.
+            if endpoint == "login":
+                data.append(chunk)
+        request.body = b"".join(data)
+        return total
+
+    def send(self, request, endpoint, status, body, content_type,
+             headers=None):
+        """ Sends a whole response. """
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        # Counted first, the client may read it all before write() returns.
+        self.count(endpoint, bytes_out=len(body))
+        request.wfile.write(body)
+
+    def send_json(self, request, endpoint, data, status=200, headers=None):
+        """ Sends a JSON response, with any padding for the endpoint. """
+        padding = match_setting(self.padding, endpoint, 0)
+        if padding:
+            data = dict(data, padding="x" * padding)
+        self.send(
+            request,
+            endpoint,
+            status,
+            json.dumps(data).encode("utf-8"),
+            "application/json",
+            headers
+        )
+
+    def login(self, request, endpoint):
+        """ Logs in, setting the sessionid cookie. """
+        try:
+            credentials = json.loads(request.body.decode("utf-8"))
+        except ValueError:
+            credentials = {}
+        if (self.password is not None and
+                credentials.get("password") != self.password):
+            self.send_json(request, endpoint, {"success": False})
+            return
+        self.send_json(
+            request,
+            endpoint,
+            {"success": True},
+            headers={"Set-Cookie": "sessionid={id}; Path=/".format(
+                id=self.new_id()
+            )}
+        )
+
+    def create(self, request, endpoint, args):
+        """ Creates a task, i.e. a dict, version, instance or file. """
+        task_id = self.new_id()
+        with self.lock:
+            self.tasks[task_id] = (endpoint, args)
+            if endpoint == "createPubGUL":
+                # name / gul_id / download_id
+                self.gul_downloads[int(args[2])] = task_id
+        self.send_json(request, endpoint, {
+            "status": "done",
+            "taskId": str(task_id),
+            "success": True,
+            "JobId": "0",
+        })
+
+    def queue_job(self, request, endpoint, args, failed):
+        """ Queues a job, done once its duration has passed. """
+        task_type = endpoint[len("doTask"):]
+        job_id = self.new_id()
+        with self.lock:
+            self.jobs[job_id] = {
+                'task_type': task_type,
+                'task_id': args[-1] if args else None,
+                'start': time.time(),
+                'duration': match_setting(self.job_durations, task_type, 0),
+                'failed': failed,
+                'polls': 0,
+            }
+        self.send_json(request, endpoint, {
+            "status": "WIP",
+            "progress": "Started",
+            "detail": "OK",
+            "success": True,
+            "JobId": job_id,
+        })
+
+    def status(self, request, endpoint, args):
+        """ Answers a statusAsync call: WIP, done or FAILED. """
+        job_id = int(args[-1])
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job['polls'] += 1
+        if job is None:
+            self.send_json(request, endpoint, {
+                "status": "FAILED",
+                "JobId": job_id,
+                "detail": "Unknown job",
+            })
+            return
+        if time.time() - job['start'] < job['duration']:
+            status, progress = "WIP", "Running"
+        elif job['failed']:
+            status, progress = "FAILED", "FAILED"
+        else:
+            status, progress = "done", "FINISHED"
+        self.send_json(request, endpoint, {
+            "status": status,
+            "RemainingChunks": "0",
+            "CompletedSteps": "",
+            "JobId": job_id,
+            "Timeout": False,
+            "progress": progress,
+        })
+
+    def task_args(self, task_id, endpoint):
+        """ list: the args a task was created with, if it is of that kind. """
+        task = self.tasks.get(int(task_id))
+        if task is None or task[0] != endpoint:
+            return None
+        return task[1]
+
+    def gul_settings(self, pub_gul_id):
+        """ (samples, loss threshold) of the GUL behind a publish GUL. """
+        samples, threshold = 10, 0.0
+        pub_args = self.task_args(pub_gul_id, "createPubGUL")
+        gul_args = pub_args and self.task_args(pub_args[1], "createGUL")
+        if gul_args:
+            threshold = float(gul_args[2])
+            samples_args = self.task_args(gul_args[1], "createCDFSamples")
+            if samples_args:
+                samples = int(samples_args[2])
+        return samples, threshold
+
+    def gul_file(self, download_id):
+        """ Returns the path of a download's GUL file, made on first use. """
+        with self.lock:
+            if download_id in self.gul_files:
+                return self.gul_files[download_id]
+            samples, threshold = self.gul_settings(
+                self.gul_downloads[download_id]
+            )
+            path = os.path.join(
+                self.work_dir,
+                "Pub_GUL_{id}.csv".format(id=download_id)
+            )
+            rand = random.Random(
+                "{seed} {id}".format(seed=self.seed, id=download_id)
+            )
+            with open(path, "w") as f:
+                f.write("EVENT_ID, ITEM_ID, IDX, GUL\n")
+                for event_id in range(1, self.gul_events + 1):
+                    rows = []
+                    for item_id in range(1, self.gul_items + 1):
+                        losses = [rand.expovariate(1.0 / 1000)
+                                  for _ in range(samples)]
+                        # IDX 0 is the mean, then one row per sample.
+                        losses.insert(0, sum(losses) / max(samples, 1))
+                        for idx, loss in enumerate(losses):
+                            if loss > threshold:
+                                rows.append("{e}, {i}, {idx}, {loss:.2f}\n"
+                                            .format(e=event_id, i=item_id,
+                                                    idx=idx, loss=loss))
+                    f.write("".join(rows))
+            self.gul_files[download_id] = path
+            return path
+
+    def download(self, request, endpoint, args):
+        """ Serves a published GUL file, honouring Range requests. """
+        download_id = int(args[0])
+        if download_id not in self.gul_downloads:
+            self.send_json(request, endpoint, {
+                "success": False,
+                "detail": "Nothing to download",
+            }, 404)
+            return
+        path = self.gul_file(download_id)
+        size = os.path.getsize(path)
+        start = 0
+        status = 200
+        range_header = request.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            start = int(range_header[len("bytes="):].split("-")[0])
+            if start >= size:
+                self.send(request, endpoint, 416, b"", "text/plain", {
+                    "Content-Range": "bytes */{size}".format(size=size)
+                })
+                return
+            status = 206
+
+        request.send_response(status)
+        request.send_header("Content-Type", "text/csv")
+        request.send_header("Content-Length", str(size - start))
+        if status == 206:
+            request.send_header(
+                "Content-Range",
+                "bytes {start}-{end}/{size}".format(
+                    start=start,
+                    end=size - 1,
+                    size=size
+                )
+            )
+        request.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            while True:
+                chunk = f.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.count(endpoint, bytes_out=len(chunk))
+                request.wfile.write(chunk)
+
+def _parse_settings(pairs, kind=float):
+    """ Turns ['pattern=value', ...] command line options into a dict. """
+    settings = {}
+    for pair in pairs or []:
+        pattern, value = pair.rsplit("=", 1)
+        settings[pattern] = kind(value)
+    return settings
+
+def main(argv=None):
+    """ Runs a SpittalServer until interrupted. """
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the Oasis mid-tier server."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", action="append", metavar="PATTERN=SECS",
+                        help="latency of matching endpoints")
+    parser.add_argument("--job-duration", action="append",
+                        metavar="PATTERN=SECS",
+                        help="run time of matching task types")
+    parser.add_argument("--fail", action="append", metavar="PATTERN=RATE",
+                        help="failure rate of matching endpoints")
+    parser.add_argument("--padding", action="append", metavar="PATTERN=BYTES",
+                        help="filler added to matching JSON responses")
+    parser.add_argument("--gul-events", type=int, default=100)
+    parser.add_argument("--gul-items", type=int, default=10)
+    parser.add_argument("--password")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    server = SpittalServer(
+        host=args.host,
+        port=args.port,
+        latency=_parse_settings(args.latency),
+        job_durations=_parse_settings(args.job_duration) or None,
+        failures=_parse_settings(args.fail),
+        gul_events=args.gul_events,
+        gul_items=args.gul_items,
+        password=args.password,
+        padding=_parse_settings(args.padding, int),
+        seed=args.seed
+    )
+    server.start()
+    print("Serving the Oasis stand-in on " + server.base_url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
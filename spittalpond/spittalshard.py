@@ -0,0 +1,193 @@
+""" Splitting an exposure into shards, and merging the shards' GULs.
+
+One large exposure makes one large benchmark and GUL job, which the
+server runs on a single worker. split_exposure() splits an exposure
+directory into shards of whole groups, each an exposure directory of its own that
+can be run at the same time as the others (see SpittalPond.run_sharded()).
+merge_gul_files() then streams the shards' GULs into one, ordered by event
+and item as a single run's GUL would be.
+
+Items are split by their GROUP_ID: all the items of a group go to the same
+shard, so a group's correlated losses are sampled together as in a single
+run. Whole groups are dealt out, largest first, to the shard with the
+fewest items so far, which keeps the shards about the same size. The
+dict_exposure and correlations_main rows go to the shard of the item in
+their first column.
+"""
+import glob
+import heapq
+import os
+import shutil
+
+from .spittalgul import require_numpy, np
+from .spittalvalidate import FileSchema, file_type, read_columns
+
+# The exposure file types split by item; others are copied to every shard.
+ITEM_FILE_TYPES = ["exposures_main", "dict_exposure", "correlations_main"]
+
+def split_exposure(exposure_directory, shards, work_dir):
+    """ Splits an exposure directory into shard directories.
+
+    Args:
+        exposure_directory (str): path of the exposure files, with a
+            trailing slash as for upload_directory().
+        shards (int): number of shards.
+        work_dir (str): where to write the shard directories.
+
+    Returns:
+        list: the shard directory paths, with trailing slashes. Fewer than
+        shards if there are fewer groups.
+
+    Raises:
+        ValueError: if there is no exposures_main file, or a row refers to
+            an item that is not in it.
+    """
+    require_numpy()
+    paths = sorted(glob.glob(exposure_directory + "*"))
+    mains = [path for path in paths
+             if file_type(path) == "exposures_main"]
+    if len(mains) != 1:
+        raise ValueError(
+            "Need one exposures_main file to shard, found {num}".format(
+                num=len(mains)
+            )
+        )
+    columns, problems = read_columns(
+        mains[0],
+        FileSchema([
+            ("ITEM_ID", 'int'),
+            ("AREAPERIL_ID", 'int'),
+            ("VULNERABILITY_ID", 'int'),
+            ("GROUP_ID", 'int'),
+        ], extra_columns=True)
+    )
+    if columns is None:
+        raise ValueError(mains[0] + ": " + "; ".join(problems))
+    items = columns[:, 0].astype(np.int64)
+    groups, group_index, group_sizes = np.unique(
+        columns[:, 3].astype(np.int64),
+        return_inverse=True,
+        return_counts=True
+    )
+    shards = max(1, min(shards, len(groups)))
+
+    item_shards = _group_shards(group_sizes, shards)[group_index]
+    order = np.argsort(items, kind="mergesort")
+    sorted_items = items[order]
+    sorted_shards = item_shards[order]
+
+    shard_directories = []
+    for shard in range(shards):
+        directory = os.path.join(work_dir, "shard_{n}".format(n=shard))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        shard_directories.append(directory + os.sep)
+
+    for path in paths:
+        filename = os.path.basename(path)
+        if file_type(path) not in ITEM_FILE_TYPES:
+            for directory in shard_directories:
+                shutil.copyfile(path, directory + filename)
+            continue
+        outputs = [open(directory + filename, "wb")
+                   for directory in shard_directories]
+        try:
+            _split_file(path, sorted_items, sorted_shards, outputs)
+        finally:
+            for f in outputs:
+                f.close()
+    return shard_directories
+
+def _group_shards(group_sizes, shards):
+    """ Returns the shard of each group, balancing the shards' item counts.
+
+    Largest group first, each group goes to the shard with the fewest items
+    so far, ties to the lowest shard number.
+    """
+    group_shards = np.zeros(len(group_sizes), dtype=np.int64)
+    loads = [(0, shard) for shard in range(shards)]
+    for group in np.argsort(-group_sizes, kind="mergesort"):
+        load, shard = loads[0]
+        group_shards[group] = shard
+        heapq.heapreplace(loads, (load + int(group_sizes[group]), shard))
+    return group_shards
+
+def _split_file(path, sorted_items, sorted_shards, outputs, batch=65536):
+    """ Writes each row of a file to the output of its item's shard. """
+    with open(path, "rb") as f:
+        header = f.readline()
+        for output in outputs:
+            output.write(header)
+        while True:
+            lines = f.readlines(batch)
+            if not lines:
+                break
+            lines = [line for line in lines if line.strip()]
+            if not lines:
+                continue
+            row_items = np.array(
+                [int(line.split(b",", 1)[0]) for line in lines],
+                dtype=np.int64
+            )
+            found = np.searchsorted(sorted_items, row_items)
+            found = np.minimum(found, len(sorted_items) - 1)
+            missing = sorted_items[found] != row_items
+            if missing.any():
+                raise ValueError(
+                    "{path}: item {item} is not in exposures_main".format(
+                        path=path,
+                        item=row_items[np.argmax(missing)]
+                    )
+                )
+            for line, shard in zip(lines, sorted_shards[found]):
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+                outputs[shard].write(line)
+
+def _gul_rows(f):
+    """ Yields (event, item, idx, line) for each row after the header. """
+    for line in f:
+        if not line.strip():
+            continue
+        if not line.endswith(b"\n"):
+            line += b"\n"
+        event_id, item_id, idx, _ = line.split(b",", 3)
+        yield int(event_id), int(item_id), int(idx), line
+
+def merge_gul_files(sources, target):
+    """ Merges GUL CSVs, each ordered by event and item, into one.
+
+    Only a row or so of each source is held in memory at a time.
+
+    Args:
+        sources (list): paths of the GUL CSVs.
+        target (str or file): path to write the merged GUL to, or anything
+            with a write() method, i.e. a GulAnalytics.
+
+    Returns:
+        int: the number of rows written.
+    """
+    files = [open(source, "rb") for source in sources]
+    sink = target
+    if not hasattr(target, 'write'):
+        sink = open(target, "wb")
+    rows = 0
+    try:
+        headers = [f.readline() for f in files]
+        sink.write(headers[0] if headers else b"")
+        batch = []
+        for row in heapq.merge(*[_gul_rows(f) for f in files]):
+            batch.append(row[3])
+            if len(batch) >= 4096:
+                sink.write(b"".join(batch))
+                rows += len(batch)
+                batch = []
+        if batch:
+            sink.write(b"".join(batch))
+            rows += len(batch)
+    finally:
+        for f in files:
+            f.close()
+        if sink is not target:
+            sink.close()
+    return rows
@@ -0,0 +1,151 @@
+import contextlib
+import json
+import os
+import tempfile
+import threading
+try:
+    import fcntl
+except ImportError:
+    # Windows, the store is then only safe to write from one process.
+    fcntl = None
+
+class JsonStore(object):
+    """ A small, durable key-value store kept in one local JSON file.
+
+    Every change is written straight to disk by writing a temporary file and
+    renaming it over the old one, so a crash never leaves a half-written
+    store behind. It is safe to use from several threads.
+
+    It is also safe to share between processes, i.e. one upload cache or
+    job history used by several runs at once, on systems with fcntl (not
+    Windows). Each change is made to the file's latest contents under a
+    lock file next to it (path + ".lock"), so no process drops another's
+    entries. Reads see another process's changes once the file changed.
+    """
+
+    def __init__(self, path):
+        """ Initiating instance, loading the file if it exists.
+
+        Args:
+            path (str): path of the JSON file.
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.data = {}
+        self.stamp = None
+        self.refresh()
+
+    def get(self, key, default=None):
+        """ Returns the value stored under key, or default. """
+        with self.lock:
+            self.refresh()
+            return self.data.get(key, default)
+
+    def keys(self):
+        """ list: the keys of the store. """
+        with self.lock:
+            self.refresh()
+            return list(self.data)
+
+    def set(self, key, value):
+        """ Stores value under key and saves the store. """
+        def change(data):
+            data[key] = value
+        self.modify(change)
+
+    def update(self, key, fields):
+        """ Merges fields into the dict stored under key and saves. """
+        def change(data):
+            data.setdefault(key, {}).update(fields)
+        self.modify(change)
+
+    def delete(self, key):
+        """ Removes key, if present, and saves the store. """
+        def change(data):
+            data.pop(key, None)
+        self.modify(change)
+
+    def modify(self, change):
+        """ Changes the store and saves it, as one step.
+
+        Args:
+            change (callable): called with the store's latest data dict,
+                to change in place. Other processes wait until it is saved.
+        """
+        with self.lock:
+            with self.file_lock():
+                self.refresh()
+                change(self.data)
+                self.save()
+
+    def refresh(self):
+        """ Reloads the file if it changed since it was last read. """
+        with self.lock:
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                return
+            stamp = (stat.st_mtime, stat.st_size, stat.st_ino)
+            if stamp == self.stamp:
+                return
+            with open(self.path) as f:
+                self.data = json.load(f)
+            self.stamp = stamp
+
+    @contextlib.contextmanager
+    def file_lock(self):
+        """ Holds the lock file that keeps other processes' changes out. """
+        if fcntl is None:
+            yield
+            return
+        self.make_directory()
+        with open(self.path + ".lock", "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def make_directory(self):
+        """ Creates the directory of the file if need be. """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Made by another thread or process meanwhile.
+                if not os.path.isdir(directory):
+                    raise
+        return directory
+
+    def save(self):
+        """ Atomically writes the store to disk.
+
+        Use modify() to change the store, so changes made by other
+        processes since it was read are kept.
+        """
+        with self.lock:
+            directory = self.make_directory()
+            fd, tmp_path = tempfile.mkstemp(
+                dir=directory,
+                prefix=os.path.basename(self.path) + ".",
+                suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self.data, f, indent=1, sort_keys=True)
+                    f.flush()
+                    os.fsync(f.fileno())
+                try:
+                    os.replace(tmp_path, self.path)
+                except AttributeError:
+                    # Python 2, rename only replaces existing files on POSIX.
+                    if os.name == "nt" and os.path.exists(self.path):
+                        os.remove(self.path)
+                    os.rename(tmp_path, self.path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            stat = os.stat(self.path)
+            self.stamp = (stat.st_mtime, stat.st_size, stat.st_ino)
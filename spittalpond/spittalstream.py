@@ -0,0 +1,272 @@
+import os
+import time
+import uuid
+import logging
+
+logger = logging.getLogger('spittalpond')
+
+# Bytes read from disk at a time. This bounds the memory used by a transfer.
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+class MultipartFileStream(object):
+    """ A multipart/form-data body that streams a file from disk.
+
+    Passing a file in the requests `files=` dict builds the whole multipart
+    body in memory. This object is passed as the request data instead: it
+    has a length, so a Content-Length header is still sent, but the file is
+    only read in chunk_size pieces as the body is being sent.
+
+    The body is the same one requests would build for
+    `files={field_name: open(filepath, 'rb')}`.
+    """
+
+    def __init__(self, field_name, filepath, chunk_size=DEFAULT_CHUNK_SIZE,
+                 progress_callback=None):
+        """ Initiating instance.
+
+        Args:
+            field_name (str): the form field name of the file. The upload
+                helper uses this as the server-side file name.
+            filepath (str): path to the local file to send.
+            chunk_size (int, optional): bytes to read from disk at a time.
+            progress_callback (callable, optional): called as
+                progress_callback(bytes_sent, total_bytes, elapsed_seconds)
+                after each chunk and once more when the body is done.
+        """
+        self.field_name = field_name
+        self.filepath = filepath
+        self.chunk_size = chunk_size
+        self.progress_callback = progress_callback
+        self.boundary = uuid.uuid4().hex
+
+        self._preamble = (
+            '--{boundary}\r\n'
+            'Content-Disposition: form-data; name="{name}"; '
+            'filename="{filename}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+        ).format(
+            boundary=self.boundary,
+            name=field_name,
+            filename=os.path.basename(filepath)
+        ).encode('utf-8')
+        self._epilogue = '\r\n--{boundary}--\r\n'.format(
+            boundary=self.boundary
+        ).encode('utf-8')
+        self._file_size = os.path.getsize(filepath)
+        self._length = (
+            len(self._preamble) + self._file_size + len(self._epilogue)
+        )
+
+        self._file = None
+        self._parts = self._iter_parts()
+        self._buffer = b''
+        self._position = 0
+        self.bytes_sent = 0
+        self.start_time = None
+
+    @property
+    def content_type(self):
+        """ str: the Content-Type header value, including the boundary. """
+        return 'multipart/form-data; boundary=' + self.boundary
+
+    def __len__(self):
+        return self._length
+
+    def _iter_parts(self):
+        """ Yields the body in pieces, the file in chunk_size chunks. """
+        yield self._preamble
+        self._file = open(self.filepath, 'rb')
+        try:
+            while True:
+                chunk = self._file.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self._file.close()
+        yield self._epilogue
+
+    def _report(self):
+        if self.progress_callback is not None:
+            self.progress_callback(
+                self.bytes_sent,
+                self._length,
+                time.time() - self.start_time
+            )
+
+    def read(self, size=-1):
+        """ Reads up to size bytes of the body.
+
+        Args:
+            size (int, optional): max bytes to return, everything left if
+                negative.
+
+        Returns:
+            bytes: the next piece of the body, empty once it is all sent.
+        """
+        if self.start_time is None:
+            self.start_time = time.time()
+        if size is None or size < 0:
+            size = self._length - self.bytes_sent
+
+        pieces = []
+        while size > 0:
+            if self._position >= len(self._buffer):
+                # The previous chunk has been handed over, report it.
+                if self._buffer:
+                    self._report()
+                self._buffer = next(self._parts, b'')
+                self._position = 0
+                if not self._buffer:
+                    break
+            piece = self._buffer[self._position:self._position + size]
+            self._position += len(piece)
+            self.bytes_sent += len(piece)
+            size -= len(piece)
+            pieces.append(piece)
+
+        if self.bytes_sent == self._length and self._buffer:
+            self._buffer = b''
+            self._report()
+        return b''.join(pieces)
+
+    def close(self):
+        """ Closes the underlying file if it is still open. """
+        if self._file is not None:
+            self._file.close()
+
+class ProgressLogger(object):
+    """ A progress callback that logs transfer progress and throughput.
+
+    Logs at most once every `interval` seconds, plus once when done.
+    """
+
+    def __init__(self, name, interval=5):
+        """ Initiating instance.
+
+        Args:
+            name (str): what is being transfered, used in the log message.
+            interval (int, optional): min seconds between log messages.
+        """
+        self.name = name
+        self.interval = interval
+        self._last_logged = None
+
+    def __call__(self, done, total, elapsed):
+        finished = total is not None and done >= total
+        if (not finished and self._last_logged is not None and
+                elapsed - self._last_logged < self.interval):
+            return
+        self._last_logged = elapsed
+        logger.info(
+            "{name}: {done}/{total} bytes, {rate:.2f} MB/s".format(
+                name=self.name,
+                done=done,
+                total=total,
+                rate=done / (1024.0 * 1024.0) / max(elapsed, 1e-6)
+            )
+        )
+
+class IncompleteDownloadError(Exception):
+    """ Raised when a download ends before all of its bytes arrived.
+
+    Attributes:
+        bytes_received (int): bytes written to the target so far.
+        expected_bytes (int): the size the server announced.
+    """
+
+    def __init__(self, bytes_received, expected_bytes):
+        self.bytes_received = bytes_received
+        self.expected_bytes = expected_bytes
+        Exception.__init__(
+            self,
+            "Download incomplete: got {got} of {expected} bytes".format(
+                got=bytes_received,
+                expected=expected_bytes
+            )
+        )
+
+def expected_length(response, offset=0):
+    """ Works out the full size of a (possibly partial) download.
+
+    Args:
+        response (HttpResponse): the server's response.
+        offset (int, optional): bytes requested to be skipped by a Range
+            header.
+
+    Returns:
+        int: total size of the file, None if the server did not say, or
+        sent it content encoded: the sizes are then of the encoded bytes,
+        not of the decoded ones written out.
+    """
+    encoding = response.headers.get('Content-Encoding', 'identity')
+    if encoding.strip().lower() != 'identity':
+        return None
+    content_range = response.headers.get('Content-Range')
+    if content_range and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1].strip()
+        if total.isdigit():
+            return int(total)
+    content_length = response.headers.get('Content-Length')
+    if content_length and content_length.isdigit():
+        return offset + int(content_length)
+    return None
+
+class CountingSink(object):
+    """ Wraps a sink, counting the bytes written and reporting progress. """
+
+    def __init__(self, sink, done=0, total=None, progress_callback=None,
+                 start_time=None):
+        """ Initiating instance.
+
+        Args:
+            sink (file): anything with a write() method.
+            done (int, optional): bytes already written by an earlier attempt.
+            total (int, optional): expected total size, for the callback.
+            progress_callback (callable, optional): called as
+                progress_callback(bytes_done, total_bytes, elapsed_seconds)
+                after each write.
+            start_time (float, optional): when the transfer started.
+        """
+        self.sink = sink
+        self.done = done
+        self.total = total
+        self.progress_callback = progress_callback
+        self.start_time = start_time if start_time is not None else time.time()
+
+    def write(self, chunk):
+        self.sink.write(chunk)
+        self.done += len(chunk)
+        if self.progress_callback is not None:
+            self.progress_callback(
+                self.done,
+                self.total,
+                time.time() - self.start_time
+            )
+
+class TeeSink(object):
+    """ Writes every chunk to several sinks, i.e. a file and a parser. """
+
+    def __init__(self, *sinks):
+        """ Initiating instance.
+
+        Args:
+            *sinks (file): anything with a write() method.
+        """
+        self.sinks = sinks
+
+    def write(self, chunk):
+        for sink in self.sinks:
+            sink.write(chunk)
+
+def copy_response(response, sink, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Writes a streamed response body to a sink, chunk by chunk.
+
+    Args:
+        response (HttpResponse): a response made with stream=True.
+        sink (file): anything with a write() method.
+        chunk_size (int, optional): bytes to hold in memory at a time.
+    """
+    for chunk in response.iter_content(chunk_size):
+        if chunk:
+            sink.write(chunk)
@@ -0,0 +1,195 @@
+import threading
+import time
+
+class JobTimings(object):
+    """ Records when each job was queued, seen running and seen done.
+
+    SpittalBase notes every job it queues with do_task() and every status
+    poll of it, keyed by the job's task type from SpittalBase.types, i.e.
+    VulnVersion, HazFPInstance, CDF, GUL or PubGUL. A job's record holds:
+
+        - task_type: the job's task type.
+        - queued: when do_task() queued it.
+        - first_running: when a poll first saw it not done, None if the
+          first poll already saw it done.
+        - last_running: when a poll last saw it not done.
+        - completed: when a poll first saw it done (or FAILED).
+        - polls: status polls made.
+        - status: the last status seen.
+
+    A job finished at some point between last_running and completed, so
+    that gap is the most the client may have spent waiting on a job that
+    was already done.
+
+    With a JobHistory, the duration of every job seen done is added to it,
+    and expected_done() predicts when a queued job will be done.
+    """
+
+    def __init__(self, history=None):
+        """ Initiating instance.
+
+        Args:
+            history (JobHistory, optional): where to keep job durations
+                across runs, see spittalhistory.
+        """
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.history = history
+
+    def queued(self, job_id, task_type, at=None, input_bytes=None):
+        """ Notes that a job was queued.
+
+        Args:
+            job_id (int): ID of the job.
+            task_type (str): the job's task type.
+            at (float, optional): when it was queued, now by default.
+            input_bytes (int, optional): size of the job's input file.
+        """
+        with self.lock:
+            self.jobs[job_id] = {
+                'task_type': task_type,
+                'queued': time.time() if at is None else at,
+                'input_bytes': input_bytes,
+                'first_running': None,
+                'last_running': None,
+                'completed': None,
+                'polls': 0,
+                'status': None,
+            }
+
+    def polled(self, job_id, status, at=None):
+        """ Notes the status a poll saw, ignoring jobs queued elsewhere. """
+        if at is None:
+            at = time.time()
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job['completed'] is not None:
+                return
+            job['polls'] += 1
+            job['status'] = status
+            if status in ('done', 'FAILED'):
+                job['completed'] = at
+            else:
+                if job['first_running'] is None:
+                    job['first_running'] = at
+                job['last_running'] = at
+            job = dict(job)
+        if status == 'done' and self.history is not None:
+            self.history.record(
+                job['task_type'],
+                self.duration(job),
+                job['input_bytes']
+            )
+
+    @staticmethod
+    def duration(job):
+        """ float: best guess of how long a completed job took.
+
+        The job finished between the last poll that saw it running and the
+        one that saw it done, so the middle of that gap is taken. If the
+        first poll saw it done, all that is known is that it took no longer
+        than that.
+        """
+        if job['last_running'] is None:
+            return job['completed'] - job['queued']
+        return (job['last_running'] + job['completed']) / 2.0 - job['queued']
+
+    def expected_done(self, job_id, fraction=1.0):
+        """ Predicts when a job will be done, from the history.
+
+        Args:
+            job_id (int): ID of the job.
+            fraction (float, optional): of the expected duration to add to
+                when the job was queued.
+
+        Returns:
+            float: the expected time, None if unknown.
+        """
+        if self.history is None:
+            return None
+        job = self.job(job_id)
+        if job is None:
+            return None
+        expected = self.history.expected(job['task_type'], job['input_bytes'])
+        if expected is None:
+            return None
+        return job['queued'] + expected * fraction
+
+    def job(self, job_id):
+        """ dict: a copy of a job's record, None if it is unknown. """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def summary(self, since=None, until=None):
+        """ Sums up the completed jobs by task type.
+
+        Args:
+            since (float, optional): only jobs queued at or after this time.
+            until (float, optional): only jobs queued before this time.
+
+        Returns:
+            dict: by task type; jobs, failed, polls, total and max seconds
+            from queued to seen done, and the total possible overshoot
+            (seconds from last seen running to seen done).
+        """
+        with self.lock:
+            jobs = [dict(job) for job in self.jobs.values()]
+        summary = {}
+        for job in jobs:
+            if job['completed'] is None:
+                continue
+            if since is not None and job['queued'] < since:
+                continue
+            if until is not None and job['queued'] >= until:
+                continue
+            stats = summary.setdefault(job['task_type'], {
+                'jobs': 0,
+                'failed': 0,
+                'polls': 0,
+                'total': 0.0,
+                'max': 0.0,
+                'overshoot': 0.0,
+            })
+            took = job['completed'] - job['queued']
+            stats['jobs'] += 1
+            stats['failed'] += job['status'] == 'FAILED'
+            stats['polls'] += job['polls']
+            stats['total'] += took
+            stats['max'] = max(stats['max'], took)
+            last_running = job['last_running'] or job['queued']
+            stats['overshoot'] += job['completed'] - last_running
+        return summary
+
+    def report(self, since=None, until=None):
+        """ A text table of summary(), by total time.
+
+        Returns:
+            str: the report.
+        """
+        summary = self.summary(since, until)
+        lines = ["{task:<28} {jobs:>5} {fail:>5} {polls:>6} {mean:>9} "
+                 "{max:>9} {over:>12}".format(
+                     task="task type",
+                     jobs="jobs",
+                     fail="fail",
+                     polls="polls",
+                     mean="mean(s)",
+                     max="max(s)",
+                     over="overshoot(s)"
+                 )]
+        for task_type in sorted(summary, key=lambda t: -summary[t]['total']):
+            stats = summary[task_type]
+            lines.append(
+                "{task:<28} {jobs:>5} {fail:>5} {polls:>6} {mean:>9.2f} "
+                "{max:>9.2f} {over:>12.2f}".format(
+                    task=task_type,
+                    jobs=stats['jobs'],
+                    fail=stats['failed'],
+                    polls=stats['polls'],
+                    mean=stats['total'] / stats['jobs'],
+                    max=stats['max'],
+                    over=stats['overshoot']
+                )
+            )
+        return "\n".join(lines)
@@ -0,0 +1,391 @@
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import NewConnectionError
+import json
+import logging
+import time
+
+from .spittalmetrics import endpoint_template, body_length
+from .spittalpoll import RetryPolicy
+
+logger = logging.getLogger('spittalpond')
+
+# Seconds to wait for a connection and for the server to send anything.
+DEFAULT_TIMEOUT = (10, 300)
+
+# Endpoints that change nothing on the server, so are safe to repeat.
+SAFE_ENDPOINTS = ("statusAsync", "doTaskDownloadFileHelper", "login")
+
+class SpittalRequestError(requests.exceptions.RequestException):
+    """ Raised when the server answered a request with an error or garbage.
+
+    Attributes:
+        endpoint (str): the endpoint template, i.e. 'statusAsync'.
+        retries (int): times the request was retried.
+        may_have_applied (bool): whether a call that changes the server may
+            have taken effect despite the error, so that repeating it could
+            create a duplicate.
+    """
+
+    def __init__(self, endpoint, problem, response, retries,
+                 may_have_applied):
+        self.endpoint = endpoint
+        self.retries = retries
+        self.may_have_applied = may_have_applied
+        message = "{endpoint}: {problem} after {retries} retries".format(
+            endpoint=endpoint,
+            problem=problem,
+            retries=retries
+        )
+        if may_have_applied:
+            message += ", it may still have been applied on the server"
+        requests.exceptions.RequestException.__init__(
+            self, message, response=response
+        )
+
+def replayable(in_data, in_file_dict):
+    """ bool: whether a request body can be sent again as it is. """
+    if in_file_dict:
+        return False
+    return in_data is None or isinstance(in_data, (dict, bytes, type(u"")))
+
+def never_sent(error):
+    """ bool: whether a request failed before the server could see it. """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        reason = getattr(error.args[0], 'reason', None)
+        return isinstance(reason, NewConnectionError)
+    return False
+
+class SpittalTransport(object):
+    """ The HTTP connection to the Oasis Django mid-tier.
+
+    Holds the pooled session, and with it the login cookie, that the
+    SpittalBase subclasses make their requests through. One transport can
+    be shared by several facades (see SpittalPond) so that they all use
+    one login and one warm connection pool.
+    """
+
+    def __init__(self, base_url, pub_user, pool_connections=10,
+                 pool_maxsize=10, pool_block=False, keep_alive=True,
+                 timeout=DEFAULT_TIMEOUT, retry_policy=None):
+        """ Initiating instance.
+
+        Args:
+            base_url (str): server's domain name and/or port (without final slash).
+            pub_usr (str): the public user used to name certain things.
+            pool_connections (int, optional): number of per-host connection
+                pools to cache.
+            pool_maxsize (int, optional): max connections kept open per host.
+            pool_block (bool, optional): block when the pool is exhausted
+                rather than opening throw-away connections.
+            keep_alive (bool, optional): reuse connections between requests.
+            timeout (tuple or float, optional): seconds to wait for a
+                connection and for the server to send anything, as
+                (connect, read), one number for both or None to wait
+                forever.
+            retry_policy (RetryPolicy, optional): how failed requests are
+                retried, RetryPolicy() by default.
+        """
+        self.base_url = base_url
+        self.pub_user = pub_user
+        self.is_logged_in = False
+        self.cookies = None
+        # Called with a record of every request, see do_request().
+        self.hooks = []
+        self.timeout = timeout
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        self.session = self.create_session(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            keep_alive=keep_alive
+        )
+
+    def create_session(self, pool_connections=10, pool_maxsize=10,
+                       pool_block=False, keep_alive=True):
+        """ Creates the pooled HTTP session used by do_request.
+
+        Every endpoint method (and every wait_until_done poll) goes through
+        this one session so the TCP/TLS connections to the mid-tier are
+        reused instead of being set up again for each request.
+
+        Args:
+            pool_connections (int, optional): number of per-host connection
+                pools to cache.
+            pool_maxsize (int, optional): max connections kept open per host.
+            pool_block (bool, optional): block when the pool is exhausted
+                rather than opening throw-away connections.
+            keep_alive (bool, optional): reuse connections between requests.
+
+        Returns:
+            requests.Session: the configured session.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def close(self):
+        """ Closes all pooled connections held by this transport. """
+        self.session.close()
+
+    def add_hook(self, hook):
+        """ Adds an instrumentation hook, called after every request.
+
+        The hook is called with a dict describing the request:
+
+            - endpoint: the endpoint template, i.e. 'statusAsync'.
+            - status: the HTTP status code, None if no response came back.
+            - latency: seconds the request took, retries included. For
+              stream requests only until the headers arrived, the body is
+              read later.
+            - request_bytes: size of the request body, None if unknown.
+            - response_bytes: size of the response body. For stream
+              requests the announced Content-Length, None if unknown.
+            - retries: times the request was retried.
+            - error: name of the exception raised, None if there was none.
+
+        See spittalmetrics.RequestMetrics for a hook that aggregates them.
+
+        Args:
+            hook (callable): the hook.
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """ Removes a hook added with add_hook(). """
+        self.hooks.remove(hook)
+
+    def call_hooks(self, record):
+        """ Passes a request record to the hooks, a failing hook is logged. """
+        for hook in list(self.hooks):
+            try:
+                hook(record)
+            except Exception as exc:
+                logger.warning("Request hook {hook} failed: {error}".format(
+                    hook=hook,
+                    error=exc
+                ))
+
+    def do_request(self, url, in_data=None, in_file_dict=None, headers=None,
+                   stream=False, timeout=None, expect_json=False):
+        """ Makes a post request.
+
+        The request goes through the pooled self.session, which also holds
+        the session cookie set by do_login(). This authenticates each request.
+        Every request is passed on to the hooks, see add_hook().
+
+        A request that times out, fails to connect or gets a 5xx status is
+        retried as the retry policy allows, see should_retry(). A 5xx status
+        that is not retried raises SpittalRequestError, rather than leaving
+        the caller to choke on an error page.
+
+        Args:
+            url (str): the url to make a post request to. Ensureu that you
+                specify a schema i.e. http://, ftp:// etc...
+            in_data (dict): optional, used if data needs to be passed.
+            in_file_dict (dict): optional, passes file dict to server.
+            headers (dict): optional, extra headers for this request.
+            stream (bool): optional, leave the response body unread so that
+                it can be consumed with iter_content().
+            timeout (tuple or float): optional, overrides self.timeout.
+            expect_json (bool): optional, treat a body that is not JSON as a
+                failure, like a 5xx status.
+
+        Returns:
+            HttpResponse: server's response
+
+        Raises:
+            SpittalRequestError: if the server's answer was still an error,
+                or not JSON when expected, after any retries.
+        """
+        url_string=url
+        logger.debug(
+            "do_request request string: {string}".format(string=url_string)
+        )
+        if timeout is None:
+            timeout = self.timeout
+        endpoint = endpoint_template(url_string)
+        can_replay = replayable(in_data, in_file_dict)
+        waits = self.retry_policy.intervals()
+        retries = 0
+        start = time.time()
+        response = None
+        error = None
+        try:
+            while True:
+                response = None
+                problem = None
+                try:
+                    response=self.session.post(
+                        url_string,
+                        data=in_data,
+                        files=in_file_dict,
+                        headers=headers,
+                        stream=stream,
+                        timeout=timeout
+                    )
+                    problem = self.response_problem(
+                        response, stream, expect_json
+                    )
+                except requests.exceptions.RequestException as exc:
+                    error = exc
+                if error is None and problem is None:
+                    return response
+                if (not can_replay or
+                        retries >= self.retry_policy.retries or
+                        not self.should_retry(endpoint, error, response)):
+                    break
+                wait = next(waits)
+                logger.warning(
+                    "Retrying {endpoint} in {wait:.2f}s: {why}".format(
+                        endpoint=endpoint,
+                        wait=wait,
+                        why=error or problem
+                    )
+                )
+                if response is not None:
+                    response.close()
+                time.sleep(wait)
+                retries += 1
+                error = None
+            if error is not None:
+                raise error
+            error = SpittalRequestError(
+                endpoint,
+                problem,
+                response,
+                retries,
+                not self.is_safe(endpoint)
+            )
+            raise error
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            if self.hooks:
+                self.call_hooks(self.request_record(
+                    url_string, in_data, response, stream,
+                    time.time() - start, retries,
+                    error and error.__class__.__name__
+                ))
+
+    def response_problem(self, response, stream, expect_json):
+        """ Returns what is wrong with a response, None if nothing is.
+
+        Only 5xx statuses count, other statuses are left to the caller.
+        """
+        if response.status_code >= 500:
+            return "HTTP {status}".format(status=response.status_code)
+        if expect_json and not stream:
+            try:
+                json.loads(response.content)
+            except ValueError:
+                return "HTTP {status} with a body that is not JSON".format(
+                    status=response.status_code
+                )
+        return None
+
+    def is_safe(self, endpoint):
+        """ bool: whether calls of the endpoint are safe to repeat. """
+        return endpoint in SAFE_ENDPOINTS or (
+            self.retry_policy.retry_creates and endpoint.startswith("create")
+        )
+
+    def should_retry(self, endpoint, error, response):
+        """ Decides whether a failed request is tried again.
+
+        Safe calls (see SAFE_ENDPOINTS) are retried on timeouts, dropped
+        connections, the policy's statuses and unexpected non-JSON bodies.
+        Any other call, i.e. a create* or doTask* one, may already have
+        taken effect when it failed, and repeating it could create a
+        duplicate object or queue a job twice. It is only retried when the
+        connection could not be made, so the server never saw it.
+
+        Args:
+            endpoint (str): the endpoint template.
+            error (Exception): what the request raised, None if it got a
+                response.
+            response (HttpResponse): the response, None if there was none.
+        """
+        if never_sent(error):
+            return True
+        if not self.is_safe(endpoint):
+            return False
+        if error is not None:
+            return isinstance(error, (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError
+            ))
+        return (response.status_code < 500 or
+                response.status_code in self.retry_policy.statuses)
+
+    @staticmethod
+    def request_record(url, in_data, response, stream, latency, retries,
+                       error):
+        """ Builds the record of a request passed to the hooks. """
+        request_bytes = body_length(in_data)
+        status = None
+        response_bytes = None
+        if response is not None:
+            status = response.status_code
+            sent = response.request.headers.get('Content-Length')
+            if sent is not None:
+                request_bytes = int(sent)
+            if not stream:
+                response_bytes = len(response.content)
+            elif response.headers.get('Content-Length') is not None:
+                response_bytes = int(response.headers['Content-Length'])
+        return {
+            'endpoint': endpoint_template(url),
+            'status': status,
+            'latency': latency,
+            'request_bytes': request_bytes,
+            'response_bytes': response_bytes,
+            'retries': retries,
+            'error': error,
+        }
+
+    def do_login(self, password):
+        """ Logs into Oasis Django mid-tier.
+
+        Also, set self.cookies to the return session ID and attaches it to
+        the pooled session. This allows for future authentication.
+
+        Args:
+            password (str): server Djanger user password.
+        """
+        # Creating JSON string with authentication credentails.
+        in_data = ('{{ "username":"{username}",'
+                    '"password":"{password}" }}'
+                    ).format(
+                    username=self.pub_user,
+                    password=password
+        )
+
+        url = self.base_url + "/oasis/login"
+        response = self.do_request(url, in_data, expect_json=True)
+        json_response = json.loads(response.content)
+
+        if json_response["success"] == False:
+            print("Invalid user id or password")
+        else:
+            self.cookies = dict(sessionid=response.cookies['sessionid'])
+            # For Authentication! Attached once, sent with every request.
+            self.session.cookies.update(self.cookies)
+            self.is_logged_in = True
+            print("You are logged into Mid-tier")
+
+        logger.info( 'Log in response ' + str(response.content))
@@ -0,0 +1,458 @@
+""" Pre-flight checks of the model and exposure CSV files.
+
+Bad file contents otherwise only show up once a doTask job on the server
+has FAILED, minutes after the upload. Each file is checked against the
+schema of its type (the first two parts of its name, see
+SpittalBase.upload_directory()):
+
+    - the header and every row have the schema's number of columns,
+    - the values are numbers, whole numbers where IDs are expected,
+    - IDs are positive 32 bit integers, and key IDs are unique,
+    - probabilities are between 0 and 1,
+    - IDs that refer to another file are found in it, i.e. the
+      VULNERABILITY_IDs of exposures_main in dict_vuln.
+
+Every check works on whole columns with NumPy, and the files are read and
+checked in parallel. Each file is parsed in bounded chunks, so only its
+checked columns are held in memory. References are checked once all files are read.
+
+DEFAULT_SCHEMAS follow the Oasis kernel file layouts. Pass other schemas
+for other layouts; files of a type without a schema are not checked.
+
+Example:
+
+    >>> validate_directories("model/", "exposure/")
+"""
+import glob
+import os
+import warnings
+from multiprocessing.pool import ThreadPool
+
+from .spittalgul import require_numpy, np
+
+MAX_ID = 2 ** 31 - 1
+# Bytes of a file parsed at a time.
+CHUNK_BYTES = 16 * 2 ** 20
+
+class SpittalValidationError(Exception):
+    """ Raised when files fail their pre-flight checks.
+
+    Attributes:
+        problems (dict): the list of problems found in each file path.
+    """
+
+    def __init__(self, problems):
+        self.problems = problems
+        lines = []
+        for path in sorted(problems):
+            for problem in problems[path]:
+                lines.append("{path}: {problem}".format(
+                    path=path,
+                    problem=problem
+                ))
+        Exception.__init__(
+            self,
+            "{num} file(s) failed validation:\n{lines}".format(
+                num=len(problems),
+                lines="\n".join(lines)
+            )
+        )
+
+class FileSchema(object):
+    """ The leading columns of a file type and what they hold.
+
+    Each column is a (name, kind) or (name, kind, reference) tuple. The
+    kinds are:
+
+        - 'id': the file's key, unique positive whole numbers.
+        - 'int': whole numbers.
+        - 'float': any finite numbers.
+        - 'prob': numbers from 0 to 1.
+
+    A reference is the type name of the file whose key the values must be
+    found in.
+    """
+
+    def __init__(self, columns, extra_columns=False):
+        """ Initiating instance.
+
+        Args:
+            columns (list): the column tuples, in file order.
+            extra_columns (bool, optional): allow more columns after these,
+                i.e. descriptions. They are not checked.
+        """
+        self.columns = [tuple(column) + (None,) * (3 - len(column))
+                        for column in columns]
+        self.extra_columns = extra_columns
+
+    @property
+    def key(self):
+        """ str: name of the 'id' column, None if there is none. """
+        for name, kind, _ in self.columns:
+            if kind == 'id':
+                return name
+        return None
+
+    def describe_count(self):
+        """ str: the expected number of columns, for messages. """
+        count = len(self.columns)
+        if self.extra_columns:
+            return "at least {count}".format(count=count)
+        return str(count)
+
+    def count_ok(self, counts):
+        """ Returns which of the column counts are allowed. """
+        if self.extra_columns:
+            return counts >= len(self.columns)
+        return counts == len(self.columns)
+
+DEFAULT_SCHEMAS = {
+    "dict_areaperil": FileSchema([
+        ("AREAPERIL_ID", 'id'),
+    ], extra_columns=True),
+    "dict_damagebin": FileSchema([
+        ("BIN_INDEX", 'id'),
+        ("BIN_FROM", 'float'),
+        ("BIN_TO", 'float'),
+        ("INTERPOLATION", 'float'),
+        ("INTERVAL_TYPE", 'int'),
+    ]),
+    "dict_event": FileSchema([
+        ("EVENT_ID", 'id'),
+    ], extra_columns=True),
+    "dict_exposure": FileSchema([
+        ("ITEM_ID", 'int', "exposures_main"),
+    ], extra_columns=True),
+    "dict_hazardintensitybin": FileSchema([
+        ("BIN_INDEX", 'id'),
+    ], extra_columns=True),
+    "dict_vuln": FileSchema([
+        ("VULNERABILITY_ID", 'id'),
+    ], extra_columns=True),
+    "version_hazfp": FileSchema([
+        ("EVENT_ID", 'int', "dict_event"),
+        ("AREAPERIL_ID", 'int', "dict_areaperil"),
+        ("INTENSITY_BIN_INDEX", 'int', "dict_hazardintensitybin"),
+        ("PROB", 'prob'),
+    ]),
+    "version_vuln": FileSchema([
+        ("VULNERABILITY_ID", 'int', "dict_vuln"),
+        ("INTENSITY_BIN_INDEX", 'int', "dict_hazardintensitybin"),
+        ("DAMAGE_BIN_INDEX", 'int', "dict_damagebin"),
+        ("PROB", 'prob'),
+    ]),
+    "exposures_main": FileSchema([
+        ("ITEM_ID", 'id'),
+        ("AREAPERIL_ID", 'int', "dict_areaperil"),
+        ("VULNERABILITY_ID", 'int', "dict_vuln"),
+        ("GROUP_ID", 'int'),
+    ], extra_columns=True),
+    "correlations_main": FileSchema([
+        ("ITEM_ID", 'int', "exposures_main"),
+    ], extra_columns=True),
+}
+
+def file_type(path):
+    """ Returns the type name of a file, i.e. 'dict_vuln' for
+    dict_vuln_1.csv, or None if the name has no type in it. """
+    splitname = os.path.basename(path).replace(".", "_").split("_")
+    if len(splitname) != 4:
+        return None
+    return splitname[0] + "_" + splitname[1]
+
+def _first_line(mask):
+    """ Returns the file line number of the first row in mask, counting
+    the header as line 1. """
+    return int(np.argmax(mask)) + 2
+
+def read_columns(path, schema, chunk_bytes=CHUNK_BYTES):
+    """ Reads the schema's columns of a CSV file.
+
+    The file is read in chunks of about chunk_bytes, each ending on a line
+    break, so only the parsed values of the whole file are held at once.
+    Only the leading columns of the schema are parsed, the bytes of any
+    extra columns are masked out before parsing.
+
+    Args:
+        path (str): the CSV file.
+        schema (FileSchema): the file's schema.
+        chunk_bytes (int, optional): bytes of the file to parse at a time.
+
+    Returns:
+        tuple: (n, columns) float64 array of the values, None if they could
+        not be parsed, and the list of problems found.
+    """
+    problems = []
+    width = len(schema.columns)
+    chunks = []
+    rows = 0
+    with open(path, "rb") as f:
+        header = f.readline().strip()
+        header_count = header.count(b",") + 1
+        if not schema.count_ok(np.array([header_count])).all():
+            problems.append(
+                "header has {got} columns, expected {want}".format(
+                    got=header_count,
+                    want=schema.describe_count()
+                )
+            )
+        rest = b""
+        last = False
+        while not last:
+            chunk = f.read(chunk_bytes)
+            data = rest + chunk
+            last = len(chunk) < chunk_bytes
+            if last:
+                # The end of the file, what is left is parsed in one go.
+                data, rest = data.rstrip(), b""
+            else:
+                # Blank lines at the end of the file are not rows, so
+                # trailing whitespace waits until more of the file is read.
+                end = len(data.rstrip())
+                end = data.rfind(b"\n", 0, end) + 1
+                data, rest = data[:end], data[end:]
+            if not data:
+                continue
+            values, problem = _parse_lines(data, schema, rows)
+            if values is None:
+                problems.append(problem)
+                return None, problems
+            chunks.append(values)
+            rows += len(values)
+    if not chunks:
+        return np.zeros((0, width)), problems
+    return np.concatenate(chunks), problems
+
+def _parse_lines(data, schema, rows_before):
+    """ Parses whole lines of a CSV body.
+
+    Args:
+        data (bytes): the lines, without the header.
+        schema (FileSchema): the file's schema.
+        rows_before (int): rows of the file before these, for the line
+            numbers of problems.
+
+    Returns:
+        tuple: (n, columns) float64 array of the values and None, or None
+        and the problem found.
+    """
+    width = len(schema.columns)
+    if not data.endswith(b"\n"):
+        data += b"\n"
+    buf = np.frombuffer(data, dtype=np.uint8)
+    # Positions rather than per byte counts, the files can be large.
+    newlines = np.flatnonzero(buf == ord("\n"))
+    comma_positions = np.flatnonzero(buf == ord(","))
+    lines = len(newlines)
+    line_starts = np.concatenate([[0], newlines[:-1] + 1])
+    # Index into comma_positions of each line's first and after-last comma.
+    first_comma = np.searchsorted(comma_positions, line_starts)
+    end_comma = np.searchsorted(comma_positions, newlines)
+    commas = end_comma - first_comma
+    bad = ~schema.count_ok(commas + 1)
+    if bad.any():
+        return None, (
+            "{num} row(s) without {want} columns, first on line {line}".format(
+                num=int(bad.sum()),
+                want=schema.describe_count(),
+                line=_first_line(bad) + rows_before
+            )
+        )
+
+    if (commas >= width).any():
+        # Mask out the extra columns: keep each line up to the comma
+        # after its last checked column, and its line break.
+        cuts = newlines.copy()
+        extra = commas >= width
+        cuts[extra] = comma_positions[first_comma[extra] + width - 1]
+        marks = np.zeros(len(buf) + 1, dtype=np.int8)
+        marks[line_starts] += 1
+        marks[cuts] -= 1
+        keep = np.cumsum(marks[:-1], dtype=np.int8).view(bool)
+        keep[newlines] = True
+        text = buf[keep]
+    else:
+        text = buf.copy()
+    text[text == ord(",")] = ord(" ")
+    text = text.tobytes()
+    if not isinstance(text, str):
+        # Python 3, fromstring() wants text.
+        text = text.decode("ascii", "replace")
+    with warnings.catch_warnings():
+        # A value that is not a number ends the parse with a warning, or
+        # an error on newer NumPy.
+        warnings.simplefilter("ignore")
+        try:
+            values = np.fromstring(text, dtype=np.float64, sep=" ")
+        except ValueError:
+            values = None
+    if values is None or len(values) != lines * width:
+        line = _first_unparsable(text, width)
+        if line is not None:
+            line += rows_before
+        return None, (
+            "non-numeric or missing value on line {line}".format(line=line)
+        )
+    return values.reshape(lines, width), None
+
+def _first_unparsable(text, width):
+    """ Returns the file line number of the first row of text that does not
+    hold width numbers. Only used once a file is known to be bad. """
+    for number, line in enumerate(text.split("\n")):
+        fields = line.split()
+        try:
+            [float(field) for field in fields]
+        except ValueError:
+            return number + 2
+        if len(fields) != width:
+            return number + 2
+    return None
+
+def check_columns(values, schema):
+    """ Checks each column's values against its kind.
+
+    Args:
+        values (numpy.ndarray): the values read by read_columns().
+        schema (FileSchema): the file's schema.
+
+    Returns:
+        list: the problems found.
+    """
+    problems = []
+
+    def check(name, bad, what):
+        if bad.any():
+            problems.append(
+                "{name}: {num} value(s) {what}, first on line {line}".format(
+                    name=name,
+                    num=int(bad.sum()),
+                    what=what,
+                    line=_first_line(bad)
+                )
+            )
+            return False
+        return True
+
+    for i, (name, kind, _) in enumerate(schema.columns):
+        column = values[:, i]
+        if not check(name, ~np.isfinite(column), "not finite"):
+            continue
+        if kind == 'prob':
+            check(name, (column < 0) | (column > 1), "not from 0 to 1")
+        elif kind in ('id', 'int'):
+            if not check(name, column != np.floor(column),
+                         "not whole numbers"):
+                continue
+            if kind == 'id':
+                if not check(name, (column < 1) | (column > MAX_ID),
+                             "not IDs from 1 to {top}".format(top=MAX_ID)):
+                    continue
+                order = np.argsort(column, kind="mergesort")
+                repeats = np.zeros(len(column), dtype=bool)
+                repeats[order[1:]] = column[order[1:]] == column[order[:-1]]
+                check(name, repeats, "repeated")
+            else:
+                check(name, np.abs(column) > MAX_ID, "too big for 32 bits")
+    return problems
+
+def _read_and_check(args):
+    """ Reads and checks one file, for the worker pool. """
+    path, schema = args
+    try:
+        values, problems = read_columns(path, schema)
+    except (IOError, OSError) as exc:
+        return None, [str(exc)]
+    if values is not None:
+        problems.extend(check_columns(values, schema))
+    return values, problems
+
+def validate_files(paths, schemas=None, workers=4):
+    """ Checks files, see the module's description.
+
+    Args:
+        paths (list): paths of the files to check, named by their type.
+        schemas (dict, optional): FileSchema by type name, DEFAULT_SCHEMAS
+            by default.
+        workers (int, optional): files to read and check at once.
+
+    Returns:
+        tuple: the number of rows of each checked file path, and the list
+        of problems of each path that has any.
+    """
+    require_numpy()
+    if schemas is None:
+        schemas = DEFAULT_SCHEMAS
+    checked = [(path, file_type(path)) for path in sorted(paths)]
+    checked = [(path, name) for path, name in checked if name in schemas]
+    jobs = [(path, schemas[name]) for path, name in checked]
+    if workers > 1 and len(jobs) > 1:
+        pool = ThreadPool(min(workers, len(jobs)))
+        try:
+            results = pool.map(_read_and_check, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_read_and_check(job) for job in jobs]
+
+    rows = {}
+    problems = {}
+    values = {}
+    keys = {}
+    for (path, name), (file_values, file_problems) in zip(checked, results):
+        if file_problems:
+            problems[path] = file_problems
+        if file_values is None:
+            continue
+        rows[path] = len(file_values)
+        values[path] = file_values
+        key = schemas[name].key
+        if key is not None:
+            column = [c[0] for c in schemas[name].columns].index(key)
+            keys.setdefault(name, []).append(file_values[:, column])
+
+    # References, to the keys of all files of the referred type.
+    for path, name in checked:
+        if path not in values:
+            continue
+        for i, (column_name, _, reference) in enumerate(
+                schemas[name].columns):
+            if reference is None or reference not in keys:
+                continue
+            column = values[path][:, i]
+            missing = ~np.isin(column, np.concatenate(keys[reference]))
+            if missing.any():
+                problems.setdefault(path, []).append(
+                    "{name}: {num} value(s) not in {ref}, first {value} on "
+                    "line {line}".format(
+                        name=column_name,
+                        num=int(missing.sum()),
+                        ref=reference,
+                        value=int(column[np.argmax(missing)]),
+                        line=_first_line(missing)
+                    )
+                )
+    return rows, problems
+
+def validate_directories(*directories, **kwargs):
+    """ Checks every file of the directories together, so references from
+    exposure files to model files are checked too.
+
+    Args:
+        *directories (str): paths of the directories, with a trailing
+            slash as for upload_directory().
+        **kwargs: schemas and workers, see validate_files().
+
+    Returns:
+        dict: the number of rows of each checked file path.
+
+    Raises:
+        SpittalValidationError: if any file has problems.
+    """
+    paths = []
+    for directory in directories:
+        paths.extend(glob.glob(directory + "*"))
+    rows, problems = validate_files(paths, **kwargs)
+    if problems:
+        raise SpittalValidationError(problems)
+    return rows
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from spittalpond.spittalpond import SpittalPond
+from spittalpond.spittalserver import SpittalServer
+
+MODEL_FILES = [
+    "dict_areaperil_1.csv",
+    "dict_damagebin_1.csv",
+    "dict_event_1.csv",
+    "dict_hazardintensitybin_1.csv",
+    "dict_vuln_1.csv",
+    "version_hazfp_1.csv",
+    "version_vuln_1.csv",
+]
+EXPOSURE_FILES = [
+    "correlations_main_1.csv",
+    "dict_exposure_1.csv",
+    "exposures_main_1.csv",
+]
+
+
+@pytest.fixture
+def make_server():
+    """ Starts SpittalServers, stopped when the test ends. """
+    servers = []
+
+    def make(**settings):
+        server = SpittalServer(**settings)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.stop()
+
+
+def logged_in(server, **kwargs):
+    """ Returns a SpittalPond logged into a SpittalServer. """
+    pond = SpittalPond(server.base_url, "root", **kwargs)
+    pond.do_login("password")
+    return pond
+
+
+def job_requests(server):
+    """ int: the doTask calls that queued a job on the server. """
+    return sum(
+        stats['requests'] for endpoint, stats in server.stats.items()
+        if endpoint.startswith("doTask") and "FileHelper" not in endpoint
+    )
+
+
+def write_files(directory, names):
+    """ Writes placeholder input files, the SpittalServer does not read
+    them. Returns the directory path with a trailing slash. """
+    directory = str(directory)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for name in names:
+        with open(os.path.join(directory, name), "w") as f:
+            f.write("a,b\n")
+    return directory + os.sep
+
+
+@pytest.fixture
+def model_directory(tmpdir):
+    return write_files(tmpdir.join("model"), MODEL_FILES)
+
+
+@pytest.fixture
+def exposure_directory(tmpdir):
+    return write_files(tmpdir.join("exposure"), EXPOSURE_FILES)
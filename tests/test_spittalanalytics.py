@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from spittalpond.spittalanalytics import LossSketch
+
+QUANTILES = [0, 0.001, 0.1, 0.25, 0.5, 0.9, 0.99, 0.999, 1]
+
+
+@pytest.fixture
+def losses():
+    rng = np.random.RandomState(5)
+    values = rng.lognormal(mean=8, sigma=2.5, size=100000)
+    # Some events miss every item.
+    values[rng.rand(len(values)) < 0.05] = 0
+    return values
+
+
+def exact(values, q):
+    """ The loss the sketch estimates: the one at rank q * (n - 1). """
+    return np.sort(values)[int(q * (len(values) - 1))]
+
+
+def check_accuracy(sketch, values):
+    for q in QUANTILES:
+        want = exact(values, q)
+        got = sketch.quantile(q)
+        assert abs(got - want) <= sketch.relative_accuracy * want, q
+
+
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.05])
+def test_quantiles_within_relative_accuracy(losses, relative_accuracy):
+    sketch = LossSketch(relative_accuracy)
+    for batch in np.array_split(losses, 7):
+        sketch.add(batch)
+    assert sketch.count == len(losses)
+    assert sketch.mean() == pytest.approx(losses.mean())
+    check_accuracy(sketch, losses)
+
+
+def merged(shards):
+    sketch = LossSketch()
+    for shard in shards:
+        shard_sketch = LossSketch()
+        shard_sketch.add(shard)
+        sketch.merge(shard_sketch)
+    return sketch
+
+
+def test_merged_sketches_match_one_sketch(losses):
+    whole = LossSketch()
+    whole.add(losses)
+    sketch = merged(np.array_split(losses, 3))
+    assert sketch.count == whole.count
+    for q in QUANTILES:
+        assert sketch.quantile(q) == whole.quantile(q)
+
+
+def test_merge_shards_of_other_scales(losses):
+    # Shards of very different sizes and losses, so their buckets are
+    # offset from each other.
+    shards = [losses[:10], losses[10:50000] * 1e-3, losses[50000:] * 1e3]
+    check_accuracy(merged(shards), np.concatenate(shards))
+
+
+def test_round_trip_through_json(losses):
+    sketch = LossSketch()
+    sketch.add(losses)
+    copy = LossSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+    for q in QUANTILES:
+        assert copy.quantile(q) == sketch.quantile(q)
+
+
+def test_empty_sketch():
+    sketch = LossSketch()
+    sketch.add([])
+    assert sketch.quantile(0.5) is None
+    assert sketch.mean() is None
@@ -0,0 +1,185 @@
+import json
+import sys
+import threading
+import time
+
+import pytest
+
+from spittalpond.spittalbase import SpittalJobError
+from spittalpond.spittalfuture import (
+    JobCancelledError, JobTimeoutError, default_poller
+)
+from spittalpond.spittalpoll import BackoffPolling
+
+from conftest import logged_in
+
+FAST = BackoffPolling(initial_wait=0.02, max_wait=0.05)
+
+
+def watched(handle):
+    """ bool: whether the default poller still has the handle queued. """
+    poller = default_poller()
+    with poller.condition:
+        return any(entry[2] is handle for entry in poller.queue)
+
+
+def test_handles_finish_out_of_order(make_server):
+    server = make_server(job_durations={
+        "HazFPVersion": 0.4, "VulnVersion": 0.05, "EventDict": 0.2
+    })
+    model = logged_in(server).model
+    finished = []
+    lock = threading.Lock()
+
+    def note(handle):
+        with lock:
+            finished.append(handle.task_type)
+
+    handles = [
+        model.do_task(task_type, 1, policy=FAST)
+        for task_type in ("HazFPVersion", "VulnVersion", "EventDict")
+    ]
+    for handle in handles:
+        handle.add_done_callback(note)
+    for handle in handles:
+        assert handle.result(timeout=10)["status"] == "done"
+    assert finished == ["VulnVersion", "EventDict", "HazFPVersion"]
+    assert [handle.state() for handle in handles] == ["done"] * 3
+
+    # A callback added once the job is done is called straight away.
+    late = []
+    handles[0].add_done_callback(late.append)
+    assert late == [handles[0]]
+
+
+def test_failed_job(make_server):
+    server = make_server(
+        job_durations={"*": 0.05},
+        failures={"doTaskVulnVersion": 1}
+    )
+    handle = logged_in(server).model.do_task("VulnVersion", 1, policy=FAST)
+    with pytest.raises(SpittalJobError):
+        handle.result(timeout=10)
+    assert isinstance(handle.exception(), SpittalJobError)
+    assert handle.state() == "failed"
+
+
+def test_cancel(make_server):
+    server = make_server(job_durations={"*": 60})
+    handle = logged_in(server).model.do_task("VulnVersion", 1, policy=FAST)
+    called = []
+    handle.add_done_callback(called.append)
+    assert handle.cancel()
+    assert not handle.cancel()
+    assert handle.cancelled() and handle.done()
+    assert called == [handle]
+    with pytest.raises(JobCancelledError):
+        handle.result()
+
+
+def test_result_timeout_keeps_watching(make_server):
+    server = make_server(job_durations={"*": 0.5})
+    handle = logged_in(server).model.do_task("VulnVersion", 1, policy=FAST)
+    with pytest.raises(JobTimeoutError):
+        handle.result(timeout=0.05)
+    assert handle.state() == "running"
+    assert handle.result(timeout=10)["status"] == "done"
+
+
+def test_handle_timeout_stops_polling(make_server):
+    # A job stuck in WIP is given up on once the handle's timeout passes.
+    server = make_server(job_durations={"*": 3600})
+    handle = logged_in(server).model.do_task(
+        "VulnVersion", 1, policy=FAST, timeout=0.3
+    )
+    started = time.time()
+    with pytest.raises(JobTimeoutError):
+        handle.result(timeout=10)
+    assert time.time() - started < 5
+    assert handle.state() == "failed"
+    assert not watched(handle)
+    polls = server.stats["statusAsync"]["requests"]
+    time.sleep(0.2)
+    assert server.stats["statusAsync"]["requests"] == polls
+
+
+class AddEntries(object):
+    """ Adds and drops data_dict entries on a thread, as the facades do,
+    with threads switched often so unguarded iteration is caught out. """
+
+    def __init__(self, data_dict):
+        self.data_dict = data_dict
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+
+    def run(self):
+        n = 0
+        while not self.stop.is_set():
+            entry = {"taskId": n}
+            self.data_dict["extra{n}".format(n=n % 100)] = entry
+            entry["field{n}".format(n=n)] = n
+            if n % 100 == 99:
+                for m in range(100):
+                    self.data_dict.pop("extra{m}".format(m=m), None)
+            n += 1
+
+    def __enter__(self):
+        self.switch_interval = None
+        if hasattr(sys, "setswitchinterval"):
+            self.switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-5)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop.set()
+        self.thread.join()
+        if self.switch_interval is not None:
+            sys.setswitchinterval(self.switch_interval)
+
+
+def test_mark_job_done_while_entries_are_added(make_server):
+    model = logged_in(make_server()).model
+    for n in range(3000):
+        model.data_dict["task{n}".format(n=n)] = {"taskId": n, "job_id": n}
+    errors = []
+
+    def mark():
+        try:
+            for n in range(300):
+                model.mark_job_done(n)
+        except Exception as exc:
+            errors.append(exc)
+
+    with AddEntries(model.data_dict):
+        marker = threading.Thread(target=mark)
+        marker.start()
+        marker.join()
+    assert errors == []
+    assert model.data_dict["task299"]["job_status"] == "done"
+
+
+def test_queue_task_while_poller_checkpoints(make_server, tmpdir):
+    server = make_server(job_durations={"*": 0.02})
+    journal = str(tmpdir.join("journal.json"))
+    model = logged_in(server, journal=journal).model
+    names = ["task{n}".format(n=n) for n in range(40)]
+    model.types = dict(model.types, **dict(
+        (name, "VulnVersion") for name in names
+    ))
+    for n, name in enumerate(names):
+        model.data_dict[name] = {"taskId": n + 1}
+    for n in range(1000):
+        model.data_dict["bulk{n}".format(n=n)] = {"taskId": n}
+
+    with AddEntries(model.data_dict):
+        handles = [model.queue_task(name, policy=FAST).watch()
+                   for name in names]
+        for handle in handles:
+            handle.result(timeout=30)
+
+    with open(journal) as f:
+        saved = json.load(f)["model"]
+    for name in names:
+        assert saved[name]["job_status"] == "done"
+        assert saved[name]["job_id"] == model.data_dict[name]["job_id"]
@@ -0,0 +1,39 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from spittalpond.spittalgul import GulWriter, open_gul_table, parse_gul_rows
+
+
+def test_parse_gul_rows():
+    rows = parse_gul_rows(b"1,1,1,5.0\n1,2,1,6.5\r\n2,1,1,7.0")
+    assert rows.tolist() == [[1, 1, 1, 5.0], [1, 2, 1, 6.5], [2, 1, 1, 7.0]]
+
+
+def test_parse_gul_rows_rejects_ragged_rows():
+    # A short row then a long one still add up to four values per row.
+    with pytest.raises(ValueError) as error:
+        parse_gul_rows(b"1,1,1,5.0\n1,2,1\n2,1,1,7.0,9\n")
+    assert "2 row(s) without 4 values" in str(error.value)
+
+
+def test_parse_gul_rows_rejects_non_numbers():
+    with pytest.raises(ValueError):
+        parse_gul_rows(b"1,1,1,5.0\n1,2,1,oops\n")
+
+
+def test_gul_writer_rejects_ragged_rows(tmpdir):
+    writer = GulWriter(str(tmpdir.join("table")))
+    writer.write(b"EVENT_ID,ITEM_ID,IDX,GUL\n1,1,1,5.0\n")
+    with pytest.raises(ValueError):
+        writer.write(b"1,2,1\n2,1,1,7.0,9\n")
+
+
+def test_gul_writer_round_trip(tmpdir):
+    directory = str(tmpdir.join("table"))
+    with GulWriter(directory) as writer:
+        writer.write(b"EVENT_ID,ITEM_ID,IDX,GUL\n1,1,1,5.0\n1,")
+        writer.write(b"2,1,6.5\n2,1,1,7.0")
+    table = open_gul_table(directory)
+    assert table["event_id"].tolist() == [1, 1, 2]
+    assert table["gul"].tolist() == [5.0, 6.5, 7.0]
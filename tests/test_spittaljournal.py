@@ -0,0 +1,62 @@
+import pytest
+
+from spittalpond.spittalpoll import BackoffPolling
+
+from conftest import job_requests, logged_in
+
+FAST = BackoffPolling(initial_wait=0.02, max_wait=0.05)
+
+
+def load_model(pond, directory, wait=True):
+    pond.model.upload_directory(directory)
+    pond.model.create_model_structures()
+    return pond.model.load_models(wait=wait, policy=FAST)
+
+
+@pytest.fixture
+def journal(tmpdir):
+    return str(tmpdir.join("journal.json"))
+
+
+def test_resume_skips_done_jobs(make_server, model_directory, journal):
+    server = make_server(job_durations={"*": 0.02})
+    load_model(logged_in(server, journal=journal), model_directory)
+    jobs = job_requests(server)
+    uploads = server.stats["createFileUpload"]["requests"]
+    assert jobs > 0
+
+    pond = logged_in(server, journal=journal)
+    pond.resume()
+    load_model(pond, model_directory)
+    assert job_requests(server) == jobs
+    assert server.stats["createFileUpload"]["requests"] == uploads
+    for entry in pond.model.data_dict.values():
+        if "job_id" in entry:
+            assert entry["job_status"] == "done"
+
+
+def test_resume_waits_for_queued_jobs(make_server, model_directory, journal):
+    # The first process stops after queueing the jobs, before they finish.
+    server = make_server(job_durations={"*": 0.3})
+    load_model(logged_in(server, journal=journal), model_directory,
+               wait=False)
+    jobs = job_requests(server)
+
+    pond = logged_in(server, journal=journal)
+    pond.resume()
+    load_model(pond, model_directory)
+    assert job_requests(server) == jobs
+    statuses = [entry.get("job_status")
+                for entry in pond.model.data_dict.values()
+                if "job_id" in entry]
+    assert statuses and set(statuses) == {"done"}
+
+
+def test_without_resume_jobs_are_queued_again(make_server, model_directory,
+                                              journal):
+    server = make_server(job_durations={"*": 0.02})
+    load_model(logged_in(server, journal=journal), model_directory)
+    jobs = job_requests(server)
+
+    load_model(logged_in(server, journal=journal), model_directory)
+    assert job_requests(server) == 2 * jobs
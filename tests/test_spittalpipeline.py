@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from spittalpond.spittalpipeline import SpittalPipeline, SpittalPipelineError
+
+
+def test_run_respects_dependencies():
+    pipeline = SpittalPipeline(max_workers=4)
+    started = {}
+    lock = threading.Lock()
+
+    def stage(name, seconds):
+        def run():
+            with lock:
+                started[name] = time.time()
+            time.sleep(seconds)
+            return name
+        return run
+
+    pipeline.add_stage("model", stage("model", 0.1))
+    pipeline.add_stage("random", stage("random", 0.1))
+    pipeline.add_stage("gul", stage("gul", 0), ["model", "random"])
+    results = pipeline.run()
+
+    assert results == {"model": "model", "random": "random", "gul": "gul"}
+    # model and random ran side by side, gul only after both.
+    assert abs(started["model"] - started["random"]) < 0.09
+    assert started["gul"] >= max(started["model"], started["random"]) + 0.09
+
+
+def test_failed_stage_stops_its_dependents():
+    succeeded = []
+    pipeline = SpittalPipeline(on_success=lambda: succeeded.append(True))
+    ran = []
+
+    def fail():
+        raise IOError("upload failed")
+
+    pipeline.add_stage("upload", fail)
+    pipeline.add_stage("other", lambda: ran.append("other"))
+    pipeline.add_stage("gul", lambda: ran.append("gul"), ["upload"])
+    with pytest.raises(SpittalPipelineError) as error:
+        pipeline.run()
+
+    assert error.value.stage == "upload"
+    assert isinstance(error.value.error, IOError)
+    assert "gul" not in ran
+    assert succeeded == []
+
+
+def test_stage_raising_base_exception_does_not_hang():
+    def interrupt():
+        raise KeyboardInterrupt()
+
+    pipeline = SpittalPipeline()
+    pipeline.add_stage("first", lambda: 1)
+    pipeline.add_stage("second", interrupt, ["first"])
+    with pytest.raises(SpittalPipelineError) as error:
+        pipeline.run()
+    assert isinstance(error.value.error, KeyboardInterrupt)
+
+
+def test_history_failure_does_not_fail_the_stage():
+    class BrokenHistory(object):
+        def record(self, *args):
+            raise IOError("disk full")
+
+        def expected(self, *args):
+            return None
+
+    pipeline = SpittalPipeline(history=BrokenHistory())
+    pipeline.add_stage("only", lambda: 1)
+    assert pipeline.run() == {"only": 1}
+
+
+def test_cycle_is_rejected():
+    pipeline = SpittalPipeline()
+    pipeline.add_stage("a", lambda: 1, ["c"])
+    pipeline.add_stage("b", lambda: 1, ["a"])
+    pipeline.add_stage("c", lambda: 1, ["b"])
+    pipeline.add_stage("d", lambda: 1)
+    with pytest.raises(ValueError) as error:
+        pipeline.run()
+    assert "cycle: a, b, c" in str(error.value)
+
+
+def test_unknown_dependency_is_rejected():
+    pipeline = SpittalPipeline()
+    pipeline.add_stage("a", lambda: 1, ["missing"])
+    with pytest.raises(ValueError) as error:
+        pipeline.check()
+    assert "unknown stage missing" in str(error.value)
@@ -0,0 +1,121 @@
+import csv
+import os
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from spittalpond.spittalshard import merge_gul_files, split_exposure
+
+
+def write_csv(path, header, rows):
+    with open(str(path), "w") as f:
+        f.write(header + "\n")
+        for row in rows:
+            f.write(",".join(str(value) for value in row) + "\n")
+
+
+def read_rows(path):
+    with open(path) as f:
+        return list(csv.reader(f))[1:]
+
+
+@pytest.fixture
+def exposure(tmpdir):
+    """ An exposure of 300 items in 40 groups of uneven sizes. """
+    directory = tmpdir.mkdir("exposure")
+    rng = random.Random(3)
+    items = list(range(1, 301))
+    rng.shuffle(items)
+    groups = dict((item, 1 + int(rng.paretovariate(1.5)) % 40)
+                  for item in items)
+    write_csv(
+        directory.join("exposures_main_1.csv"),
+        "ITEM_ID,AREAPERIL_ID,VULNERABILITY_ID,GROUP_ID,TIV",
+        [(item, 1, 1, groups[item], 1000.5) for item in items]
+    )
+    write_csv(
+        directory.join("dict_exposure_1.csv"),
+        "ITEM_ID,NAME",
+        [(item, "item") for item in sorted(items)]
+    )
+    write_csv(
+        directory.join("correlations_main_1.csv"),
+        "ITEM_ID,GROUP",
+        [(item, groups[item]) for item in items if item % 3 == 0]
+    )
+    write_csv(directory.join("version_exposure_1.csv"), "ID", [(1,)])
+    return str(directory) + os.sep, groups
+
+
+def test_groups_stay_in_one_shard(exposure, tmpdir):
+    directory, groups = exposure
+    shards = split_exposure(directory, 4, str(tmpdir.join("work")))
+    assert len(shards) == 4
+
+    group_shards = {}
+    item_shards = {}
+    sizes = []
+    for shard, shard_directory in enumerate(shards):
+        rows = read_rows(shard_directory + "exposures_main_1.csv")
+        sizes.append(len(rows))
+        for row in rows:
+            item, group = int(row[0]), int(row[3])
+            assert group_shards.setdefault(group, shard) == shard
+            item_shards[item] = shard
+    assert sorted(item_shards) == sorted(groups)
+
+    # Each group went to the smallest shard so far, so no shard is more
+    # than the largest group bigger than another.
+    group_sizes = [list(groups.values()).count(group)
+                   for group in set(groups.values())]
+    assert max(sizes) - min(sizes) <= max(group_sizes)
+
+    # Rows of the other item files follow their item.
+    for shard, shard_directory in enumerate(shards):
+        for filename in ("dict_exposure_1.csv", "correlations_main_1.csv"):
+            for row in read_rows(shard_directory + filename):
+                assert item_shards[int(row[0])] == shard
+        assert read_rows(shard_directory + "version_exposure_1.csv") == [
+            ["1"]
+        ]
+
+
+def test_fewer_shards_than_asked_for_few_groups(tmpdir):
+    directory = tmpdir.mkdir("exposure")
+    write_csv(
+        directory.join("exposures_main_1.csv"),
+        "ITEM_ID,AREAPERIL_ID,VULNERABILITY_ID,GROUP_ID",
+        [(1, 1, 1, 7), (2, 1, 1, 7), (3, 1, 1, 8)]
+    )
+    shards = split_exposure(str(directory) + os.sep, 5,
+                            str(tmpdir.join("work")))
+    assert len(shards) == 2
+
+
+def test_unknown_item_is_rejected(tmpdir):
+    directory = tmpdir.mkdir("exposure")
+    write_csv(
+        directory.join("exposures_main_1.csv"),
+        "ITEM_ID,AREAPERIL_ID,VULNERABILITY_ID,GROUP_ID",
+        [(1, 1, 1, 1), (2, 1, 1, 2)]
+    )
+    write_csv(directory.join("dict_exposure_1.csv"), "ITEM_ID,NAME",
+              [(1, "item"), (5, "item")])
+    with pytest.raises(ValueError) as error:
+        split_exposure(str(directory) + os.sep, 2, str(tmpdir.join("work")))
+    assert "item 5 is not in exposures_main" in str(error.value)
+
+
+def test_merge_gul_files_orders_by_event_and_item(tmpdir):
+    header = "EVENT_ID,ITEM_ID,IDX,GUL"
+    first = tmpdir.join("first.csv")
+    second = tmpdir.join("second.csv")
+    write_csv(first, header, [(1, 1, 0, 0.5), (1, 3, 0, 0.1), (2, 1, 0, 1)])
+    write_csv(second, header, [(1, 2, 0, 0.2), (2, 2, 0, 0.3)])
+    target = str(tmpdir.join("gul.csv"))
+    assert merge_gul_files([str(first), str(second)], target) == 5
+    assert [row[:2] for row in read_rows(target)] == [
+        ["1", "1"], ["1", "2"], ["1", "3"], ["2", "1"], ["2", "2"]
+    ]
@@ -0,0 +1,61 @@
+import json
+import multiprocessing
+
+from spittalpond.spittalhistory import JobHistory
+from spittalpond.spittalstore import JsonStore
+
+
+def _write_keys(args):
+    path, prefix, count = args
+    store = JsonStore(path)
+    for i in range(count):
+        store.set("{prefix}{i}".format(prefix=prefix, i=i), i)
+        store.update("shared", {"{prefix}{i}".format(prefix=prefix, i=i): i})
+
+
+def test_set_get_delete(tmpdir):
+    path = str(tmpdir.join("store.json"))
+    store = JsonStore(path)
+    store.set("a", 1)
+    store.update("b", {"x": 1})
+    store.update("b", {"y": 2})
+    store.delete("a")
+    assert JsonStore(path).get("b") == {"x": 1, "y": 2}
+    assert JsonStore(path).keys() == ["b"]
+    assert tmpdir.listdir(lambda p: p.ext == ".tmp") == []
+
+
+def test_stores_on_one_file_keep_each_others_changes(tmpdir):
+    path = str(tmpdir.join("store.json"))
+    first = JsonStore(path)
+    second = JsonStore(path)
+    first.set("a", 1)
+    second.set("b", 2)
+    first.update("c", {"x": 1})
+    second.update("c", {"y": 2})
+    assert first.get("b") == 2
+    assert JsonStore(path).get("c") == {"x": 1, "y": 2}
+
+
+def test_processes_sharing_a_store(tmpdir):
+    path = str(tmpdir.join("store.json"))
+    pool = multiprocessing.Pool(4)
+    try:
+        pool.map(_write_keys, [(path, "p%d-" % n, 25) for n in range(4)])
+    finally:
+        pool.close()
+        pool.join()
+    with open(path) as f:
+        data = json.load(f)
+    assert len(data) == 4 * 25 + 1
+    assert len(data["shared"]) == 4 * 25
+
+
+def test_job_history_shared(tmpdir):
+    path = str(tmpdir.join("history.json"))
+    first = JobHistory(path)
+    second = JobHistory(path)
+    first.record("GUL", 10.0)
+    second.record("GUL", 20.0)
+    assert [s[0] for s in first.samples("GUL")] == [10.0, 20.0]
+    assert first.expected("GUL") == 15.0
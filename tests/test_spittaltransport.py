@@ -0,0 +1,75 @@
+import socket
+
+import pytest
+import requests
+
+from spittalpond.spittalpoll import RetryPolicy
+from spittalpond.spittaltransport import SpittalRequestError, SpittalTransport
+
+from conftest import logged_in
+
+FAST = RetryPolicy(retries=2, initial_wait=0.01)
+
+
+def transport(base_url, **kwargs):
+    """ Returns a SpittalTransport and the list its requests are noted in. """
+    records = []
+    kwargs.setdefault("retry_policy", FAST)
+    spittal_transport = SpittalTransport(base_url, "root", **kwargs)
+    spittal_transport.add_hook(records.append)
+    return spittal_transport, records
+
+
+def test_status_check_is_retried_after_read_timeout(make_server):
+    server = make_server(latency={"statusAsync": 0.5})
+    client, records = transport(server.base_url, timeout=(1, 0.1))
+    with pytest.raises(requests.exceptions.Timeout):
+        client.do_request(client.base_url + "/oasis/statusAsync/1/1/")
+    assert records[-1]["retries"] == 2
+    assert server.stats["statusAsync"]["requests"] == 3
+
+
+def test_do_task_is_not_retried_after_read_timeout(make_server):
+    # The job may have been queued, so a retry could queue it twice.
+    server = make_server(latency={"doTaskLoadVulnVersion": 0.5})
+    client, records = transport(server.base_url, timeout=(1, 0.1))
+    with pytest.raises(requests.exceptions.Timeout):
+        client.do_request(
+            client.base_url + "/oasis/doTaskLoadVulnVersion/1/1/"
+        )
+    assert records[-1]["retries"] == 0
+    assert server.stats["doTaskLoadVulnVersion"]["requests"] == 1
+
+
+def test_create_is_not_retried_after_server_error(make_server):
+    server = make_server(failures={"createFileUpload": 1.0})
+    pond = logged_in(server, retry_policy=FAST)
+    with pytest.raises(SpittalRequestError) as error:
+        pond.model.create_file_upload("a.csv", "root", 1)
+    assert error.value.may_have_applied
+    assert error.value.retries == 0
+    assert server.stats["createFileUpload"]["requests"] == 1
+
+
+def test_create_is_retried_when_allowed(make_server):
+    server = make_server(failures={"createFileUpload": 1.0})
+    policy = RetryPolicy(retries=2, initial_wait=0.01, retry_creates=True)
+    pond = logged_in(server, retry_policy=policy)
+    with pytest.raises(SpittalRequestError) as error:
+        pond.model.create_file_upload("a.csv", "root", 1)
+    assert error.value.retries == 2
+    assert server.stats["createFileUpload"]["requests"] == 3
+
+
+def test_refused_connection_is_retried_for_any_call():
+    # Nothing listens on the port, so the server never saw the call.
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    client, records = transport("http://127.0.0.1:{port}".format(port=port))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.do_request(
+            client.base_url + "/oasis/doTaskLoadVulnVersion/1/1/"
+        )
+    assert records[-1]["retries"] == 2
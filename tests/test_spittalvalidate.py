@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from spittalpond.spittalvalidate import (
+    SpittalValidationError, read_columns, validate_directories,
+    validate_files, DEFAULT_SCHEMAS
+)
+
+
+def write(directory, name, text):
+    path = str(directory.join(name))
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+
+@pytest.fixture
+def model(tmpdir):
+    """ A small model directory whose files pass every check. """
+    directory = tmpdir.mkdir("model")
+    write(directory, "dict_areaperil_1.csv", "AREAPERIL_ID,NAME\n1,a\n2,b\n")
+    write(directory, "dict_event_1.csv", "EVENT_ID\n1\n2\n3\n")
+    write(directory, "dict_hazardintensitybin_1.csv", "BIN_INDEX\n1\n2\n")
+    write(directory, "dict_vuln_1.csv", "VULNERABILITY_ID,NAME\n1,x\n2,y\n")
+    write(directory, "dict_damagebin_1.csv",
+          "BIN_INDEX,BIN_FROM,BIN_TO,INTERPOLATION,INTERVAL_TYPE\n"
+          "1,0,0.5,0.25,1\n2,0.5,1,0.75,1\n")
+    write(directory, "version_hazfp_1.csv",
+          "EVENT_ID,AREAPERIL_ID,INTENSITY_BIN_INDEX,PROB\n"
+          "1,1,1,0.5\n1,1,2,0.5\n2,2,1,1\n")
+    write(directory, "version_vuln_1.csv",
+          "VULNERABILITY_ID,INTENSITY_BIN_INDEX,DAMAGE_BIN_INDEX,PROB\n"
+          "1,1,1,1\n2,2,2,1\n")
+    return directory
+
+
+def problems_of(directory, name):
+    rows, problems = validate_files(
+        [str(path) for path in directory.listdir()]
+    )
+    return problems.get(str(directory.join(name)), [])
+
+
+def test_good_files_pass(model):
+    rows = validate_directories(str(model) + os.sep)
+    assert rows[str(model.join("version_hazfp_1.csv"))] == 3
+    assert len(rows) == 7
+
+
+def test_header_column_count(model):
+    write(model, "dict_damagebin_1.csv",
+          "BIN_INDEX,BIN_FROM,BIN_TO\n1,0,0.5,0.25,1\n")
+    assert problems_of(model, "dict_damagebin_1.csv") == [
+        "header has 3 columns, expected 5"
+    ]
+
+
+def test_ragged_rows(model):
+    write(model, "version_vuln_1.csv",
+          "VULNERABILITY_ID,INTENSITY_BIN_INDEX,DAMAGE_BIN_INDEX,PROB\n"
+          "1,1,1,1\n2,2,2\n2,2,2,1,9\n")
+    assert problems_of(model, "version_vuln_1.csv") == [
+        "2 row(s) without 4 columns, first on line 3"
+    ]
+
+
+def test_non_numeric_value(model):
+    write(model, "version_hazfp_1.csv",
+          "EVENT_ID,AREAPERIL_ID,INTENSITY_BIN_INDEX,PROB\n"
+          "1,1,1,0.5\n1,1,x,0.5\n")
+    assert problems_of(model, "version_hazfp_1.csv") == [
+        "non-numeric or missing value on line 3"
+    ]
+
+
+def test_column_values(model):
+    write(model, "dict_vuln_1.csv", "VULNERABILITY_ID,NAME\n1,x\n1,y\n")
+    write(model, "version_hazfp_1.csv",
+          "EVENT_ID,AREAPERIL_ID,INTENSITY_BIN_INDEX,PROB\n"
+          "1,1,1,0.5\n1,1,2,1.5\n")
+    write(model, "dict_damagebin_1.csv",
+          "BIN_INDEX,BIN_FROM,BIN_TO,INTERPOLATION,INTERVAL_TYPE\n"
+          "1,0,0.5,0.25,1\n2,0.5,1,0.75,1.5\n")
+    assert problems_of(model, "dict_vuln_1.csv") == [
+        "VULNERABILITY_ID: 1 value(s) repeated, first on line 3"
+    ]
+    assert problems_of(model, "version_hazfp_1.csv") == [
+        "PROB: 1 value(s) not from 0 to 1, first on line 3"
+    ]
+    assert problems_of(model, "dict_damagebin_1.csv") == [
+        "INTERVAL_TYPE: 1 value(s) not whole numbers, first on line 3"
+    ]
+
+
+def test_references_across_directories(model, tmpdir):
+    exposure = tmpdir.mkdir("exposure")
+    write(exposure, "exposures_main_1.csv",
+          "ITEM_ID,AREAPERIL_ID,VULNERABILITY_ID,GROUP_ID,TIV\n"
+          "1,1,1,1,10\n2,2,7,1,10\n3,2,7,2,10\n")
+    with pytest.raises(SpittalValidationError) as error:
+        validate_directories(str(model) + os.sep, str(exposure) + os.sep)
+    path = str(exposure.join("exposures_main_1.csv"))
+    assert error.value.problems == {path: [
+        "VULNERABILITY_ID: 2 value(s) not in dict_vuln, first 7 on line 3"
+    ]}
+
+
+def test_read_columns_in_chunks(model):
+    # Chunks that split the file mid-line read the same as one chunk.
+    path = str(model.join("version_hazfp_1.csv"))
+    schema = DEFAULT_SCHEMAS["version_hazfp"]
+    whole, problems = read_columns(path, schema)
+    chunked, chunk_problems = read_columns(path, schema, chunk_bytes=5)
+    assert problems == chunk_problems == []
+    assert (whole == chunked).all()
+    assert whole.shape == (3, 4)